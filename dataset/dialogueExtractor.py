@@ -2,11 +2,147 @@ import re
 import pdfplumber
 import os
 import glob
+import json
+import argparse
+import contextlib
+import io
+import time
+
+import repo_root  # noqa: F401
+from profiling import add_profile_argument, profile, profiled, span
+
+JACK_CUES = ("JACK", "JACK SPARROW")
+
+# Layout mode: margins cropped off every page, in points (72 per inch). Running
+# headers, page numbers and watermarks sit above and below the text block, and
+# the left scene numbers sit left of the action column (1.5 inches in).
+LAYOUT_MARGINS = {"top": 50, "bottom": 40, "left": 90, "right": 20}
+# Watermark stamped inside the text block, where cropping can't reach it
+WATERMARK_PATTERN = re.compile(r'8FLiX\.com|SCREENPLAY DATABASE')
+COLUMN_TOLERANCE = 12  # Points a line may start away from its column
+SEGMENT_GAP = 30  # A wider gap between words splits a line (e.g. right-hand scene numbers)
+
+# Sluglines and transitions that open a new scene in a screenplay
+SCENE_HEADING_PATTERN = re.compile(r'^(INT\.|EXT\.|INT/EXT|I/E\b|CUT TO|DISSOLVE TO|FADE (IN|OUT)|\[(SCENE|Scene)\b)')
+SPEECH_INDENT_TOLERANCE = 3  # Characters a speech line may start left of the speech's first line
+
+def is_character_cue(stripped):
+    """Check if a line is a character name (all caps and not too long), extensions like (O.S.) allowed."""
+    name = re.sub(r'\(.*?\)', '', stripped).strip()
+    return stripped.isupper() and len(stripped) < 30 and bool(name) and not any(c in name for c in '.,!?')
+
+def normalize_speaker(cue):
+    """Strip extensions like (CONT'D) or (O.S.) and map Jack's cues to a single name."""
+    speaker = re.sub(r'\(.*?\)', '', cue).strip()
+    return "JACK" if speaker in JACK_CUES else speaker
+
+def split_screenplay_scenes(lines, should_skip=None):
+    """
+    Group screenplay lines into scenes of (speaker, text) turns.
+
+    A scene heading starts a new scene, a character cue starts a new speech and
+    an empty line ends it, as does a line indented less than the speech (action,
+    which sits left of the dialogue column). Consecutive speeches by the same
+    character are merged. Without indentation, as in pdfplumber's plain
+    extract_text(), only empty lines end a speech, and PDFs put none between a
+    speech and the action after it; give PDF text with extract_text(layout=True).
+
+    Args:
+        lines (list): Raw screenplay lines, with their indentation
+        should_skip (callable): Optional filter for non-cue lines (watermarks, page numbers)
 
-def extract_jack_sparrow_lines(filepath, output_path):
+    Returns:
+        list: Scenes as lists of (speaker, text) tuples
+    """
+    scenes = []
+    turns = []
+    speaker = None
+    speech = []
+    speech_indent = None  # Indentation of the current speech's first line
+
+    def close_speech():
+        if speaker and speech:
+            text = ' '.join(speech)
+            if turns and turns[-1][0] == speaker:
+                turns[-1] = (speaker, f"{turns[-1][1]} {text}")
+            else:
+                turns.append((speaker, text))
+        speech.clear()
+
+    for line in lines:
+        stripped = line.strip()
+
+        if SCENE_HEADING_PATTERN.match(stripped):
+            close_speech()
+            speaker = None
+            if turns:
+                scenes.append(turns)
+                turns = []
+            continue
+
+        if is_character_cue(stripped):
+            close_speech()
+            speaker = normalize_speaker(stripped)
+            speech_indent = None
+            continue
+
+        if not stripped:
+            close_speech()
+            speaker = None
+            continue
+
+        if should_skip and should_skip(stripped):
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        if speech_indent is not None and indent < speech_indent - SPEECH_INDENT_TOLERANCE:
+            # Action after the speech, with no empty line in between
+            close_speech()
+            speaker = None
+            speech_indent = None
+            continue
+
+        # Skip parentheticals such as "(beat)" that sit between cue and speech
+        if speaker and not stripped.isupper() and not re.fullmatch(r'\(.*\)', stripped):
+            if speech_indent is None:
+                speech_indent = indent
+            speech.append(stripped)
+
+    close_speech()
+    if turns:
+        scenes.append(turns)
+
+    return scenes
+
+def write_scenes(scenes, output_path):
+    """
+    Save scenes in which Jack speaks as JSONL, one scene per line.
+
+    Returns:
+        int: Number of scenes written
+    """
+    written = 0
+    with open(output_path, 'w', encoding='utf-8') as out_file:
+        for turns in scenes:
+            if not any(speaker == "JACK" for speaker, _ in turns):
+                continue
+            scene = {
+                "id": f"scene_{written}",
+                "turns": [{"speaker": speaker, "text": text} for speaker, text in turns],
+            }
+            json.dump(scene, out_file, ensure_ascii=False)
+            out_file.write('\n')
+            written += 1
+
+    print(f"✅ Saved {written} scenes with Jack Sparrow to: {output_path}")
+    return written
+
+@profiled()
+def extract_jack_sparrow_lines(filepath, output_path, scenes_path=None):
     """
     Extract Jack Sparrow's dialogue along with the previous line from another character.
     Returns a list of tuples (previous_line, jack_line).
+    If scenes_path is given, the full scene-level dialogue is saved there as well.
     """
     dialogue_pairs = []
     with open(filepath, 'r', encoding='utf-8') as file:
@@ -25,8 +161,8 @@ def extract_jack_sparrow_lines(filepath, output_path):
             continue
             
         # Check if this is a character name (all caps and not too long)
-        if stripped.isupper() and len(stripped) < 30 and not any(c in stripped for c in '.,!?'):
-            if stripped == "JACK" or stripped == "JACK SPARROW":
+        if is_character_cue(stripped):
+            if normalize_speaker(stripped) == "JACK":
                 is_jack_talking = True
                 # If we have accumulated previous lines, join them
                 if previous_lines:
@@ -73,6 +209,9 @@ def extract_jack_sparrow_lines(filepath, output_path):
 
     print(f"Extracted {len(dialogue_pairs)} dialogue pairs with Jack Sparrow.")
 
+    if scenes_path:
+        write_scenes(split_screenplay_scenes(lines), scenes_path)
+
 def clean_jack_line(raw_line):
     # Remove action descriptions in square brackets
     line = re.sub(r'\[.*?\]', '', raw_line)
@@ -88,9 +227,11 @@ def clean_jack_line(raw_line):
     line = re.sub(r'\s+', ' ', line).strip()
     return line
 
-def process_jack_script_file(input_path, output_path):
+@profiled()
+def process_jack_script_file(input_path, output_path, scenes_path=None):
     """
     Process the script file to extract dialogue pairs where Jack responds to another character.
+    If scenes_path is given, the full scene-level dialogue is saved there as well.
     """
     dialogue_pairs = []
     with open(input_path, 'r', encoding='utf-8') as infile:
@@ -119,10 +260,52 @@ def process_jack_script_file(input_path, output_path):
 
     print(f"✅ Processed {len(dialogue_pairs)} dialogue pairs to: {output_path}")
 
-def extract_clean_jack_dialogue(pdf_path, output_path):
+    if scenes_path:
+        write_scenes(split_transcript_scenes(lines), scenes_path)
+
+def split_transcript_scenes(lines):
+    """
+    Group "Name : line" transcript lines into scenes of (speaker, text) turns.
+    Scene headings and empty lines start a new scene.
+    """
+    scenes = []
+    turns = []
+
+    for line in lines:
+        match = re.match(r'^\s*([A-Za-z][\w .\'-]*?)\s*:\s*(.+)$', line)
+        if SCENE_HEADING_PATTERN.match(line.strip()) or not line.strip():
+            if turns:
+                scenes.append(turns)
+                turns = []
+            continue
+        if not match:
+            continue
+
+        speaker = normalize_speaker(match.group(1).upper())
+        text = clean_jack_line(match.group(2))
+        if not text:
+            continue
+        if turns and turns[-1][0] == speaker:
+            turns[-1] = (speaker, f"{turns[-1][1]} {text}")
+        else:
+            turns.append((speaker, text))
+
+    if turns:
+        scenes.append(turns)
+
+    return scenes
+
+@profiled()
+def extract_clean_jack_dialogue(pdf_path, output_path, scenes_path=None, layout=False):
     """
     Extract Jack Sparrow's dialogue along with the previous line from another character from a PDF.
+    If scenes_path is given, the full scene-level dialogue is saved there as well.
+    With layout=True the page geometry is used instead of the text filters (see extract_layout_dialogue).
     """
+    if layout:
+        return extract_layout_dialogue(pdf_path, output_path, scenes_path)
+
+    all_lines = []
     dialogue_pairs = []
     collecting = False
     buffer = []
@@ -147,11 +330,27 @@ def extract_clean_jack_dialogue(pdf_path, output_path):
                 return True
         return False
     
+    def is_margin(line):
+        """Check if a layout line is empty or a header, footer or page number (an all caps line may be a cue)."""
+        stripped = line.strip()
+        return not stripped or (should_filter_line(stripped) and not re.fullmatch(r'[A-Z\s]+', stripped))
+    
     print(f"Opening PDF: {pdf_path}")
     with pdfplumber.open(pdf_path) as pdf:
         for page_num, page in enumerate(pdf.pages, 1):
             print(f"\nProcessing page {page_num}...")
-            lines = page.extract_text().split('\n')
+            with span("pdfplumber.extract_text"):
+                lines = page.extract_text().split('\n')
+            if scenes_path:
+                # Scenes need the indentation to tell a speech from the action after it
+                with span("pdfplumber.extract_text_layout"):
+                    layout_lines = page.extract_text(layout=True).split('\n')
+                # Empty lines in the margins would end a speech running over the page
+                while layout_lines and is_margin(layout_lines[0]):
+                    layout_lines.pop(0)
+                while layout_lines and is_margin(layout_lines[-1]):
+                    layout_lines.pop()
+                all_lines.extend(layout_lines)
             
             for line_num, line in enumerate(lines, 1):
                 stripped = line.strip()
@@ -161,8 +360,8 @@ def extract_clean_jack_dialogue(pdf_path, output_path):
                     continue
                 
                 # Check if this is a character name (all caps and not too long)
-                if stripped.isupper() and len(stripped) < 30 and not any(c in stripped for c in '.,!?'):
-                    if stripped == "JACK" or stripped == "JACK SPARROW":
+                if is_character_cue(stripped):
+                    if normalize_speaker(stripped) == "JACK":
                         # If we have accumulated previous lines, join them
                         if previous_lines:
                             prev_text = ' '.join(previous_lines)
@@ -215,8 +414,225 @@ def extract_clean_jack_dialogue(pdf_path, output_path):
     print(f"Total dialogue pairs extracted: {len(dialogue_pairs)}")
     print(f"✅ Extracted {len(dialogue_pairs)} dialogue pairs to: {output_path}")
 
+    if scenes_path:
+        write_scenes(split_screenplay_scenes(all_lines, should_skip=should_filter_line), scenes_path)
+
     return dialogue_pairs
 
+def page_segments(page, margins=LAYOUT_MARGINS):
+    """
+    Text runs of a page as (x0, text) tuples, top to bottom, with the margins cropped off.
+
+    Words on the same line form one run unless a wide gap separates them, so a
+    scene number printed at the right edge becomes a run of its own.
+    """
+    with span("pdfplumber.extract_words"):
+        body = page.within_bbox((margins["left"], margins["top"],
+                                 page.width - margins["right"], page.height - margins["bottom"]))
+        words = body.extract_words()
+    runs = []
+    line_top = None
+    last_x1 = None
+    for word in words:
+        if line_top is not None and abs(word["top"] - line_top) <= 3 and word["x0"] - last_x1 <= SEGMENT_GAP:
+            runs[-1][1].append(word["text"])
+        else:
+            runs.append((word["x0"], [word["text"]]))
+            line_top = word["top"]
+        last_x1 = word["x1"]
+
+    segments = []
+    for x0, words in runs:
+        text = ' '.join(words)
+        if not WATERMARK_PATTERN.search(text):
+            segments.append((x0, text))
+    return segments
+
+def find_columns(segments):
+    """
+    Locate the action, dialogue and character cue columns from where text runs start.
+
+    Screenplay elements are left-aligned at fixed indents, so the common
+    starting positions are the columns: action is the leftmost one, cues are
+    the busiest one made up mostly of cue-like runs, and dialogue is the
+    busiest one in between.
+
+    Args:
+        segments (list): (x0, text) tuples of the whole document
+
+    Returns:
+        dict: "action", "dialogue" and "cue" x positions in points
+
+    Raises:
+        ValueError: If the runs don't line up in screenplay columns
+    """
+    buckets = {}
+    for x0, text in segments:
+        buckets.setdefault(round(x0 / 4) * 4, []).append(text)
+    common = sorted(x for x, texts in buckets.items() if len(texts) >= 0.02 * len(segments))
+    if len(common) < 3:
+        raise ValueError(f"No screenplay columns found (line starts at {common})")
+
+    action = common[0]
+    cue_columns = [x for x in common[1:]
+                   if sum(is_character_cue(text) for text in buckets[x]) > 0.5 * len(buckets[x])]
+    cue = max(cue_columns, key=lambda x: len(buckets[x]), default=None)
+    between = [x for x in common if cue is not None and action < x < cue]
+    if not between:
+        raise ValueError(f"No dialogue and cue columns found (line starts at {common})")
+    dialogue = max(between, key=lambda x: len(buckets[x]))
+    return {"action": action, "dialogue": dialogue, "cue": cue}
+
+def layout_scenes(segments, columns):
+    """
+    Group positioned text runs into scenes of (speaker, text) turns.
+
+    Same structure as split_screenplay_scenes, but a run is a cue, dialogue or
+    action by the column it starts in. Runs in no column (transitions,
+    right-hand scene numbers, "(CONTINUED)") are ignored.
+
+    Returns:
+        list: Scenes as lists of (speaker, text) tuples
+    """
+    scenes = []
+    turns = []
+    speaker = None
+    speech = []
+    in_parenthetical = False
+
+    def close_speech():
+        if speaker and speech:
+            text = ' '.join(speech)
+            if turns and turns[-1][0] == speaker:
+                turns[-1] = (speaker, f"{turns[-1][1]} {text}")
+            else:
+                turns.append((speaker, text))
+        speech.clear()
+
+    for x0, text in segments:
+        if SCENE_HEADING_PATTERN.match(text):
+            close_speech()
+            speaker = None
+            if turns:
+                scenes.append(turns)
+                turns = []
+        elif abs(x0 - columns["cue"]) <= COLUMN_TOLERANCE:
+            close_speech()
+            # "(MORE)" at a page break normalizes to nothing; the "(CONT'D)" cue after it resumes the speech
+            speaker = normalize_speaker(text) or None
+            in_parenthetical = False
+        elif columns["dialogue"] - COLUMN_TOLERANCE <= x0 < columns["cue"] - COLUMN_TOLERANCE:
+            # Parentheticals such as "(beat)" are indented a little further and may wrap
+            if in_parenthetical or text.startswith('('):
+                in_parenthetical = ')' not in text
+            elif speaker:
+                speech.append(text)
+        elif abs(x0 - columns["action"]) <= COLUMN_TOLERANCE:
+            close_speech()
+            speaker = None
+
+    close_speech()
+    if turns:
+        scenes.append(turns)
+
+    return scenes
+
+def scene_pairs(scenes):
+    """(previous line, Jack's line) for every turn in which Jack answers another character."""
+    return [(prev_text, text)
+            for turns in scenes
+            for (_, prev_text), (speaker, text) in zip(turns, turns[1:])
+            if speaker == "JACK"]
+
+def extract_layout_dialogue(pdf_path, output_path, scenes_path=None, margins=LAYOUT_MARGINS):
+    """
+    Layout-aware variant of extract_clean_jack_dialogue.
+
+    The margins holding headers, footers, watermarks and scene numbers are
+    cropped off before any text is extracted, and every line is classified by
+    the column it starts in (see find_columns), so character cues are found
+    by their indentation instead of by being upper case.
+
+    Args:
+        pdf_path (str): Screenplay PDF
+        output_path (str): Pairs file, "previous line / Jack's line / blank line"
+        scenes_path (str): Optional JSONL of the scenes in which Jack speaks
+        margins (dict): Points cropped off the "top", "bottom", "left" and "right" of every page
+
+    Returns:
+        list: (previous_line, jack_line) tuples
+    """
+    print(f"Opening PDF: {pdf_path}")
+    with pdfplumber.open(pdf_path) as pdf:
+        segments = [segment for page in pdf.pages for segment in page_segments(page, margins)]
+
+    columns = find_columns(segments)
+    print(f"Columns at x = {columns['action']} (action), {columns['dialogue']} (dialogue), {columns['cue']} (cues)")
+    scenes = layout_scenes(segments, columns)
+    dialogue_pairs = scene_pairs(scenes)
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for prev_line, jack_line in dialogue_pairs:
+            out.write(f"{prev_line}\n{jack_line}\n\n")
+    print(f"✅ Extracted {len(dialogue_pairs)} dialogue pairs to: {output_path}")
+
+    if scenes_path:
+        write_scenes(scenes, scenes_path)
+
+    return dialogue_pairs
+
+def read_pairs(path):
+    """(previous_line, jack_line) tuples from a pairs file written by the extractors."""
+    with open(path, 'r', encoding='utf-8') as f:
+        blocks = f.read().split('\n\n')
+    return [tuple(block.strip().split('\n', 1)) for block in blocks if '\n' in block.strip()]
+
+def pair_key(jack_line):
+    return ' '.join(re.findall(r"[\w']+", jack_line.lower()))
+
+def benchmark_extraction(pdf_path, reference_path=None):
+    """
+    Time the text and layout extraction of a PDF and compare the pairs they find.
+
+    Jack's lines are compared lowercased and without punctuation. With a
+    hand-checked reference pairs file, each mode also gets its precision and
+    recall against it.
+
+    Returns:
+        dict: Page count, per mode the pages/sec and pair count (plus precision
+              and recall), and the number of Jack lines both modes found
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        pages = len(pdf.pages)
+    reference = {pair_key(jack) for _, jack in read_pairs(reference_path)} if reference_path else None
+
+    results = {"pages": pages}
+    found = {}
+    for mode in ("text", "layout"):
+        start = time.perf_counter()
+        # The text path prints every page and pair: keep that cost, drop the noise
+        with contextlib.redirect_stdout(io.StringIO()):
+            pairs = extract_clean_jack_dialogue(pdf_path, os.devnull, layout=(mode == "layout"))
+        seconds = time.perf_counter() - start
+        found[mode] = {pair_key(jack) for _, jack in pairs}
+        results[mode] = {"seconds": seconds, "pages_per_second": pages / seconds, "pairs": len(pairs)}
+        if reference is not None:
+            hits = len(found[mode] & reference)
+            results[mode]["precision"] = hits / len(found[mode]) if found[mode] else 0.0
+            results[mode]["recall"] = hits / len(reference) if reference else 0.0
+    results["agreeing"] = len(found["text"] & found["layout"])
+    return results
+
+def print_benchmark(results):
+    print(f"{results['pages']} pages")
+    for mode in ("text", "layout"):
+        r = results[mode]
+        line = f"{mode:<7}{r['pages_per_second']:>8.1f} pages/s {r['pairs']:>6} pairs"
+        if "precision" in r:
+            line += f"   precision {r['precision']:.2f}, recall {r['recall']:.2f}"
+        print(line)
+    print(f"Jack lines found by both: {results['agreeing']}")
+
 # Example usage
 # ("..\\res\\dead_men_tell_no_tales.pdf", "..\\res\\jack_gpt2_dead_men_tell_no_tales.txt")
 # join_split_lines("..\\res\\jack_gpt2_dead_men_tell_no_tales.txt", "..\\res\\jack_gpt2_dead_men_tell_no_tales.txt")
@@ -301,7 +717,19 @@ def merge_jack_dialogue_files(input_dir, output_file):
 #extract_jack_sparrow_lines("..\\res\\inputPirates1.txt", "..\\res\\jack_llama_curse_of_black_pearl.txt")
 #process_jack_script_file("..\\res\\inputCurseOfTheBlackPearls.txt", "..\\res\\jack_llama_curse_of_black_pearl_2.txt")
 
-extract_clean_jack_dialogue("..\\res\\on_strager_tides.pdf", "..\\res\\jack_llama_stranger_tides.txt")
-extract_clean_jack_dialogue("..\\res\\at_worlds_end.pdf", "..\\res\\jack_llama_at_worlds_end.txt")
-extract_clean_jack_dialogue("..\\res\\dead_men_tell_no_tales.pdf", "..\\res\\jack_llama_dead_men_tell_no_tales.txt")
-merge_jack_dialogue_files("..\\res", "..\\res\\jack_llama_all_text.txt")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract Jack Sparrow's dialogue from the screenplay PDFs.")
+    parser.add_argument("--layout", action="store_true", help="Crop margins and find cues by indentation")
+    parser.add_argument("--benchmark", metavar="PDF", help="Compare the text and layout extraction of one PDF")
+    parser.add_argument("--reference", help="Hand-checked pairs file for --benchmark precision/recall")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile(args.profile, memory=args.profile_memory):
+        if args.benchmark:
+            print_benchmark(benchmark_extraction(args.benchmark, args.reference))
+        else:
+            extract_clean_jack_dialogue("..\\res\\on_strager_tides.pdf", "..\\res\\jack_llama_stranger_tides.txt", "..\\res\\jack_scenes_stranger_tides.jsonl", layout=args.layout)
+            extract_clean_jack_dialogue("..\\res\\at_worlds_end.pdf", "..\\res\\jack_llama_at_worlds_end.txt", "..\\res\\jack_scenes_at_worlds_end.jsonl", layout=args.layout)
+            extract_clean_jack_dialogue("..\\res\\dead_men_tell_no_tales.pdf", "..\\res\\jack_llama_dead_men_tell_no_tales.txt", "..\\res\\jack_scenes_dead_men_tell_no_tales.jsonl", layout=args.layout)
+            merge_jack_dialogue_files("..\\res", "..\\res\\jack_llama_all_text.txt")
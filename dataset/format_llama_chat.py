@@ -1,8 +1,14 @@
 import re
 import random
 import json
+import glob
+import os
+import argparse
 from datasets import Dataset
 
+import repo_root  # noqa: F401
+from profiling import add_profile_argument, profile, profiled, span
+
 # Special tokens for Llama chat format
 BOS = "<s>"
 EOS = "</s>"
@@ -11,6 +17,10 @@ INST_END = "[/INST]"
 SYS = "<<SYS>>"
 SYS_END = "<</SYS>>"
 
+# Rough token estimate for the Llama 3.1 template when no tokenizer is given
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 5  # <|start_header_id|>role<|end_header_id|>\n\n ... <|eot_id|>
+
 # Jack's characteristic phrases and responses
 JACK_PHRASES = [
     "Savvy?",
@@ -97,6 +107,7 @@ def is_valid_dialogue(line):
         
     return True
 
+@profiled()
 def format_sharegpt(input_file, output_file):
     """
     Format the dialogue data in ShareGPT format.
@@ -105,7 +116,7 @@ def format_sharegpt(input_file, output_file):
         input_file (str): Path to the raw dialogue file
         output_file (str): Path to save the formatted dialogue
     """
-    with open(input_file, 'r', encoding='utf-8') as f:
+    with span("io.read"), open(input_file, 'r', encoding='utf-8') as f:
         lines = f.readlines()
     
     conversations = []
@@ -152,14 +163,113 @@ def format_sharegpt(input_file, output_file):
         conversations.append(conversation)
     
     # Save as JSONL file
-    with open(output_file, 'w', encoding='utf-8') as out_file:
+    with span("io.write"), open(output_file, 'w', encoding='utf-8') as out_file:
         for conversation in conversations:
             json.dump(conversation, out_file, ensure_ascii=False)
             out_file.write('\n')
 
     print(f"✅ Saved {len(conversations)} ShareGPT-style conversations to {output_file}")
 
+def estimate_tokens(text):
+    """Estimate the token count of a message rendered with the Llama 3.1 template."""
+    return len(text) // CHARS_PER_TOKEN + 1 + TOKENS_PER_MESSAGE
+
+def scene_to_exchanges(turns):
+    """
+    Turn a scene's (speaker, text) turns into (human, assistant) exchanges.
+
+    Everything said by other characters between two of Jack's lines becomes one
+    human message; when several characters speak, each line is prefixed with the
+    speaker's name. Lines before any prompt and after Jack's last line are dropped.
+    """
+    exchanges = []
+    pending = []
+
+    for turn in turns:
+        if turn["speaker"] == "JACK":
+            if pending:
+                speakers = {speaker for speaker, _ in pending}
+                if len(speakers) > 1:
+                    human = '\n'.join(f"{speaker.title()}: {text}" for speaker, text in pending)
+                else:
+                    human = ' '.join(text for _, text in pending)
+                exchanges.append((human, turn["text"]))
+                pending = []
+        else:
+            pending.append((turn["speaker"], turn["text"]))
+
+    return exchanges
+
+@profiled()
+def format_sharegpt_multiturn(input_files, output_file, max_tokens=1024, count_tokens=estimate_tokens):
+    """
+    Assemble multi-turn ShareGPT conversations from scene-level dialogue.
+
+    Consecutive exchanges from a scene are packed into one conversation until the
+    token budget is reached, then a new conversation continues the scene.
+
+    Args:
+        input_files (str or list): Scene JSONL file(s) written by the dialogue extractor
+        output_file (str): Path to save the formatted conversations
+        max_tokens (int): Token budget per conversation
+        count_tokens (callable): Token counter for a single message
+    """
+    if isinstance(input_files, str):
+        input_files = [input_files]
+
+    conversations = []
+    total_exchanges = 0
+
+    def add_conversation(messages):
+        conversations.append({
+            "id": f"jack_multi_{len(conversations)}",
+            "conversations": messages,
+        })
+
+    for input_file in input_files:
+        with span("io.read"), open(input_file, 'r', encoding='utf-8') as f:
+            scenes = [json.loads(line) for line in f if line.strip()]
+
+        for scene in scenes:
+            messages = []
+            used_tokens = 0
+
+            for human_line, jack_line in scene_to_exchanges(scene["turns"]):
+                cost = count_tokens(human_line) + count_tokens(jack_line)
+                # An exchange that alone exceeds the budget still gets its own conversation
+                if messages and used_tokens + cost > max_tokens:
+                    add_conversation(messages)
+                    messages = []
+                    used_tokens = 0
+
+                messages.append({"from": "human", "value": human_line})
+                messages.append({"from": "assistant", "value": jack_line})
+                used_tokens += cost
+                total_exchanges += 1
+
+            if messages:
+                add_conversation(messages)
+
+    # Save as JSONL file
+    with span("io.write"), open(output_file, 'w', encoding='utf-8') as out_file:
+        for conversation in conversations:
+            json.dump(conversation, out_file, ensure_ascii=False)
+            out_file.write('\n')
+
+    average_turns = total_exchanges / len(conversations) if conversations else 0
+    print(f"✅ Saved {len(conversations)} multi-turn conversations ({total_exchanges} exchanges, "
+          f"{average_turns:.1f} per conversation) to {output_file}")
+
 if __name__ == "__main__":
-    input_file = "..\\res\\jack_llama_all_text.txt"
-    output_file = "..\\res\\jack_sharegpt_dataset.jsonl"
-    format_sharegpt(input_file, output_file) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Format the extracted dialogue as ShareGPT conversations.")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile(args.profile, memory=args.profile_memory):
+        input_file = "..\\res\\jack_llama_all_text.txt"
+        output_file = "..\\res\\jack_sharegpt_dataset.jsonl"
+        format_sharegpt(input_file, output_file)
+
+        scene_files = glob.glob(os.path.join("..\\res", "jack_scenes_*.jsonl"))
+        if scene_files:
+            format_sharegpt_multiturn(scene_files, "..\\res\\jack_sharegpt_multiturn.jsonl") 
\ No newline at end of file
@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+
+from format_llama_chat import PROMPTS, CONTEXTS
+
+import repo_root  # noqa: F401
+from llama_template import STOP_SEQUENCES, render_prompt as render_messages
+
+MAX_ANSWER_WORDS = 120  # Longer answers ramble instead of replying
+# The model writing a script ("Jack: ...", "User: ...") instead of answering
+ROLE_PREFIX_PATTERN = re.compile(r'^\s*(captain\s+)?(jack(\s+sparrow)?|user|human|assistant|system)\s*:',
+                                 re.IGNORECASE | re.MULTILINE)
+URL_PATTERN = re.compile(r'https?://|www\.|\.(com|org|net)\b', re.IGNORECASE)
+STAGE_DIRECTION_PATTERN = re.compile(r'\*[^*]+\*|\([a-z][^)]*\)')  # *grins*, (laughs)
+
+def is_valid_answer(response):
+    """Check that a generated answer is a single spoken reply of Jack's."""
+    words = response.split()
+    if not words or len(words) > MAX_ANSWER_WORDS:
+        return False
+    if "<|" in response or ROLE_PREFIX_PATTERN.search(response):
+        return False
+    if URL_PATTERN.search(response) or re.search(r'\d', response):
+        return False
+    return not STAGE_DIRECTION_PATTERN.search(response)
+
+def build_prompts():
+    """Every CONTEXTS x PROMPTS combination as a user message."""
+    return [f"{context}. {prompt}" for context in CONTEXTS for prompt in PROMPTS]
+
+def write_prompt_file(path, prompts):
+    with open(path, 'w', encoding='utf-8') as f:
+        for prompt in prompts:
+            f.write(prompt + '\n')
+    print(f"✅ Wrote {len(prompts)} prompts to {path}")
+
+def read_prompt_file(path):
+    """One prompt per line, or JSONL with a "prompt" field."""
+    prompts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                prompts.append(json.loads(line)["prompt"] if line.startswith('{') else line)
+    return prompts
+
+def prompt_id(prompt, sample):
+    return hashlib.sha1(f"{sample}:{prompt}".encode("utf-8")).hexdigest()[:16]
+
+def normalize(text):
+    """Lowercase words only, so responses differing in punctuation count as duplicates."""
+    return ' '.join(re.findall(r"[a-z']+", text.lower()))
+
+def render_prompt(prompt):
+    return render_messages([{"role": "user", "content": prompt}])
+
+class HFGenerator:
+    """Batched sampling with transformers: prompts of similar length are decoded together."""
+
+    def __init__(self, model_path, batch_size, max_new_tokens, temperature):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+        self.model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=dtype)
+        self.model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        eos_ids = [self.tokenizer.eos_token_id, self.tokenizer.convert_tokens_to_ids("<|eot_id|>")]
+        self.eos_ids = [i for i in eos_ids if i is not None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False  # Nothing to release, the model goes with the object
+
+    def generate(self, prompts):
+        texts = [render_prompt(p) for p in prompts]
+        inputs = self.tokenizer(texts, add_special_tokens=False, padding=True, return_tensors="pt").to(self.model.device)
+        with self.torch.inference_mode():
+            outputs = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, do_sample=True,
+                                          temperature=self.temperature, top_p=0.9,
+                                          eos_token_id=self.eos_ids, pad_token_id=self.tokenizer.pad_token_id)
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+# Per-process llama.cpp model for GGUFGenerator
+_llm = None
+_settings = None
+
+def _init_gguf_worker(model_path, n_threads, settings):
+    global _llm, _settings
+    from llama_cpp import Llama
+    _llm = Llama(model_path=model_path, n_ctx=512, n_threads=n_threads, n_gpu_layers=0, verbose=False)
+    _settings = settings
+
+def _generate_gguf(prompt):
+    output = _llm(render_prompt(prompt), max_tokens=_settings["max_new_tokens"],
+                  temperature=_settings["temperature"], top_p=0.9, stop=STOP_SEQUENCES)
+    return output["choices"][0]["text"].strip()
+
+class GGUFGenerator:
+    """
+    Parallel decoding with llama.cpp on CPU: several processes map the same GGUF
+    file and split the cores between them, each answering whole prompts. Use it
+    in a with block, or call close(), so the processes are stopped.
+    """
+
+    def __init__(self, model_path, workers, max_new_tokens, temperature):
+        n_threads = max(1, (os.cpu_count() or 1) // workers)
+        settings = {"max_new_tokens": max_new_tokens, "temperature": temperature}
+        self.pool = multiprocessing.get_context("spawn").Pool(
+            workers, initializer=_init_gguf_worker, initargs=(model_path, n_threads, settings)
+        )
+        self.batch_size = workers * 4
+
+    def generate(self, prompts):
+        return self.pool.map(_generate_gguf, prompts)
+
+    def close(self, terminate=False):
+        """Stop the worker processes; with terminate, without waiting for prompts still being answered."""
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+        return False
+
+def load_seen(paths):
+    """Normalized assistant lines already present, so new ones are only kept when they are new."""
+    seen = set()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    for message in json.loads(line)["conversations"]:
+                        if message["from"] in ("assistant", "gpt"):
+                            seen.add(normalize(message["value"]))
+    return seen
+
+def load_progress(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def generate_dataset(generator, prompts, output_file, samples=1, existing=()):
+    """
+    Generate Jack's answers to prompts and append the good ones as ShareGPT JSONL.
+
+    Work is done in batches; after each batch the kept conversations are
+    appended to output_file and the ids of all attempted prompt samples to
+    output_file + ".progress", so an interrupted run resumes where it stopped.
+    Answers that fail is_valid_answer or duplicate an existing line are dropped.
+
+    Args:
+        generator: HFGenerator or GGUFGenerator
+        prompts (list): User messages
+        output_file (str): ShareGPT JSONL to append to
+        samples (int): Answers sampled per prompt
+        existing (iterable): Other ShareGPT files whose lines count as duplicates
+    """
+    progress_file = output_file + ".progress"
+    done = load_progress(progress_file)
+    seen = load_seen([output_file, *existing])
+    work = [(prompt_id(p, s), p) for s in range(samples) for p in prompts if prompt_id(p, s) not in done]
+    # Similar lengths in a batch means less padding for batched decoding
+    work.sort(key=lambda item: len(item[1]))
+    print(f"{len(work)} prompt samples to generate ({len(done)} already done)")
+
+    counts = {"kept": 0, "invalid": 0, "duplicate": 0}
+    start = time.perf_counter()
+    for i in range(0, len(work), generator.batch_size):
+        batch = work[i:i + generator.batch_size]
+        responses = generator.generate([p for _, p in batch])
+
+        kept = []
+        for (item_id, prompt), response in zip(batch, responses):
+            key = normalize(response)
+            if not key or not is_valid_answer(response):
+                counts["invalid"] += 1
+            elif key in seen:
+                counts["duplicate"] += 1
+            else:
+                seen.add(key)
+                counts["kept"] += 1
+                kept.append({
+                    "id": f"jack_synth_{item_id}",
+                    "conversations": [
+                        {"from": "human", "value": prompt},
+                        {"from": "assistant", "value": response},
+                    ],
+                })
+
+        # Conversations first, so a crash in between only regenerates a batch
+        with open(output_file, 'a', encoding='utf-8') as out_file:
+            for conversation in kept:
+                json.dump(conversation, out_file, ensure_ascii=False)
+                out_file.write('\n')
+        with open(progress_file, 'a', encoding='utf-8') as f:
+            f.write(''.join(item_id + '\n' for item_id, _ in batch))
+
+        finished = i + len(batch)
+        rate = finished / (time.perf_counter() - start)
+        print(f"{finished}/{len(work)} done, {counts['kept']} kept, {counts['invalid']} invalid, "
+              f"{counts['duplicate']} duplicates ({rate:.1f} prompts/s)")
+
+    print(f"✅ Saved {counts['kept']} new conversations to {output_file}")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Jack Sparrow dialogue in batches.")
+    parser.add_argument("--model", help="Merged Hugging Face model directory, or a .gguf file for llama.cpp")
+    parser.add_argument("--prompts", default="..\\res\\synthetic_prompts.txt", help="One prompt per line")
+    parser.add_argument("--write-prompts", action="store_true", help="Write the CONTEXTS x PROMPTS combinations to --prompts and exit")
+    parser.add_argument("--output", default="..\\res\\jack_synthetic.jsonl")
+    parser.add_argument("--dataset", default="jack_sharegpt_dataset.jsonl", help="Existing dataset used for deduplication")
+    parser.add_argument("--samples", type=int, default=2, help="Answers sampled per prompt")
+    parser.add_argument("--batch-size", type=int, default=16, help="Prompts decoded together (transformers)")
+    parser.add_argument("--workers", type=int, default=4, help="llama.cpp processes (GGUF)")
+    parser.add_argument("--max-new-tokens", type=int, default=80)
+    parser.add_argument("--temperature", type=float, default=0.9)
+    args = parser.parse_args()
+
+    if args.write_prompts:
+        write_prompt_file(args.prompts, build_prompts())
+    elif not args.model:
+        parser.error("--model is required to generate")
+    else:
+        prompts = read_prompt_file(args.prompts) if os.path.exists(args.prompts) else build_prompts()
+        if args.model.endswith(".gguf"):
+            generator = GGUFGenerator(args.model, args.workers, args.max_new_tokens, args.temperature)
+        else:
+            generator = HFGenerator(args.model, args.batch_size, args.max_new_tokens, args.temperature)
+        with generator:
+            generate_dataset(generator, prompts, args.output, args.samples, [args.dataset])
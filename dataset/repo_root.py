@@ -0,0 +1,8 @@
+"""Puts the repository root on sys.path, for modules shared by the script directories such as profiling.py."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
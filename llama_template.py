@@ -0,0 +1,23 @@
+"""
+The Llama 3.1 chat template the model is fine-tuned with, shared by the chat UI,
+the synthetic dialogue generator and the GGUF benchmark so their prompts match
+the training data.
+"""
+
+from typing import Dict, List
+
+# Unsloth's llama-3.1 template puts this header in front of every system prompt, or alone when there is none
+SYSTEM_HEADER = "Cutting Knowledge Date: December 2023\nToday Date: 26 July 2024\n\n"
+BEGIN_OF_TEXT = "<|begin_of_text|>"
+ASSISTANT_START = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+END_OF_TURN = "<|eot_id|>"
+STOP_SEQUENCES = [END_OF_TURN, "<|start_header_id|>"]
+
+def render_message(role: str, content: str) -> str:
+    """Render one message with the Llama 3.1 chat template."""
+    return f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}{END_OF_TURN}"
+
+def render_prompt(messages: List[Dict], system: str = "") -> str:
+    """Render {"role", "content"} messages after the system header, up to the start of the assistant's answer."""
+    return (BEGIN_OF_TEXT + render_message("system", SYSTEM_HEADER + system)
+            + "".join(render_message(m["role"], m["content"]) for m in messages) + ASSISTANT_START)
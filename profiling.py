@@ -0,0 +1,258 @@
+"""
+Profiling shared by the dataset scripts and the chat UI.
+
+`--profile [DIR]` on dialogueExtractor.py, format_llama_chat.py,
+chat_ui.py and chat_cli.py runs every stage (a function decorated with @profiled) under
+cProfile, samples its call stacks, and writes to DIR:
+* <stage>.prof: cProfile stats, for pstats or snakeviz
+* <stage>.collapsed: sampled stacks in collapsed format, for flamegraph.pl or speedscope
+* summary.json: calls, wall/CPU time and span totals per stage
+
+`--profile-memory` adds tracemalloc, which slows down every allocation and
+so inflates the Python share of the timings; it is off by default. With it:
+* <stage>_memory.txt: the lines that allocated the Python memory still held after the stage
+* summary.json also has the peak traced memory per stage
+The snapshots and garbage collection it does around each stage are not
+counted in the stage's time.
+
+Calls into native libraries (pdfplumber's parser, llama.cpp) are wrapped in
+spans. Their time is reported separately, and the rest of the stage is
+Python overhead. In the collapsed stacks, samples taken inside a span sit
+under a "[span name]" frame.
+
+When no profiler is running, @profiled, span and span_iter cost one global lookup.
+"""
+
+import contextlib
+import cProfile
+import functools
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Iterable
+
+SAMPLE_INTERVAL = 0.01  # Seconds between stack samples; faster sampling takes the GIL from the stage
+MEMORY_TOP = 25  # Allocation sites listed per stage
+
+_active = None  # The running Profiler, None when profiling is off
+
+class Stage:
+    """Everything measured for one stage, summed over all its calls."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.span_seconds = 0.0  # Wall time in outermost spans
+        self.spans = {}  # Span name -> [count, wall seconds]
+        self.stacks = Counter()
+        self.memory = Counter()  # Allocation site -> bytes still held when the stage returned
+        self.peak_bytes = None  # Only measured with memory profiling
+
+    def add_span(self, name: str, seconds: float, outermost: bool):
+        entry = self.spans.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        if outermost:
+            self.span_seconds += seconds
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "python_seconds": self.wall_seconds - self.span_seconds,
+            "peak_traced_bytes": self.peak_bytes,
+            "samples": sum(self.stacks.values()),
+            "spans": {name: {"count": count, "seconds": seconds} for name, (count, seconds) in self.spans.items()},
+        }
+
+class Profiler:
+    def __init__(self, output_dir: str, interval: float = SAMPLE_INTERVAL, memory: bool = False):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.memory = memory  # Trace allocations with tracemalloc
+        self.stages = {}
+        self.threads = {}  # Thread id -> (Stage, span names open on that thread)
+        self.lock = threading.Lock()
+        # Only one cProfile profiler can run at a time, a concurrent stage gets samples and spans only
+        self.cprofile_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+
+    def start(self):
+        global _active
+        if self.memory:
+            tracemalloc.start()
+        self.sampler.start()
+        _active = self
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        thread_id = threading.get_ident()
+        if thread_id in self.threads:
+            # Nested stage: its time already counts towards the outer one
+            yield
+            return
+
+        with self.lock:
+            stage = self.stages.setdefault(name, Stage(name))
+        use_cprofile = self.cprofile_lock.acquire(blocking=False)
+        if self.memory:
+            before = self.snapshot()
+            tracemalloc.reset_peak()
+        self.threads[thread_id] = (stage, [])
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        if use_cprofile:
+            stage.profile.enable()
+        try:
+            yield
+        finally:
+            if use_cprofile:
+                stage.profile.disable()
+                self.cprofile_lock.release()
+            stage.wall_seconds += time.perf_counter() - start
+            stage.cpu_seconds += time.thread_time() - start_cpu
+            stage.calls += 1
+            del self.threads[thread_id]
+            if self.memory:
+                stage.peak_bytes = max(stage.peak_bytes or 0, tracemalloc.get_traced_memory()[1])
+                gc.collect()  # Count only what the stage really keeps alive, not uncollected cycles
+                for stat in self.snapshot().compare_to(before, "lineno"):
+                    if stat.size_diff:
+                        stage.memory[str(stat.traceback[0])] += stat.size_diff
+
+    def sample(self):
+        """Record the stack of every thread inside a stage, prefixed with the stage and its open spans."""
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, (stage, tags) in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                stage.stacks[";".join([stage.name, *(f"[{tag}]" for tag in list(tags)), *stack])] += 1
+
+    def close(self):
+        global _active
+        _active = None
+        self.stopped.set()
+        self.sampler.join()
+        if self.memory:
+            tracemalloc.stop()
+        self.write()
+        self.print_summary()
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, stage in self.stages.items():
+            stage.profile.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+            with open(os.path.join(self.output_dir, f"{name}.collapsed"), 'w', encoding='utf-8') as f:
+                for stack, count in stage.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            if self.memory:
+                with open(os.path.join(self.output_dir, f"{name}_memory.txt"), 'w', encoding='utf-8') as f:
+                    for site, size in stage.memory.most_common(MEMORY_TOP):
+                        f.write(f"{size / 1024:>10.1f} KiB  {site}\n")
+        with open(os.path.join(self.output_dir, "summary.json"), 'w', encoding='utf-8') as f:
+            json.dump({name: stage.summary() for name, stage in self.stages.items()}, f, indent=2)
+
+    def print_summary(self):
+        print(f"\nProfile written to {self.output_dir}")
+        print(f"{'stage / span':<36}{'calls':>7}{'wall s':>10}{'python s':>10}{'peak MiB':>10}")
+        for name, stage in self.stages.items():
+            peak = f"{stage.peak_bytes / 2**20:.1f}" if stage.peak_bytes is not None else "-"
+            print(f"{name:<36}{stage.calls:>7}{stage.wall_seconds:>10.3f}"
+                  f"{stage.wall_seconds - stage.span_seconds:>10.3f}{peak:>10}")
+            for span_name, (count, seconds) in sorted(stage.spans.items(), key=lambda item: -item[1][1]):
+                print(f"  {span_name:<34}{count:>7}{seconds:>10.3f}")
+
+class span:
+    """Tag a block, such as a call into pdfplumber or llama.cpp, so its time is reported apart from the Python around it."""
+
+    __slots__ = ("name", "state", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = None
+
+    def __enter__(self):
+        if _active is not None:
+            self.state = _active.threads.get(threading.get_ident())
+            if self.state is not None:
+                self.state[1].append(self.name)
+                self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.state is not None:
+            seconds = time.perf_counter() - self.start
+            stage, tags = self.state
+            tags.pop()
+            stage.add_span(self.name, seconds, outermost=not tags)
+            self.state = None
+        return False
+
+def span_iter(name: str, iterable: Iterable) -> Iterable:
+    """Iterate with every step in a span, for streaming calls like llama.cpp's token generator."""
+    if _active is None:
+        return iterable
+    return _span_steps(name, iter(iterable))
+
+def _span_steps(name, iterator):
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def profiled(name: str = None) -> Callable:
+    """Decorator that makes a function a profiling stage, named after the function unless name is given."""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def profile(output_dir: str = None, memory: bool = False):
+    """Profile the stages run inside the block into output_dir; does nothing when output_dir is None."""
+    if not output_dir:
+        yield None
+        return
+    profiler = Profiler(output_dir, memory=memory)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.close()
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile", nargs="?", const="profile", metavar="DIR",
+                        help="Profile the run and write the results to DIR (default: profile)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="With --profile, also trace Python allocations (slower, inflates the timings)")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts import their siblings by plain name, as when run from their own directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("dataset", "ui"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("pdfplumber")
+from dialogueExtractor import split_screenplay_scenes
+
+# As pdfplumber's extract_text(layout=True) gives it: no empty line between a speech and the action after it
+PDF_PAGE = [
+    "          INT. BLACK PEARL - DECK - NIGHT",
+    "               Jack leans on the rail, a bottle in hand.",
+    "                                   GIBBS",
+    "                         We've lost the wind, Captain.",
+    "                                   JACK (O.S.)",
+    "                              (beat)",
+    "                         Then we'll find another one,",
+    "                         savvy?",
+    "               He tosses the bottle overboard and strides off.",
+    "               Gibbs watches him go.",
+    "                                   GIBBS",
+    "                         Aye, Captain.",
+]
+
+def test_action_after_speech_is_not_dialogue():
+    scenes = split_screenplay_scenes(PDF_PAGE)
+    assert scenes == [[
+        ("GIBBS", "We've lost the wind, Captain."),
+        ("JACK", "Then we'll find another one, savvy?"),
+        ("GIBBS", "Aye, Captain."),
+    ]]
+
+def test_unindented_lines_still_end_speeches_at_empty_lines():
+    lines = ["JACK", "Why is the rum gone?", "", "Elizabeth shrugs.", "ELIZABETH", "It's gone."]
+    assert split_screenplay_scenes(lines) == [[("JACK", "Why is the rum gone?"), ("ELIZABETH", "It's gone.")]]
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("datasets")  # Through format_llama_chat
+from generate_synthetic import is_valid_answer
+
+# Lines of Jack's from the dataset, several with "the", "them", "there" or "other" in them
+JACK_LINES = [
+    "It's remarkable how often those two traits coincide.",
+    "What do you say to three shillings, and we forget the name?",
+    "Them's the rules, mate. Take what you can, give nothing back.",
+    "There's always another way out, savvy?",
+    "The problem is not the problem. The problem is your attitude about the problem.",
+    "Move!",
+]
+
+@pytest.mark.parametrize("line", JACK_LINES)
+def test_jack_lines_are_kept(line):
+    assert is_valid_answer(line)
+
+@pytest.mark.parametrize("answer", [
+    "",
+    "Jack: Aye, the rum's gone.",
+    "Aye.\nUser: And the Pearl?",
+    "Find it at www.pirates.com, mate.",
+    "I've sailed these waters for 20 years.",
+    "*grins* Savvy?",
+    "(laughs) Not likely.",
+    "Aye.<|eot_id|>",
+    "rum " * 200,
+])
+def test_generation_artifacts_are_dropped(answer):
+    assert not is_valid_answer(answer)
@@ -0,0 +1,51 @@
+import time
+
+from session_manager import SessionManager
+from stub_chat import StubChat
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_manager(tmp_path, clock, idle_check_seconds=None):
+    chat = StubChat(tokens_per_second=1e6, prompt_tokens_per_second=1e6, response_tokens=3)
+    return SessionManager(chat, spill_dir=str(tmp_path), idle_seconds=60, keep_model_state=False,
+                          idle_check_seconds=idle_check_seconds, clock=clock)
+
+def test_idle_sessions_spill_without_new_messages(tmp_path):
+    clock = FakeClock()
+    manager = make_manager(tmp_path, clock, idle_check_seconds=0.01)
+    manager.chat("a", "Where's the rum?")
+    manager.chat("b", "Savvy?")  # Switches a out into memory
+    assert manager.stats()["spilled_sessions"] == 0
+
+    clock.now += 61
+    deadline = time.monotonic() + 2
+    while manager.stats()["spilled_sessions"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.stats()["spilled_sessions"] == 1
+    assert manager.stats()["resident_sessions"] == 1  # b is still in the chat object
+
+    # The spilled session comes back with its history
+    manager.chat("a", "And the Pearl?")
+    assert len(manager.chat_model.conversation_history) == 4
+    manager.close()
+
+def test_recent_sessions_stay_resident(tmp_path):
+    clock = FakeClock()
+    manager = make_manager(tmp_path, clock)
+    manager.chat("a", "Where's the rum?")
+    manager.chat("b", "Savvy?")
+    clock.now += 59
+    manager.spill_idle()
+    assert manager.stats()["spilled_sessions"] == 0
+    manager.close()
+
+def test_stale_spills_are_cleared_on_start(tmp_path):
+    (tmp_path / "stale.pkl").write_bytes(b"from an earlier run")
+    manager = make_manager(tmp_path, FakeClock())
+    assert manager.stats()["spilled_sessions"] == 0
+    manager.close()
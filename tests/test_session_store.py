@@ -0,0 +1,25 @@
+from session_store import SessionStore
+
+def test_reads_see_queued_writes(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    session_id = store.create_session("Where's the rum?")
+    store.append_message(session_id, "user", "Where's the rum?")
+    store.append_message(session_id, "assistant", "Gone, mate.")
+    # No flush in between: the reads wait for the writer
+    assert [s["message_count"] for s in store.list_sessions()] == [2]
+    assert [m["content"] for m in store.load_messages(session_id)] == ["Where's the rum?", "Gone, mate."]
+    store.close()
+
+def test_model_state_round_trip(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path)
+    session_id = store.create_session("Savvy?")
+    state = {"history_start": 2, "adapter": "jack", "llama_state": b"\x00" * 1024}
+    store.save_model_state(session_id, 2, state)
+    store.close()
+
+    # Resuming happens in a later run
+    store = SessionStore(path)
+    assert store.load_model_state(session_id) == (2, state)
+    assert store.load_model_state("unknown") is None
+    store.close()
@@ -0,0 +1,188 @@
+"""Export GGUF quantizations and compare their speed and quality on CPU.
+
+For every `*.gguf` file in the export directory this measures, with
+llama.cpp on CPU only:
+
+* load time and file size
+* resident memory after loading and after generating
+* prompt and generation tokens/sec on a few fixed prompts
+* perplexity of Jack's held-out lines from `jack_sharegpt_dataset.jsonl`
+
+It prints a comparison table, saves the numbers as JSON and recommends the
+fastest variant whose perplexity is within `--tolerance` of the best one, which
+is the file `JackSparrowChat.initialize_model` should load.
+
+Usage:
+    python benchmark_gguf.py --export --config train_config.json
+    python benchmark_gguf.py --gguf-dir outputs/gguf --threads 8
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from llama_cpp import Llama
+
+from heldout import DEFAULT_DATASET, EVAL_PROMPTS, load_held_out
+
+import repo_root  # noqa: F401
+from llama_template import END_OF_TURN, render_prompt as render_messages
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def render_prompt(conversation):
+    """Render a ShareGPT conversation with the llama-3.1 template up to the last assistant turn."""
+    return render_messages([
+        {"role": "assistant" if message["from"] in ("assistant", "gpt") else "user", "content": message["value"]}
+        for message in conversation[:-1]
+    ])
+
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / 1024 / 1024 if psutil is not None else None
+
+
+def perplexity(model_path, conversations, n_threads, n_ctx = 512):
+    """Perplexity of the final assistant line of each conversation given its prompt."""
+    llm = Llama(model_path = model_path, n_ctx = n_ctx, n_threads = n_threads, n_gpu_layers = 0,
+                logits_all = True, verbose = False)
+    total_nll = 0.0
+    total_tokens = 0
+
+    for conversation in conversations:
+        prompt = render_prompt(conversation)
+        prompt_tokens = llm.tokenize(prompt.encode("utf-8"), add_bos = False, special = True)
+        response = conversation[-1]["value"] + END_OF_TURN
+        response_tokens = llm.tokenize(response.encode("utf-8"), add_bos = False, special = True)
+        tokens = prompt_tokens + response_tokens
+        if len(tokens) > n_ctx:
+            continue
+
+        llm.reset()
+        llm.eval(tokens)
+        # Logits at position i predict token i + 1
+        logits = np.asarray(llm.scores[len(prompt_tokens) - 1:len(tokens) - 1], dtype = np.float64)
+        peak = logits.max(axis = 1, keepdims = True)
+        log_norm = np.log(np.exp(logits - peak).sum(axis = 1)) + peak[:, 0]
+        target = logits[np.arange(len(response_tokens)), response_tokens]
+        total_nll += float((log_norm - target).sum())
+        total_tokens += len(response_tokens)
+
+    del llm
+    return float(np.exp(total_nll / total_tokens)) if total_tokens else float("nan")
+
+
+def benchmark_speed(model_path, n_threads, max_tokens = 64):
+    """Load time, memory and tokens/sec for greedy generation on the benchmark prompts."""
+    before = rss_mb()
+    start = time.perf_counter()
+    llm = Llama(model_path = model_path, n_ctx = 2048, n_threads = n_threads, n_gpu_layers = 0, verbose = False)
+    load_seconds = time.perf_counter() - start
+    loaded = rss_mb()
+
+    stop_tokens = {llm.token_eos(), *llm.tokenize(END_OF_TURN.encode("utf-8"), add_bos = False, special = True)}
+    prompt_tokens = completion_tokens = 0
+    prompt_seconds = generate_seconds = 0.0
+    for prompt in EVAL_PROMPTS[:4]:
+        text = render_prompt([{"from": "human", "value": prompt}, {"from": "assistant", "value": ""}])
+        tokens = llm.tokenize(text.encode("utf-8"), add_bos = False, special = True)
+        llm.reset()
+        # The first token arrives once the prompt has been evaluated
+        start = time.perf_counter()
+        first_token_at = None
+        generated = 0
+        for token in llm.generate(tokens, temp = 0.0):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            generated += 1
+            if token in stop_tokens or generated >= max_tokens:
+                break
+        end = time.perf_counter()
+        prompt_seconds += (first_token_at or end) - start
+        generate_seconds += end - (first_token_at or end)
+        prompt_tokens += len(tokens)
+        completion_tokens += max(generated - 1, 0)
+
+    result = {
+        "load_seconds": load_seconds,
+        "rss_loaded_mb": loaded - before if loaded is not None else None,
+        "rss_after_generate_mb": rss_mb() - before if loaded is not None else None,
+        "prompt_tokens_per_second": prompt_tokens / prompt_seconds if prompt_seconds else 0.0,
+        "generate_tokens_per_second": completion_tokens / generate_seconds if generate_seconds else 0.0,
+    }
+    del llm
+    return result
+
+
+def recommend(results, tolerance):
+    """Fastest variant whose perplexity is within tolerance of the best one."""
+    scored = [r for r in results if not np.isnan(r["perplexity"])]
+    if not scored:
+        return None
+    best = min(r["perplexity"] for r in scored)
+    acceptable = [r for r in scored if r["perplexity"] <= best * (1 + tolerance)]
+    return max(acceptable, key = lambda r: r["generate_tokens_per_second"])
+
+
+def print_table(results, recommended):
+    print(f"\n{'file':<28}{'size MB':>9}{'load s':>8}{'RSS MB':>9}{'prompt t/s':>12}{'gen t/s':>9}{'ppl':>8}")
+    for r in results:
+        rss = f"{r['rss_after_generate_mb']:.0f}" if r["rss_after_generate_mb"] is not None else "n/a"
+        marker = "  <- recommended" if r is recommended else ""
+        print(f"{r['file']:<28}{r['size_mb']:>9.0f}{r['load_seconds']:>8.2f}{rss:>9}"
+              f"{r['prompt_tokens_per_second']:>12.1f}{r['generate_tokens_per_second']:>9.1f}"
+              f"{r['perplexity']:>8.3f}{marker}")
+
+
+def run_benchmark(gguf_dir, dataset_path, n_threads, samples, tolerance, output_path):
+    files = sorted(glob.glob(os.path.join(gguf_dir, "*.gguf")))
+    if not files:
+        print(f"No GGUF files found in {gguf_dir}")
+        return None
+
+    conversations = load_held_out(dataset_path)[:samples]
+    results = []
+    for path in files:
+        print(f"Benchmarking {os.path.basename(path)}...")
+        result = {"file": os.path.basename(path), "size_mb": os.path.getsize(path) / 1024 / 1024}
+        result.update(benchmark_speed(path, n_threads))
+        result["perplexity"] = perplexity(path, conversations, n_threads)
+        results.append(result)
+
+    recommended = recommend(results, tolerance)
+    print_table(results, recommended)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"results": results, "recommended": recommended["file"] if recommended else None}, f, indent = 2)
+    if recommended:
+        print(f"\n✅ Recommended default for initialize_model: {recommended['file']}")
+    print(f"Results saved to {output_path}")
+    return recommended
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Export GGUF quantizations and benchmark them on CPU.")
+    parser.add_argument("--export", action = "store_true", help = "Run the gguf stage of train.py first")
+    parser.add_argument("--config", default = "train_config.json", help = "Training config used by --export")
+    parser.add_argument("--gguf-dir", default = None, help = "Defaults to <output_dir>/gguf from the config")
+    parser.add_argument("--dataset", default = DEFAULT_DATASET)
+    parser.add_argument("--threads", type = int, default = os.cpu_count())
+    parser.add_argument("--samples", type = int, default = 100, help = "Held-out conversations for perplexity")
+    parser.add_argument("--tolerance", type = float, default = 0.02, help = "Accepted relative perplexity loss")
+    parser.add_argument("--output", default = "gguf_benchmark.json")
+    args = parser.parse_args()
+
+    gguf_dir = args.gguf_dir
+    if args.export or gguf_dir is None:
+        from train import load_config, run
+        config = load_config(args.config)
+        gguf_dir = gguf_dir or os.path.join(config["output_dir"], "gguf")
+        if args.export:
+            run(config, ["gguf"])
+
+    run_benchmark(gguf_dir, args.dataset, args.threads, args.samples, args.tolerance, args.output)
@@ -0,0 +1,208 @@
+"""Batched offline evaluation of a fine-tuned Jack Sparrow model.
+
+On the held-out conversations from `heldout.py` this computes, with batched
+forward passes:
+
+* response_loss / response_perplexity: loss on Jack's lines only, the same
+  tokens the model is trained on
+* full_loss / full_perplexity: loss on every token of the conversation
+
+It then generates answers to the fixed `EVAL_PROMPTS` in one left-padded
+batch and reports simple persona signals (pirate markers, distinct bigrams,
+average length) next to the generations.
+
+Batches are built from length-sorted samples under a token budget, and the
+vocabulary projection is only applied to real (non-padding) positions, so the
+1B model evaluates on CPU in a few minutes.
+
+Usage:
+    python eval_persona.py --model outputs/lora --output eval_report.json
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import torch
+
+from heldout import DEFAULT_DATASET, DEFAULT_EVAL_FRACTION, EVAL_PROMPTS, load_held_out
+from preprocess_dataset import INSTRUCTION_PART, RESPONSE_PART, IGNORE_INDEX, mask_non_responses
+
+PERSONA_MARKERS = ("savvy", "aye", "mate", "rum", "pearl", "captain", "pirate", "ship", "sea", "treasure")
+
+
+def load_model(model_path, dtype = torch.float32):
+    """Load a merged model or LoRA adapters (detected by adapter_config.json) with its tokenizer."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if os.path.exists(os.path.join(model_path, "adapter_config.json")):
+        from peft import AutoPeftModelForCausalLM
+        model = AutoPeftModelForCausalLM.from_pretrained(model_path, torch_dtype = dtype)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype = dtype)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model.eval()
+    return model, tokenizer
+
+
+def to_messages(conversation):
+    return [
+        {"role": "assistant" if m["from"] in ("assistant", "gpt") else "user", "content": m["value"]}
+        for m in conversation
+    ]
+
+
+def tokenize_samples(tokenizer, conversations, max_seq_length):
+    instruction_ids = tokenizer(INSTRUCTION_PART, add_special_tokens = False).input_ids
+    response_ids = tokenizer(RESPONSE_PART, add_special_tokens = False).input_ids
+    samples = []
+    for conversation in conversations:
+        text = tokenizer.apply_chat_template(to_messages(conversation), tokenize = False)
+        ids = tokenizer(text, add_special_tokens = False).input_ids[:max_seq_length]
+        samples.append((ids, mask_non_responses(ids, instruction_ids, response_ids)))
+    return samples
+
+
+def token_budget_batches(samples, max_batch_tokens):
+    """Length-sorted batches whose padded size stays under max_batch_tokens."""
+    order = sorted(range(len(samples)), key = lambda i: len(samples[i][0]))
+    batches, batch = [], []
+    for index in order:
+        longest = len(samples[index][0])  # sorted ascending, so this is the batch maximum
+        if batch and longest * (len(batch) + 1) > max_batch_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@torch.inference_mode()
+def compute_losses(model, tokenizer, conversations, max_seq_length = 2048, max_batch_tokens = 4096):
+    """Summed negative log-likelihood over response tokens and over all tokens."""
+    device = next(model.parameters()).device
+    decoder = model.get_decoder()
+    head = model.get_output_embeddings()
+    samples = tokenize_samples(tokenizer, conversations, max_seq_length)
+    totals = {"response_nll": 0.0, "response_tokens": 0, "full_nll": 0.0, "full_tokens": 0}
+
+    for batch in token_budget_batches(samples, max_batch_tokens):
+        longest = max(len(samples[i][0]) for i in batch)
+        input_ids = torch.full((len(batch), longest), tokenizer.pad_token_id, dtype = torch.long)
+        labels = torch.full((len(batch), longest), IGNORE_INDEX, dtype = torch.long)
+        attention_mask = torch.zeros((len(batch), longest), dtype = torch.long)
+        for row, index in enumerate(batch):
+            ids, response_labels = samples[index]
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            labels[row, :len(ids)] = torch.tensor(response_labels)
+            attention_mask[row, :len(ids)] = 1
+
+        hidden = decoder(input_ids = input_ids.to(device), attention_mask = attention_mask.to(device))[0]
+        # Position t predicts token t + 1; only project positions followed by a real token
+        next_real = attention_mask[:, 1:].bool()
+        states = hidden[:, :-1][next_real.to(device)]
+        targets = input_ids[:, 1:][next_real].to(device)
+        is_response = (labels[:, 1:][next_real] != IGNORE_INDEX).to(device)
+
+        nll = torch.nn.functional.cross_entropy(head(states).float(), targets, reduction = "none")
+        totals["full_nll"] += float(nll.sum())
+        totals["full_tokens"] += int(nll.numel())
+        totals["response_nll"] += float(nll[is_response].sum())
+        totals["response_tokens"] += int(is_response.sum())
+
+    response_loss = totals["response_nll"] / max(totals["response_tokens"], 1)
+    full_loss = totals["full_nll"] / max(totals["full_tokens"], 1)
+    return {
+        "response_loss": response_loss,
+        "response_perplexity": math.exp(response_loss),
+        "full_loss": full_loss,
+        "full_perplexity": math.exp(full_loss),
+        "response_tokens": totals["response_tokens"],
+        "full_tokens": totals["full_tokens"],
+    }
+
+
+@torch.inference_mode()
+def generate_batch(model, tokenizer, prompts, max_new_tokens = 48):
+    """Greedy answers to all prompts in one left-padded batch."""
+    device = next(model.parameters()).device
+    texts = [
+        tokenizer.apply_chat_template([{"role": "user", "content": p}], tokenize = False, add_generation_prompt = True)
+        for p in prompts
+    ]
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    inputs = tokenizer(texts, add_special_tokens = False, padding = True, return_tensors = "pt").to(device)
+    tokenizer.padding_side = padding_side
+
+    eos_ids = [tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<|eot_id|>")]
+    outputs = model.generate(**inputs, max_new_tokens = max_new_tokens, do_sample = False,
+                             eos_token_id = [i for i in eos_ids if i is not None],
+                             pad_token_id = tokenizer.pad_token_id)
+    new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+    return [text.strip() for text in tokenizer.batch_decode(new_tokens, skip_special_tokens = True)]
+
+
+def persona_signals(responses):
+    words = [response.lower().split() for response in responses]
+    bigrams = [tuple(w[i:i + 2]) for w in words for i in range(len(w) - 1)]
+    with_marker = sum(any(marker in response.lower() for marker in PERSONA_MARKERS) for response in responses)
+    return {
+        "persona_marker_rate": with_marker / len(responses) if responses else 0.0,
+        "distinct_2": len(set(bigrams)) / len(bigrams) if bigrams else 0.0,
+        "average_words": sum(len(w) for w in words) / len(words) if words else 0.0,
+    }
+
+
+def evaluate_model(model, tokenizer, conversations, prompts = EVAL_PROMPTS, max_batch_tokens = 4096):
+    """Run the loss and generation checks on an already loaded model."""
+    report = {"conversations": len(conversations)}
+
+    start = time.perf_counter()
+    report.update(compute_losses(model, tokenizer, conversations, max_batch_tokens = max_batch_tokens))
+    report["loss_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    responses = generate_batch(model, tokenizer, prompts)
+    report["generation_seconds"] = time.perf_counter() - start
+    report.update(persona_signals(responses))
+    report["generations"] = [{"prompt": p, "response": r} for p, r in zip(prompts, responses)]
+    return report
+
+
+def print_report(report):
+    print(f"\nHeld-out conversations: {report['conversations']}")
+    print(f"Response loss {report['response_loss']:.4f} (perplexity {report['response_perplexity']:.2f}) "
+          f"over {report['response_tokens']} tokens")
+    print(f"Full loss     {report['full_loss']:.4f} (perplexity {report['full_perplexity']:.2f}) "
+          f"over {report['full_tokens']} tokens")
+    print(f"Persona markers {report['persona_marker_rate']:.0%}, distinct-2 {report['distinct_2']:.2f}, "
+          f"{report['average_words']:.1f} words per answer")
+    print(f"Timing: losses {report['loss_seconds']:.1f}s, generation {report['generation_seconds']:.1f}s\n")
+    for item in report["generations"]:
+        print(f"Human: {item['prompt']}\nJack: {item['response']}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Evaluate a fine-tuned model on the held-out Jack Sparrow lines.")
+    parser.add_argument("--model", required = True, help = "Merged model or LoRA adapter directory")
+    parser.add_argument("--dataset", default = DEFAULT_DATASET)
+    parser.add_argument("--eval-fraction", type = float, default = DEFAULT_EVAL_FRACTION)
+    parser.add_argument("--max-batch-tokens", type = int, default = 4096)
+    parser.add_argument("--threads", type = int, default = os.cpu_count())
+    parser.add_argument("--output", default = "eval_report.json")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model, tokenizer = load_model(args.model)
+    report = evaluate_model(model, tokenizer, load_held_out(args.dataset, args.eval_fraction),
+                            max_batch_tokens = args.max_batch_tokens)
+    print_report(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent = 2, ensure_ascii = False)
+    print(f"Report saved to {args.output}")
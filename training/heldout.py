@@ -0,0 +1,54 @@
+"""Held-out split and fixed prompts shared by training and evaluation.
+
+A conversation is held out when a hash of its text falls below the eval
+fraction, so the split does not depend on row order or on the tool reading the
+dataset: training skips exactly the conversations the evaluation scripts use.
+"""
+
+import hashlib
+import json
+import os
+
+DEFAULT_DATASET = os.path.join("..", "dataset", "jack_sharegpt_dataset.jsonl")
+DEFAULT_EVAL_FRACTION = 0.05
+
+# Fixed prompts for generation checks, kept short so CPU runs stay fast
+EVAL_PROMPTS = [
+    "Who are you?",
+    "Where is the Black Pearl?",
+    "Why is the rum gone?",
+    "What's your plan to get out of this?",
+    "Can you be trusted?",
+    "What do you think of the East India Trading Company?",
+    "Tell me about Davy Jones.",
+    "What is the best thing about being a pirate?",
+]
+
+
+def message_text(message):
+    """Text of a ShareGPT ("value") or standardized ("content") message."""
+    return message.get("value", message.get("content", ""))
+
+
+def held_out_score(messages):
+    """Stable value in [0, 1) derived from the conversation text."""
+    text = "\n".join(message_text(message) for message in messages)
+    digest = hashlib.sha1(text.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def load_conversations(path = DEFAULT_DATASET):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)["conversations"] for line in f if line.strip()]
+
+
+def split_conversations(conversations, fraction = DEFAULT_EVAL_FRACTION):
+    """Return (train, held_out) lists of conversations."""
+    train, held_out = [], []
+    for messages in conversations:
+        (held_out if held_out_score(messages) < fraction else train).append(messages)
+    return train, held_out
+
+
+def load_held_out(path = DEFAULT_DATASET, fraction = DEFAULT_EVAL_FRACTION):
+    return split_conversations(load_conversations(path), fraction)[1]
@@ -0,0 +1,127 @@
+"""Token length statistics of the tokenized dataset, and batch settings derived from them.
+
+`preprocess_dataset.py` writes these statistics next to every cache entry.
+`recommend_batching` uses them to pick the batching mode and the per-device
+batch size that fit a token budget, instead of guessing both by hand.
+
+Usage:
+    python length_stats.py dataset_cache/<key> --max-seq-length 2048 --tokens-per-batch 16384
+"""
+
+import argparse
+import json
+
+from packing import BATCHING_MODES, SAFE_BATCHING_MODES, simulate_batches
+
+
+def percentile(lengths, fraction):
+    ordered = sorted(lengths)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+def length_summary(lengths):
+    return {
+        "samples": len(lengths),
+        "tokens": sum(lengths),
+        "mean": sum(lengths) / len(lengths) if lengths else 0.0,
+        "p50": percentile(lengths, 0.5),
+        "p90": percentile(lengths, 0.9),
+        "p99": percentile(lengths, 0.99),
+        "max": max(lengths, default = 0),
+    }
+
+
+def length_histogram(lengths, bin_width = 32):
+    """Sample counts per [start, start + bin_width) token range, empty ranges included."""
+    counts = {}
+    for length in lengths:
+        start = length // bin_width * bin_width
+        counts[start] = counts.get(start, 0) + 1
+    top = max(counts, default = 0)
+    return [{"start": start, "end": start + bin_width, "count": counts.get(start, 0)}
+            for start in range(0, top + bin_width, bin_width)]
+
+
+def print_histogram(histogram, width = 50):
+    """Text bars for the non-empty ranges."""
+    peak = max((b["count"] for b in histogram), default = 0)
+    for b in histogram:
+        if not b["count"]:
+            continue
+        bar = "#" * round(width * b["count"] / peak) if peak else ""
+        print(f"{b['start']:>6}-{b['end'] - 1:<6}{b['count']:>7}  {bar}")
+
+
+def recommend_batching(lengths, max_seq_length, tokens_per_batch, allow_packed = False):
+    """
+    Pick the batching mode and per-device batch size for a token budget.
+
+    The batch size is the largest one whose worst case, a batch padded to the
+    longest sample (or a full packed row), stays within tokens_per_batch. The
+    mode is the one that then puts the most real tokens in each batch, the
+    least padded one on a tie. "packed" is only chosen with allow_packed, for
+    models where `packing.verify_segment_isolation` passes; its numbers are
+    reported either way.
+
+    Args:
+        lengths (list): Token count of every training sample
+        max_seq_length (int): Longest row the model is trained on
+        tokens_per_batch (int): Padded tokens one device can take per step
+        allow_packed (bool): Whether "packed" may be recommended
+
+    Returns:
+        dict: "batching", "per_device_train_batch_size" and the per-mode numbers behind the choice
+    """
+    longest = min(max(lengths, default = 1), max_seq_length)
+    modes = {}
+    for mode in BATCHING_MODES:
+        row_length = max_seq_length if mode == "packed" else longest
+        batch_size = max(1, tokens_per_batch // row_length)
+        batches = simulate_batches(lengths, batch_size, max_seq_length, mode)
+        real = sum(sum(batch) for batch in batches)
+        padded = sum(max(batch) * len(batch) for batch in batches)
+        modes[mode] = {
+            "per_device_train_batch_size": batch_size,
+            "steps": len(batches),
+            "real_tokens_per_batch": real / len(batches) if batches else 0.0,
+            "padding_ratio": 1 - real / padded if padded else 0.0,
+        }
+    candidates = BATCHING_MODES if allow_packed else SAFE_BATCHING_MODES
+    best = max(candidates, key = lambda mode: (round(modes[mode]["real_tokens_per_batch"]), -modes[mode]["padding_ratio"]))
+    return {"batching": best, "per_device_train_batch_size": modes[best]["per_device_train_batch_size"], "modes": modes}
+
+
+def write_length_stats(lengths, path, max_seq_length, tokens_per_batch = None, extra = None):
+    """Save the summary, histogram and (with a token budget) the batching recommendation as JSON."""
+    stats = {"max_seq_length": max_seq_length, **length_summary(lengths), **(extra or {})}
+    stats["histogram"] = length_histogram(lengths)
+    if tokens_per_batch:
+        stats["recommendation"] = recommend_batching(lengths, max_seq_length, tokens_per_batch)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent = 2)
+    return stats
+
+
+def print_length_stats(stats):
+    print(f"{stats['samples']} samples, {stats['tokens']} tokens, mean {stats['mean']:.1f}, "
+          f"p50 {stats['p50']}, p90 {stats['p90']}, p99 {stats['p99']}, max {stats['max']}")
+    print_histogram(stats["histogram"])
+    recommendation = stats.get("recommendation")
+    if recommendation:
+        print(f"Recommended: batching = \"{recommendation['batching']}\", "
+              f"per_device_train_batch_size = {recommendation['per_device_train_batch_size']}")
+
+
+if __name__ == "__main__":
+    from datasets import load_from_disk
+
+    parser = argparse.ArgumentParser(description = "Token length statistics of a tokenized dataset.")
+    parser.add_argument("dataset_path", help = "Tokenized dataset directory written by preprocess_dataset.py")
+    parser.add_argument("--max-seq-length", type = int, default = 2048)
+    parser.add_argument("--tokens-per-batch", type = int, default = 16384)
+    parser.add_argument("--output", default = "length_stats.json")
+    args = parser.parse_args()
+
+    lengths = load_from_disk(args.dataset_path)["length"]
+    print_length_stats(write_length_stats(lengths, args.output, args.max_seq_length, args.tokens_per_batch))
+    print(f"Saved to {args.output}")
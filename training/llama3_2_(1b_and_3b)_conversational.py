@@ -115,22 +115,13 @@ tokenizer = get_chat_template(
     chat_template = "llama-3.1",
 )
 
-def formatting_prompts_func(examples):
-    convos = examples["conversations"]
-    texts = [tokenizer.apply_chat_template(convo, tokenize = False, add_generation_prompt = False) for convo in convos]
-    return { "text" : texts, }
-pass
-
-from datasets import load_dataset
-dataset = load_dataset("Devwa/jackSparrow", split = "train")
-
-"""We now use `standardize_sharegpt` to convert ShareGPT style datasets into HuggingFace's generic format. This changes the dataset from looking like:
+"""The conversations are rendered with the chat template, tokenized and masked once by `preprocess_dataset.py` and cached on disk as memory-mapped Arrow files keyed by the tokenizer and template. Later runs load the cache directly. That step also runs `standardize_sharegpt`, which turns ShareGPT style rows like:
 ```
 {"from": "system", "value": "You are an assistant"}
 {"from": "human", "value": "What is 2+2?"}
 {"from": "gpt", "value": "It's 4."}
 ```
-to
+into
 ```
 {"role": "system", "content": "You are an assistant"}
 {"role": "user", "content": "What is 2+2?"}
@@ -138,20 +129,16 @@ to
 ```
 """
 
-from unsloth.chat_templates import standardize_sharegpt
-dataset = standardize_sharegpt(dataset)
-dataset = dataset.map(formatting_prompts_func, batched = True,)
+from preprocess_dataset import load_or_build_dataset
+from heldout import DEFAULT_EVAL_FRACTION
+# Conversations longer than max_seq_length are split between exchanges instead of being cut off
+dataset = load_or_build_dataset(tokenizer, "Devwa/jackSparrow", max_seq_length = max_seq_length, outliers = "split")
+# Keep the held-out conversations out of training, `eval_persona.py` scores the model on them
+dataset = dataset.filter(lambda score: score >= DEFAULT_EVAL_FRACTION, input_columns = "held_out_score")
 
-"""We look at how the conversations are structured for item 5:"""
+"""We look at how item 5 was tokenized:"""
 
-dataset[5]["conversations"]
-
-"""And we see how the chat template transformed these conversations.
-
-**[Notice]** Llama 3.1 Instruct's default chat template default adds `"Cutting Knowledge Date: December 2023\nToday Date: 26 July 2024"`, so do not be alarmed!
-"""
-
-dataset[5]["text"]
+tokenizer.decode(dataset[5]["input_ids"])
 
 """<a name="Train"></a>
 ### Train the model
@@ -162,17 +149,54 @@ from trl import SFTTrainer
 from transformers import TrainingArguments, DataCollatorForSeq2Seq
 from unsloth import is_bfloat16_supported
 
+"""Most samples are a single short line, so a padded batch is mostly padding. `batching` picks how rows are built: `"padded"` is the original behaviour, `"grouped"` batches samples of similar length together, and `"packed"` concatenates several conversations per row with per-conversation position ids and a block-diagonal attention mask (see `packing.py`). TRL's own `packing` stays off because it would let conversations attend to each other. Note that a packed row holds many conversations, so each step sees more samples.
+
+Unsloth's fast forward ignores `attention_mask` while training, so `"packed"` is checked with `verify_segment_isolation` first and training stops if the conversations are not kept apart. To measure the speed-up, run once with `"padded"` and compare the tokens/sec printed at the end."""
+
+from packing import pack_dataset, PackedCollator, print_padding_report, verify_segment_isolation
+
+batching = "grouped" # "padded", "grouped" or "packed"
+per_device_train_batch_size = 2
+print_padding_report(dataset["length"], per_device_train_batch_size, max_seq_length)
+
+"""The token lengths can also choose for us: `recommend_batching` takes the per-device token budget and returns the mode and batch size that put the most real tokens in each step."""
+
+from length_stats import length_summary, length_histogram, print_histogram, recommend_batching
+
+print(length_summary(dataset["length"]))
+print_histogram(length_histogram(dataset["length"]))
+use_recommendation = False
+if use_recommendation:
+    recommendation = recommend_batching(dataset["length"], max_seq_length, tokens_per_batch = 16384)
+    batching = recommendation["batching"]
+    per_device_train_batch_size = recommendation["per_device_train_batch_size"]
+
+if batching == "packed":
+    train_dataset = pack_dataset(dataset, max_seq_length)
+    data_collator = PackedCollator(tokenizer, mask_dtype = torch.bfloat16 if is_bfloat16_supported() else torch.float16)
+    verify_segment_isolation(model, data_collator)
+else:
+    train_dataset = dataset
+    data_collator = DataCollatorForSeq2Seq(tokenizer = tokenizer)
+
+"""`TelemetryCallback` records tokens/sec, padding, the step time breakdown and memory for every step in `outputs/telemetry.jsonl` and prints a summary at the end of training."""
+
+from telemetry import TelemetryCallback
+telemetry = TelemetryCallback("outputs/telemetry.jsonl")
+
 trainer = SFTTrainer(
     model = model,
     tokenizer = tokenizer,
-    train_dataset = dataset,
-    dataset_text_field = "text",
+    train_dataset = train_dataset,
     max_seq_length = max_seq_length,
-    data_collator = DataCollatorForSeq2Seq(tokenizer = tokenizer),
-    dataset_num_proc = 2,
-    packing = False, # Can make training 5x faster for short sequences.
+    data_collator = telemetry.wrap_collator(data_collator, tokenizer),
+    callbacks = [telemetry],
+    dataset_kwargs = {"skip_prepare_dataset": True}, # Already tokenized by preprocess_dataset.py
+    packing = False,
     args = TrainingArguments(
-        per_device_train_batch_size = 2,
+        per_device_train_batch_size = per_device_train_batch_size,
+        group_by_length = batching == "grouped",
+        length_column_name = "length",
         gradient_accumulation_steps = 4,
         warmup_steps = 5,
         num_train_epochs = 1, # Set this for 1 full training run.
@@ -189,14 +213,7 @@ trainer = SFTTrainer(
     ),
 )
 
-"""We also use Unsloth's `train_on_completions` method to only train on the assistant outputs and ignore the loss on the user's inputs."""
-
-from unsloth.chat_templates import train_on_responses_only
-trainer = train_on_responses_only(
-    trainer,
-    instruction_part = "<|start_header_id|>user<|end_header_id|>\n\n",
-    response_part = "<|start_header_id|>assistant<|end_header_id|>\n\n",
-)
+"""The labels were already masked in preprocessing the same way Unsloth's `train_on_responses_only` does it, so we only train on the assistant outputs and ignore the loss on the user's inputs."""
 
 """We verify masking is actually done:"""
 
@@ -229,6 +246,8 @@ print(f"Peak reserved memory = {used_memory} GB.")
 print(f"Peak reserved memory for training = {used_memory_for_lora} GB.")
 print(f"Peak reserved memory % of max memory = {used_percentage} %.")
 print(f"Peak reserved memory for training % of max memory = {lora_percentage} %.")
+tokens_per_second = sum(dataset["length"]) * trainer.args.num_train_epochs / trainer_stats.metrics['train_runtime']
+print(f"{round(tokens_per_second)} tokens/sec with {batching} batching.")
 
 """<a name="Inference"></a>
 ### Inference
@@ -236,7 +255,7 @@ Let's run the model! You can change the instruction and input - leave the output
 
 **[NEW] Try 2x faster inference in a free Colab for Llama-3.1 8b Instruct [here](https://colab.research.google.com/github/unslothai/notebooks/blob/main/nb/Unsloth_Studio.ipynb)**
 
-We use `min_p = 0.1` and `temperature = 1.5`. Read this [Tweet](https://x.com/menhguin/status/1826132708508213629) for more information on why.
+For sampling below we use `min_p = 0.1` and `temperature = 1.5`. Read this [Tweet](https://x.com/menhguin/status/1826132708508213629) for more information on why.
 """
 
 from unsloth.chat_templates import get_chat_template
@@ -247,19 +266,11 @@ tokenizer = get_chat_template(
 )
 FastLanguageModel.for_inference(model) # Enable native 2x faster inference
 
-messages = [
-    {"role": "user", "content": "Continue the fibonnaci sequence: 1, 1, 2, 3, 5, 8,"},
-]
-inputs = tokenizer.apply_chat_template(
-    messages,
-    tokenize = True,
-    add_generation_prompt = True, # Must add for generation
-    return_tensors = "pt",
-).to("cuda")
+"""Instead of eyeballing a single prompt, `eval_persona.py` measures the loss and perplexity on Jack's held-out lines with batched forward passes and answers a fixed prompt set in one batch. Run `python eval_persona.py --model lora_model` after saving to do the same on CPU."""
 
-outputs = model.generate(input_ids = inputs, max_new_tokens = 64, use_cache = True,
-                         temperature = 1.5, min_p = 0.1)
-tokenizer.batch_decode(outputs)
+from eval_persona import evaluate_model, print_report
+from heldout import load_held_out
+print_report(evaluate_model(model, tokenizer, load_held_out()))
 
 """ You can also use a `TextStreamer` for continuous inference - so you can see the generation token by token, instead of waiting the whole time!"""
 
@@ -0,0 +1,243 @@
+"""Sequence packing and padding statistics for the tokenized Jack Sparrow dataset.
+
+Almost every sample is a single short line of dialogue, so padded batches are
+mostly padding. Two alternatives are supported:
+
+* "grouped": keep one conversation per row but let the trainer build batches
+  of similar length (`group_by_length` on the `length` column).
+* "packed": concatenate several already masked conversations into one row.
+  `position_ids` restart at 0 for every conversation and `PackedCollator`
+  turns them into a block-diagonal causal mask, so conversations never attend
+  to each other and the response-only labels are kept as they are.
+
+Packing is only correct if the model's attention honours that mask. Unsloth's
+fast Llama forward drops `attention_mask` in training mode, so a packed row
+would let each conversation attend to all the ones before it. "grouped" is
+therefore the default, and "packed" is only used after
+`verify_segment_isolation` has shown that the model keeps the conversations apart.
+
+Usage:
+    python packing.py dataset_cache/<key> --batch-size 2 --max-seq-length 2048
+"""
+
+import argparse
+import random
+
+import torch
+from datasets import Dataset, load_from_disk
+
+IGNORE_INDEX = -100
+BATCHING_MODES = ("padded", "grouped", "packed")
+# Modes that are correct with any attention implementation
+SAFE_BATCHING_MODES = ("padded", "grouped")
+
+
+def pack_lengths(lengths, max_seq_length):
+    """
+    Group sample indices into bins of at most max_seq_length tokens.
+
+    Uses first-fit decreasing, which keeps the number of rows close to the
+    minimum for many short samples.
+    """
+    order = sorted(range(len(lengths)), key = lambda i: lengths[i], reverse = True)
+    bins = []
+    remaining = []
+    for index in order:
+        size = min(lengths[index], max_seq_length)
+        for b, space in enumerate(remaining):
+            if size <= space:
+                bins[b].append(index)
+                remaining[b] -= size
+                break
+        else:
+            bins.append([index])
+            remaining.append(max_seq_length - size)
+    return bins
+
+
+def pack_dataset(dataset, max_seq_length):
+    """
+    Concatenate tokenized conversations into rows of at most max_seq_length tokens.
+
+    Args:
+        dataset: Output of `preprocess_dataset.load_or_build_dataset`
+        max_seq_length (int): Maximum tokens per packed row
+
+    Returns:
+        Dataset with input_ids, labels, position_ids and length columns
+    """
+    input_ids = dataset["input_ids"]
+    labels = dataset["labels"]
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+
+    for indices in pack_lengths([len(ids) for ids in input_ids], max_seq_length):
+        row_ids, row_labels, row_positions = [], [], []
+        for index in indices:
+            ids = input_ids[index][:max_seq_length]
+            row_ids.extend(ids)
+            row_labels.extend(labels[index][:max_seq_length])
+            row_positions.extend(range(len(ids)))
+        packed["input_ids"].append(row_ids)
+        packed["labels"].append(row_labels)
+        packed["position_ids"].append(row_positions)
+        packed["length"].append(len(row_ids))
+
+    print(f"✅ Packed {len(input_ids)} conversations into {len(packed['input_ids'])} rows")
+    return Dataset.from_dict(packed)
+
+
+class PackedCollator:
+    """
+    Pad packed rows and keep conversations from attending to each other.
+
+    With block_diagonal_mask the collator passes a 4D additive mask built from
+    the position_ids resets, which works with the eager and SDPA attention
+    paths. Without it only position_ids are passed, which is enough for
+    attention implementations that read sequence boundaries from them
+    (flash-attention varlen).
+    """
+
+    def __init__(self, tokenizer, block_diagonal_mask = True, mask_dtype = torch.float32, pad_to_multiple_of = 8):
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.block_diagonal_mask = block_diagonal_mask
+        self.mask_dtype = mask_dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            longest = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch_size = len(features)
+        input_ids = torch.full((batch_size, longest), self.pad_token_id, dtype = torch.long)
+        labels = torch.full((batch_size, longest), IGNORE_INDEX, dtype = torch.long)
+        position_ids = torch.zeros((batch_size, longest), dtype = torch.long)
+        # Padding gets segment -1; every conversation gets its own segment number
+        segments = torch.full((batch_size, longest), -1, dtype = torch.long)
+
+        for row, feature in enumerate(features):
+            size = len(feature["input_ids"])
+            positions = torch.tensor(feature["position_ids"], dtype = torch.long)
+            input_ids[row, :size] = torch.tensor(feature["input_ids"], dtype = torch.long)
+            labels[row, :size] = torch.tensor(feature["labels"], dtype = torch.long)
+            position_ids[row, :size] = positions
+            segments[row, :size] = torch.cumsum(positions == 0, dim = 0)
+
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if not self.block_diagonal_mask:
+            batch["attention_mask"] = (segments >= 0).long()
+            return batch
+
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        causal = torch.ones((longest, longest), dtype = torch.bool).tril()
+        allowed = same_segment & causal
+        # Let padding attend to itself so no row of the mask is fully blocked
+        allowed |= torch.eye(longest, dtype = torch.bool)
+        mask = torch.zeros((batch_size, 1, longest, longest), dtype = self.mask_dtype)
+        mask.masked_fill_(~allowed[:, None], torch.finfo(self.mask_dtype).min)
+        batch["attention_mask"] = mask
+        return batch
+
+
+def verify_segment_isolation(model, collator, tolerance = 0.05):
+    """
+    Check that the model keeps packed conversations from attending to each other.
+
+    Runs one row holding two conversations, and the second conversation alone,
+    in training mode (where fast attention paths may ignore attention_mask), and
+    compares the second conversation's logits.
+
+    Args:
+        model: The model about to be trained
+        collator (PackedCollator): Collator the trainer will use
+        tolerance (float): Largest allowed difference, relative to the largest logit
+
+    Returns:
+        float: The relative difference found
+
+    Raises:
+        RuntimeError: If the logits differ, i.e. the mask is not consumed
+    """
+    first, second = list(range(1000, 1024)), list(range(2000, 2016))
+    packed = {"input_ids": first + second, "labels": [IGNORE_INDEX] * (len(first) + len(second)),
+              "position_ids": list(range(len(first))) + list(range(len(second)))}
+    alone = {"input_ids": second, "labels": [IGNORE_INDEX] * len(second), "position_ids": list(range(len(second)))}
+
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.train()
+    try:
+        with torch.no_grad():
+            logits = []
+            for feature in (packed, alone):
+                batch = {k: v.to(device) for k, v in collator([feature]).items() if k != "labels"}
+                logits.append(model(**batch).logits[0].float())
+    finally:
+        model.train(was_training)
+
+    packed_logits = logits[0][len(first):len(first) + len(second)]
+    alone_logits = logits[1][:len(second)]
+    difference = ((packed_logits - alone_logits).abs().max() / alone_logits.abs().max()).item()
+    if difference > tolerance:
+        raise RuntimeError(
+            f"Packed conversations attend to each other (logits differ by {difference:.1%}): "
+            "this attention path ignores the block-diagonal mask. Use batching = \"grouped\" instead."
+        )
+    print(f"✅ Packed conversations are isolated (logits differ by {difference:.2%})")
+    return difference
+
+
+def simulate_batches(lengths, batch_size, max_seq_length, mode, seed = 3407):
+    """Return the per-row token counts of each batch one epoch would produce."""
+    rng = random.Random(seed)
+    if mode == "packed":
+        rows = [sum(min(lengths[i], max_seq_length) for i in b) for b in pack_lengths(lengths, max_seq_length)]
+        rng.shuffle(rows)
+    else:
+        rows = [min(length, max_seq_length) for length in lengths]
+        rng.shuffle(rows)
+        if mode == "grouped":
+            # Same idea as transformers' LengthGroupedSampler: sort inside mega-batches
+            mega = batch_size * 50
+            rows = [length for i in range(0, len(rows), mega)
+                    for length in sorted(rows[i:i + mega], reverse = True)]
+    return [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+
+def padding_report(lengths, batch_size, max_seq_length):
+    """
+    Compare padding for every batching mode.
+
+    Returns:
+        dict: mode -> {"batches", "padding_ratio", "tokens_per_batch"}
+    """
+    report = {}
+    for mode in BATCHING_MODES:
+        batches = simulate_batches(lengths, batch_size, max_seq_length, mode)
+        real = sum(sum(batch) for batch in batches)
+        padded = sum(max(batch) * len(batch) for batch in batches)
+        report[mode] = {
+            "batches": len(batches),
+            "padding_ratio": 1 - real / padded if padded else 0.0,
+            "tokens_per_batch": real / len(batches) if batches else 0.0,
+        }
+    return report
+
+
+def print_padding_report(lengths, batch_size, max_seq_length):
+    report = padding_report(lengths, batch_size, max_seq_length)
+    print(f"{'mode':<10}{'batches':>10}{'padding':>10}{'tokens/batch':>14}")
+    for mode, stats in report.items():
+        print(f"{mode:<10}{stats['batches']:>10}{stats['padding_ratio']:>10.1%}{stats['tokens_per_batch']:>14.1f}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report padding for each batching mode.")
+    parser.add_argument("dataset_path", help = "Tokenized dataset directory written by preprocess_dataset.py")
+    parser.add_argument("--batch-size", type = int, default = 2)
+    parser.add_argument("--max-seq-length", type = int, default = 2048)
+    args = parser.parse_args()
+
+    dataset = load_from_disk(args.dataset_path)
+    print_padding_report(dataset["length"], args.batch_size, args.max_seq_length)
@@ -0,0 +1,262 @@
+"""Tokenize the Jack Sparrow dataset once and cache it on disk.
+
+The cached dataset is already rendered with the Llama 3.1 chat template,
+tokenized and masked so only the assistant responses are trained on, which is
+what `train_on_responses_only` would otherwise do on every run. It is stored as
+Arrow files that `load_from_disk` memory-maps, under a directory named after a
+hash of the tokenizer, the chat template and the preprocessing settings.
+
+Conversations longer than `max_seq_length` are split between exchanges
+(default), dropped, or truncated. Token length statistics and a histogram are
+saved next to the cache entry as `<key>_lengths.json`.
+
+Usage:
+    python preprocess_dataset.py --model unsloth/Llama-3.2-3B-Instruct --dataset Devwa/jackSparrow
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from datasets import load_dataset, load_from_disk
+
+from heldout import held_out_score
+
+CHAT_TEMPLATE = "llama-3.1"
+INSTRUCTION_PART = "<|start_header_id|>user<|end_header_id|>\n\n"
+RESPONSE_PART = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+IGNORE_INDEX = -100
+DEFAULT_CACHE_DIR = "dataset_cache"
+# Bump when the columns written to the cache change
+CACHE_FORMAT = 3
+OUTLIER_POLICIES = ("split", "drop", "truncate")
+
+
+def load_raw_dataset(source, split = "train"):
+    """Load a ShareGPT dataset from a local JSONL file or the Hugging Face Hub."""
+    if os.path.isfile(source):
+        return load_dataset("json", data_files = source, split = "train")
+    return load_dataset(source, split = split)
+
+
+def cache_key(tokenizer, raw_dataset, max_seq_length, outliers = "split"):
+    """Hash everything that changes the tokenized output."""
+    digest = hashlib.sha256()
+    if getattr(tokenizer, "is_fast", False):
+        digest.update(tokenizer.backend_tokenizer.to_str().encode("utf-8"))
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys = True).encode("utf-8"))
+    settings = {
+        "tokenizer": tokenizer.name_or_path,
+        "chat_template": tokenizer.chat_template,
+        "instruction_part": INSTRUCTION_PART,
+        "response_part": RESPONSE_PART,
+        "max_seq_length": max_seq_length,
+        "outliers": outliers,
+        "dataset": raw_dataset._fingerprint,
+        "format": CACHE_FORMAT,
+    }
+    digest.update(json.dumps(settings, sort_keys = True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def find_subsequence(ids, pattern, start = 0):
+    """Return the index of the first occurrence of pattern in ids at or after start, or -1."""
+    size = len(pattern)
+    first = pattern[0]
+    for i in range(start, len(ids) - size + 1):
+        if ids[i] == first and ids[i:i + size] == pattern:
+            return i
+    return -1
+
+
+def mask_non_responses(input_ids, instruction_ids, response_ids):
+    """
+    Build labels that only keep the assistant responses.
+
+    Everything from the start of the sequence up to the end of each assistant
+    header, and from each user header onwards, is set to IGNORE_INDEX, matching
+    unsloth's `train_on_responses_only`.
+    """
+    labels = [IGNORE_INDEX] * len(input_ids)
+    position = 0
+    while True:
+        header = find_subsequence(input_ids, response_ids, position)
+        if header == -1:
+            break
+        start = header + len(response_ids)
+        end = find_subsequence(input_ids, instruction_ids, start)
+        if end == -1:
+            end = len(input_ids)
+        labels[start:end] = input_ids[start:end]
+        position = end
+    return labels
+
+
+def encode(tokenizer, conversations):
+    texts = [
+        tokenizer.apply_chat_template(convo, tokenize = False, add_generation_prompt = False)
+        for convo in conversations
+    ]
+    # The template already starts with <|begin_of_text|>
+    return tokenizer(texts, add_special_tokens = False)["input_ids"]
+
+
+def split_conversation(tokenizer, convo, max_seq_length):
+    """
+    Split a conversation between exchanges into parts of at most max_seq_length tokens.
+
+    Each part starts at a user message and takes as many whole exchanges as fit;
+    a single exchange that is too long on its own becomes a part by itself.
+    """
+    exchanges = []
+    for message in convo:
+        if message["role"] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(message)
+
+    parts = []
+    current = []
+    for exchange in exchanges:
+        candidate = current + exchange
+        if current and len(encode(tokenizer, [candidate])[0]) > max_seq_length:
+            parts.append(current)
+            current = exchange
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def tokenize_conversations(examples, tokenizer, max_seq_length, instruction_ids, response_ids, outliers = "split"):
+    # Tokenize without truncation first to see the real lengths
+    rows = {"input_ids": [], "attention_mask": [], "labels": [], "length": [], "held_out_score": [],
+            "original_length": []}
+    for convo, ids in zip(examples["conversations"], encode(tokenizer, examples["conversations"])):
+        if len(ids) <= max_seq_length:
+            pieces = [ids]
+        elif outliers == "drop":
+            continue
+        elif outliers == "split":
+            pieces = encode(tokenizer, split_conversation(tokenizer, convo, max_seq_length))
+        else:
+            pieces = [ids]
+
+        # Parts of a split conversation stay on the same side of the held-out split
+        score = held_out_score(convo)
+        for piece in pieces:
+            piece = piece[:max_seq_length]
+            rows["input_ids"].append(piece)
+            rows["attention_mask"].append([1] * len(piece))
+            rows["labels"].append(mask_non_responses(piece, instruction_ids, response_ids))
+            rows["length"].append(len(piece))
+            rows["held_out_score"].append(score)
+            rows["original_length"].append(len(ids))
+    return rows
+
+
+def build_dataset(tokenizer, raw_dataset, max_seq_length, num_proc = None, outliers = "split"):
+    """Standardize, template, tokenize and mask a raw ShareGPT dataset."""
+    from unsloth.chat_templates import standardize_sharegpt
+
+    num_proc = num_proc or os.cpu_count()
+    instruction_ids = tokenizer(INSTRUCTION_PART, add_special_tokens = False).input_ids
+    response_ids = tokenizer(RESPONSE_PART, add_special_tokens = False).input_ids
+
+    dataset = standardize_sharegpt(raw_dataset)
+    return dataset.map(
+        tokenize_conversations,
+        batched = True,
+        num_proc = num_proc,
+        remove_columns = dataset.column_names,
+        fn_kwargs = {
+            "tokenizer": tokenizer,
+            "max_seq_length": max_seq_length,
+            "instruction_ids": instruction_ids,
+            "response_ids": response_ids,
+            "outliers": outliers,
+        },
+        desc = "Tokenizing conversations",
+    )
+
+
+def load_or_build_dataset(tokenizer, source, max_seq_length = 2048, cache_dir = DEFAULT_CACHE_DIR,
+                          num_proc = None, rebuild = False, outliers = "split"):
+    """
+    Return the tokenized dataset for source, building and caching it if needed.
+
+    Args:
+        tokenizer: Tokenizer with the Llama 3.1 chat template applied
+        source (str): Local JSONL path or Hugging Face dataset name
+        max_seq_length (int): Sequences are truncated to this many tokens
+        cache_dir (str): Directory holding one sub-directory per cache key
+        num_proc (int): Worker processes for tokenization (default: all cores)
+        rebuild (bool): Ignore an existing cache entry
+        outliers (str): What to do with conversations over max_seq_length: "split", "drop" or "truncate"
+    """
+    from length_stats import write_length_stats
+
+    if outliers not in OUTLIER_POLICIES:
+        raise ValueError(f"outliers must be one of {OUTLIER_POLICIES}, got {outliers!r}")
+    raw_dataset = load_raw_dataset(source)
+    path = os.path.join(cache_dir, cache_key(tokenizer, raw_dataset, max_seq_length, outliers))
+
+    if os.path.isdir(path) and not rebuild:
+        print(f"✅ Loading tokenized dataset from {path}")
+        return load_from_disk(path)
+
+    start = time.perf_counter()
+    dataset = build_dataset(tokenizer, raw_dataset, max_seq_length, num_proc, outliers)
+    dataset.save_to_disk(path)
+    print(f"✅ Tokenized {len(dataset)} conversations in {time.perf_counter() - start:.1f}s, saved to {path}")
+
+    over_limit = sum(length > max_seq_length for length in dataset["original_length"])
+    stats = write_length_stats(dataset["length"], lengths_path(path), max_seq_length, extra = {
+        "outliers": outliers,
+        "raw_samples": len(raw_dataset),
+        "rows_from_outliers": over_limit,
+    })
+    print(f"Token lengths: p50 {stats['p50']}, p99 {stats['p99']}, max {stats['max']}; "
+          f"{over_limit} rows come from conversations over {max_seq_length} tokens ({outliers})")
+    # Reload so training reads the memory-mapped copy instead of the in-memory one
+    return load_from_disk(path)
+
+
+def lengths_path(cache_path):
+    """Length statistics file written next to a cache entry."""
+    return cache_path.rstrip("/\\") + "_lengths.json"
+
+
+def get_tokenizer(model_name, max_seq_length):
+    """Load only the tokenizer of model_name with the training chat template."""
+    from transformers import AutoTokenizer
+    from unsloth.chat_templates import get_chat_template
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, model_max_length = max_seq_length)
+    return get_chat_template(tokenizer, chat_template = CHAT_TEMPLATE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Pre-tokenize the Jack Sparrow dataset for training.")
+    parser.add_argument("--model", default = "unsloth/Llama-3.2-3B-Instruct", help = "Model whose tokenizer is used")
+    parser.add_argument("--dataset", default = "Devwa/jackSparrow", help = "Local JSONL file or Hub dataset")
+    parser.add_argument("--max-seq-length", type = int, default = 2048)
+    parser.add_argument("--cache-dir", default = DEFAULT_CACHE_DIR)
+    parser.add_argument("--num-proc", type = int, default = None, help = "Defaults to all cores")
+    parser.add_argument("--rebuild", action = "store_true", help = "Rebuild even if a cache entry exists")
+    parser.add_argument("--outliers", choices = OUTLIER_POLICIES, default = "split",
+                        help = "What to do with conversations longer than --max-seq-length")
+    parser.add_argument("--tokens-per-batch", type = int, default = 16384,
+                        help = "Per-device token budget used for the batching recommendation")
+    args = parser.parse_args()
+
+    from length_stats import print_length_stats, write_length_stats
+
+    tokenizer = get_tokenizer(args.model, args.max_seq_length)
+    dataset = load_or_build_dataset(tokenizer, args.dataset, args.max_seq_length,
+                                    args.cache_dir, args.num_proc, args.rebuild, args.outliers)
+    stats = write_length_stats(dataset["length"], "length_stats.json", args.max_seq_length, args.tokens_per_batch)
+    print_length_stats(stats)
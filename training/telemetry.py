@@ -0,0 +1,198 @@
+"""Per-step throughput and memory telemetry for the Hugging Face Trainer.
+
+`TelemetryCallback` writes one record per optimizer step to a JSONL or CSV
+file (picked from the extension) and prints a summary when training ends.
+Token counts and data-loading time come from wrapping the data collator with
+`TelemetryCallback.wrap_collator`, so they are only collected when batches are
+collated in the main process (`dataloader_num_workers = 0`, the default).
+
+Each record holds:
+* tokens, padded_tokens, padding_fraction and tokens_per_second
+* step_seconds split into data_seconds (collation), forward_backward_seconds,
+  optimizer_seconds and other_seconds (logging, checkpointing, callbacks)
+* memory_mb: peak CUDA memory reserved, or the process RSS without a GPU
+"""
+
+import csv
+import json
+import os
+import statistics
+import time
+
+from transformers import TrainerCallback
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+FIELDS = [
+    "step", "step_seconds", "data_seconds", "forward_backward_seconds", "optimizer_seconds",
+    "other_seconds", "tokens", "padded_tokens", "padding_fraction", "tokens_per_second",
+    "memory_mb", "memory_kind",
+]
+
+
+def current_memory():
+    """Return (megabytes, kind) for the best memory measure available."""
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda.max_memory_reserved() / 1024 / 1024, "cuda_reserved"
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024, "rss"
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "max_rss"
+    except ImportError:
+        return None, None
+
+
+class TelemetryCollator:
+    """Data collator wrapper that reports collation time and token counts."""
+
+    def __init__(self, collator, callback, pad_token_id):
+        self.collator = collator
+        self.callback = callback
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, features):
+        start = time.perf_counter()
+        batch = self.collator(features)
+        elapsed = time.perf_counter() - start
+
+        input_ids = batch["input_ids"]
+        attention_mask = batch.get("attention_mask")
+        if attention_mask is not None and attention_mask.dim() == 2:
+            tokens = int(attention_mask.sum())
+        else:
+            # Packed batches carry a 4D mask, count everything that is not padding
+            tokens = int((input_ids != self.pad_token_id).sum())
+        self.callback.record_batch(tokens, input_ids.numel(), elapsed)
+        return batch
+
+
+class TelemetryCallback(TrainerCallback):
+    """Record per-step throughput, time breakdown and memory to a local file."""
+
+    def __init__(self, path = "telemetry.jsonl"):
+        self.path = path
+        self.records = []
+        self.file = None
+        self.writer = None
+        self._reset_step()
+
+    def _reset_step(self):
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.data_seconds = 0.0
+        self.step_start = time.perf_counter()
+        self.pre_optimizer = None
+        self.post_optimizer = None
+
+    def wrap_collator(self, collator, tokenizer):
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        return TelemetryCollator(collator, self, pad_token_id)
+
+    def record_batch(self, tokens, padded_tokens, seconds):
+        self.tokens += tokens
+        self.padded_tokens += padded_tokens
+        self.data_seconds += seconds
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        # Append so a resumed run keeps the records of the interrupted one
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, 'a', encoding='utf-8', newline='')
+        if self.path.endswith(".csv"):
+            self.writer = csv.DictWriter(self.file, fieldnames = FIELDS)
+            if is_new:
+                self.writer.writeheader()
+        self._reset_step()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self.pre_optimizer = time.perf_counter()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        self.post_optimizer = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        step_seconds = now - self.step_start
+        # Without the optimizer hooks (older transformers) everything counts as forward/backward
+        pre_optimizer = self.pre_optimizer or now
+        post_optimizer = self.post_optimizer or now
+        memory_mb, memory_kind = current_memory()
+
+        record = {
+            "step": state.global_step,
+            "step_seconds": step_seconds,
+            "data_seconds": self.data_seconds,
+            "forward_backward_seconds": max(pre_optimizer - self.step_start - self.data_seconds, 0.0),
+            "optimizer_seconds": post_optimizer - pre_optimizer,
+            "other_seconds": now - post_optimizer,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_fraction": 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            "tokens_per_second": self.tokens / step_seconds if step_seconds else 0.0,
+            "memory_mb": memory_mb,
+            "memory_kind": memory_kind,
+        }
+        self.records.append(record)
+        if self.file is not None:
+            if self.writer is not None:
+                self.writer.writerow(record)
+            else:
+                self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+        self._reset_step()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if state.is_world_process_zero:
+            print_summary(self.summary())
+
+    def summary(self):
+        """Aggregate the recorded steps, skipping the first one (warm-up, compilation)."""
+        records = self.records[1:] or self.records
+        if not records:
+            return {}
+        total_seconds = sum(r["step_seconds"] for r in records)
+        tokens = sum(r["tokens"] for r in records)
+        padded_tokens = sum(r["padded_tokens"] for r in records)
+        step_times = sorted(r["step_seconds"] for r in records)
+        memory = [r["memory_mb"] for r in records if r["memory_mb"] is not None]
+        summary = {
+            "steps": len(records),
+            "tokens_per_second": tokens / total_seconds if total_seconds else 0.0,
+            "padding_fraction": 1 - tokens / padded_tokens if padded_tokens else 0.0,
+            "step_seconds_p50": statistics.median(step_times),
+            "step_seconds_p95": step_times[min(int(len(step_times) * 0.95), len(step_times) - 1)],
+            "peak_memory_mb": max(memory) if memory else None,
+            "memory_kind": records[-1]["memory_kind"],
+        }
+        for part in ("data_seconds", "forward_backward_seconds", "optimizer_seconds", "other_seconds"):
+            share = sum(r[part] for r in records) / total_seconds if total_seconds else 0.0
+            summary[part.replace("_seconds", "_share")] = share
+        return summary
+
+
+def print_summary(summary):
+    if not summary:
+        print("No training steps recorded.")
+        return
+    print(f"\nTelemetry over {summary['steps']} steps:")
+    print(f"  {summary['tokens_per_second']:.0f} tokens/sec, {summary['padding_fraction']:.1%} padding")
+    print(f"  step time p50 {summary['step_seconds_p50']:.3f}s, p95 {summary['step_seconds_p95']:.3f}s")
+    print(f"  data {summary['data_share']:.1%}, forward/backward {summary['forward_backward_share']:.1%}, "
+          f"optimizer {summary['optimizer_share']:.1%}, other {summary['other_share']:.1%}")
+    if summary["peak_memory_mb"] is not None:
+        print(f"  peak memory {summary['peak_memory_mb']:.0f} MB ({summary['memory_kind']})")
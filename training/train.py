@@ -0,0 +1,329 @@
+"""Configurable, resumable fine-tuning entry point.
+
+Runs the same recipe as `llama3_2_(1b_and_3b)_conversational.py`, but reads
+its settings from a JSON config and is split into stages:
+
+* train: LoRA fine-tuning with periodic checkpoints, resumed automatically
+* eval:  held-out loss, perplexity and sample generations (eval_persona.py)
+* merge: save the merged 16-bit (or 4-bit) model
+* gguf:  export the GGUF quantizations used by the chat UI
+* adapter: convert the LoRA adapters alone to GGUF, to be served over a shared
+  base model by the chat UI instead of a merged copy
+
+Finished stages and their timings are recorded in `<output_dir>/run_state.json`
+and skipped on the next run as long as the settings they depend on are unchanged. Nothing is
+pushed to the Hub unless `push_to_hub.repo_id` is set and `HF_TOKEN` is in the
+environment.
+
+Usage:
+    python train.py --config train_config.json
+    python train.py --config train_config.json --stages merge,gguf --force
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+STAGES = ("train", "eval", "merge", "gguf", "adapter")
+
+# Where outputs, telemetry and the tokenization cache go; moving them changes no stage's result
+LOCATIONS = ("output_dir", "cache_dir", "telemetry_file")
+
+# Config sections that do not affect the output of a stage
+IRRELEVANT_SECTIONS = {
+    "train": ("stages", "push_to_hub", "merge", "gguf", "adapter") + LOCATIONS,
+    "eval": ("stages", "push_to_hub", "merge", "gguf", "adapter") + LOCATIONS,
+    "merge": ("stages", "push_to_hub", "gguf", "adapter") + LOCATIONS,
+    "gguf": ("stages", "push_to_hub", "merge", "adapter") + LOCATIONS,
+    "adapter": ("stages", "push_to_hub", "merge", "gguf") + LOCATIONS,
+}
+
+
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def stage_config_hash(config, stage):
+    """Hash the settings a stage depends on, so e.g. new GGUF methods don't redo training."""
+    relevant = {key: value for key, value in config.items() if key not in IRRELEVANT_SECTIONS[stage]}
+    return hashlib.sha256(json.dumps(relevant, sort_keys = True).encode("utf-8")).hexdigest()[:16]
+
+
+class RunState:
+    """Completed stages and their timings, persisted next to the checkpoints."""
+
+    def __init__(self, output_dir, config):
+        self.path = os.path.join(output_dir, "run_state.json")
+        self.config = config
+        self.stages = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.stages = json.load(f)
+
+    def is_done(self, stage):
+        entry = self.stages.get(stage, {})
+        return entry.get("config_hash") == stage_config_hash(self.config, stage)
+
+    def mark_done(self, stage, seconds):
+        self.stages[stage] = {
+            "config_hash": stage_config_hash(self.config, stage),
+            "seconds": round(seconds, 2),
+            "finished_at": datetime.now().isoformat(timespec = "seconds"),
+        }
+        # A retrained model invalidates everything built from it
+        if stage == "train":
+            for later in ("eval", "merge", "gguf", "adapter"):
+                self.stages.pop(later, None)
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.stages, f, indent = 2)
+        os.replace(tmp_path, self.path)
+
+
+class TrainingRun:
+    """Holds the model between stages so it is loaded at most once per process."""
+
+    def __init__(self, config):
+        self.config = config
+        self.output_dir = config["output_dir"]
+        # Keyed by the train settings: checkpoints of a different config (LR, epochs, LoRA r) are never resumed
+        self.checkpoint_dir = os.path.join(self.output_dir, "checkpoints", stage_config_hash(config, "train"))
+        self.lora_dir = os.path.join(self.output_dir, "lora")
+        self.merged_dir = os.path.join(self.output_dir, "merged")
+        self.gguf_dir = os.path.join(self.output_dir, "gguf")
+        self.adapter_dir = os.path.join(self.output_dir, "adapter")
+        self.model = None
+        self.tokenizer = None
+        self.splits = None
+
+    def load_model(self, model_name):
+        from unsloth import FastLanguageModel
+        from unsloth.chat_templates import get_chat_template
+
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name = model_name,
+            max_seq_length = self.config["max_seq_length"],
+            dtype = self.config["dtype"],
+            load_in_4bit = self.config["load_in_4bit"],
+        )
+        self.model = model
+        self.tokenizer = get_chat_template(tokenizer, chat_template = "llama-3.1")
+
+    def ensure_trained_model(self):
+        """Load the saved LoRA adapters when the train stage ran in an earlier process."""
+        if self.model is None:
+            if not os.path.isdir(self.lora_dir):
+                raise FileNotFoundError(f"No LoRA adapters in {self.lora_dir}, run the train stage first")
+            self.load_model(self.lora_dir)
+
+    def get_splits(self):
+        if self.splits is None:
+            from preprocess_dataset import load_or_build_dataset
+
+            dataset = load_or_build_dataset(self.tokenizer, self.config["dataset"],
+                                            self.config["max_seq_length"], self.config["cache_dir"],
+                                            outliers = self.config["outliers"])
+            # Same hash-based split as heldout.py, so evaluation never sees training data
+            fraction = self.config["eval_fraction"]
+            self.splits = {
+                "train": dataset.filter(lambda score: score >= fraction, input_columns = "held_out_score"),
+                "test": dataset.filter(lambda score: score < fraction, input_columns = "held_out_score"),
+            }
+        return self.splits
+
+    def batch_settings(self, lengths):
+        """Batching mode and training arguments, sized from the sample lengths when asked to."""
+        from length_stats import recommend_batching
+
+        batching = self.config["batching"]
+        training_args = dict(self.config["training"])
+        tokens_per_batch = self.config["tokens_per_batch"]
+        if batching == "auto" or tokens_per_batch:
+            recommendation = recommend_batching(lengths, self.config["max_seq_length"],
+                                                tokens_per_batch or 16384)
+            if batching == "auto":
+                batching = recommendation["batching"]
+            if tokens_per_batch:
+                training_args["per_device_train_batch_size"] = recommendation["modes"][batching]["per_device_train_batch_size"]
+            print(f"Batching: {batching}, per_device_train_batch_size = {training_args['per_device_train_batch_size']}")
+        return batching, training_args
+
+    def make_trainer(self, train_dataset):
+        import torch
+        from trl import SFTTrainer
+        from transformers import TrainingArguments, DataCollatorForSeq2Seq
+        from unsloth import is_bfloat16_supported
+        from packing import pack_dataset, PackedCollator, verify_segment_isolation
+        from telemetry import TelemetryCallback
+
+        batching, training_args = self.batch_settings(train_dataset["length"])
+        max_seq_length = self.config["max_seq_length"]
+        if batching == "packed":
+            train_dataset = pack_dataset(train_dataset, max_seq_length)
+            mask_dtype = torch.bfloat16 if is_bfloat16_supported() else torch.float16
+            data_collator = PackedCollator(self.tokenizer, mask_dtype = mask_dtype)
+            # Fails before training when the attention path drops the block-diagonal mask
+            verify_segment_isolation(self.model, data_collator)
+        else:
+            data_collator = DataCollatorForSeq2Seq(tokenizer = self.tokenizer)
+
+        telemetry = TelemetryCallback(os.path.join(self.output_dir, self.config["telemetry_file"]))
+        return SFTTrainer(
+            model = self.model,
+            tokenizer = self.tokenizer,
+            train_dataset = train_dataset,
+            max_seq_length = max_seq_length,
+            data_collator = telemetry.wrap_collator(data_collator, self.tokenizer),
+            callbacks = [telemetry],
+            dataset_kwargs = {"skip_prepare_dataset": True},
+            packing = False,
+            args = TrainingArguments(
+                **training_args,
+                group_by_length = batching == "grouped",
+                length_column_name = "length",
+                fp16 = not is_bfloat16_supported(),
+                bf16 = is_bfloat16_supported(),
+                save_strategy = "steps",
+                output_dir = self.checkpoint_dir,
+                report_to = "none",
+            ),
+        )
+
+    def train(self, resume = True):
+        from unsloth import FastLanguageModel
+        from transformers.trainer_utils import get_last_checkpoint
+
+        self.load_model(self.config["model_name"])
+        self.model = FastLanguageModel.get_peft_model(self.model, bias = "none", **self.config["lora"])
+
+        if not resume and os.path.isdir(self.checkpoint_dir):
+            # A fresh run writes new checkpoints here, stale ones must not be picked up later
+            shutil.rmtree(self.checkpoint_dir)
+        trainer = self.make_trainer(self.get_splits()["train"])
+        checkpoint = get_last_checkpoint(self.checkpoint_dir) if resume and os.path.isdir(self.checkpoint_dir) else None
+        if checkpoint:
+            print(f"Resuming from {checkpoint}")
+        stats = trainer.train(resume_from_checkpoint = checkpoint)
+        print(f"{round(stats.metrics['train_runtime'] / 60, 2)} minutes used for training.")
+
+        self.model.save_pretrained(self.lora_dir)
+        self.tokenizer.save_pretrained(self.lora_dir)
+        self.push("lora")
+
+    def eval(self):
+        from unsloth import FastLanguageModel
+        from eval_persona import evaluate_model, print_report
+        from heldout import split_conversations
+        from preprocess_dataset import load_raw_dataset
+
+        self.ensure_trained_model()
+        FastLanguageModel.for_inference(self.model)
+        conversations = load_raw_dataset(self.config["dataset"])["conversations"]
+        held_out = split_conversations(conversations, self.config["eval_fraction"])[1]
+
+        report = evaluate_model(self.model, self.tokenizer, held_out)
+        print_report(report)
+        with open(os.path.join(self.output_dir, "eval_report.json"), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent = 2, ensure_ascii = False)
+
+    def merge(self):
+        self.ensure_trained_model()
+        self.model.save_pretrained_merged(self.merged_dir, self.tokenizer,
+                                          save_method = self.config["merge"]["save_method"])
+        self.push("merged")
+
+    def gguf(self):
+        self.ensure_trained_model()
+        methods = self.config["gguf"]["quantization_methods"]
+        self.model.save_pretrained_gguf(self.gguf_dir, self.tokenizer, quantization_method = methods)
+        self.push("gguf")
+
+    def adapter(self):
+        """Convert the saved LoRA adapters to a GGUF adapter with llama.cpp's converter."""
+        import subprocess
+        import sys
+
+        if not os.path.isdir(self.lora_dir):
+            raise FileNotFoundError(f"No LoRA adapters in {self.lora_dir}, run the train stage first")
+        settings = self.config["adapter"]
+        if not os.path.exists(settings["converter"]):
+            raise FileNotFoundError(f"{settings['converter']} not found, the gguf stage installs llama.cpp")
+
+        os.makedirs(self.adapter_dir, exist_ok = True)
+        outfile = os.path.join(self.adapter_dir, settings["name"] + ".gguf")
+        subprocess.run([
+            sys.executable, settings["converter"], self.lora_dir,
+            "--base-model-id", self.config["model_name"],
+            "--outtype", settings["outtype"],
+            "--outfile", outfile,
+        ], check = True)
+        print(f"Copy {outfile} to ui/adapters/ to serve it over the base model")
+
+    def push(self, kind):
+        repo_id = self.config["push_to_hub"]["repo_id"]
+        token = os.environ.get("HF_TOKEN")
+        if not repo_id or not token:
+            return
+        if kind == "lora":
+            self.model.push_to_hub(repo_id, token = token)
+            self.tokenizer.push_to_hub(repo_id, token = token)
+        elif kind == "merged":
+            self.model.push_to_hub_merged(repo_id, self.tokenizer,
+                                          save_method = self.config["merge"]["save_method"], token = token)
+        elif kind == "gguf":
+            self.model.push_to_hub_gguf(repo_id, self.tokenizer,
+                                        quantization_method = self.config["gguf"]["quantization_methods"],
+                                        token = token)
+
+
+def run(config, stages, force = False, resume = True):
+    """Run the requested stages in order, skipping ones already finished."""
+    state = RunState(config["output_dir"], config)
+    training_run = TrainingRun(config)
+    timings = {}
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        if not force and state.is_done(stage):
+            print(f"⏭️  Skipping {stage}, finished {state.stages[stage]['finished_at']}")
+            continue
+
+        print(f"\n=== {stage} ===")
+        start = time.perf_counter()
+        if stage == "train":
+            training_run.train(resume = resume and not force)
+        else:
+            getattr(training_run, stage)()
+        timings[stage] = time.perf_counter() - start
+        state.mark_done(stage, timings[stage])
+        print(f"✅ {stage} finished in {timings[stage]:.1f}s")
+
+    if timings:
+        print("\nStage timings:")
+        for stage, seconds in timings.items():
+            print(f"  {stage:<7} {seconds:>10.1f}s")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Fine-tune Llama 3.2 on the Jack Sparrow dataset.")
+    parser.add_argument("--config", default = "train_config.json")
+    parser.add_argument("--stages", default = None, help = f"Comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--force", action = "store_true", help = "Rerun stages even if they already finished")
+    parser.add_argument("--no-resume", action = "store_true", help = "Start training from scratch instead of the last checkpoint")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    stages = args.stages.split(",") if args.stages else config["stages"]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    run(config, stages, force = args.force, resume = not args.no_resume)
@@ -0,0 +1,143 @@
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+STARTED = time.perf_counter()  # Startup is measured from here, before the model and its libraries load
+
+import repo_root  # noqa: F401
+from profiling import add_profile_argument, profile
+
+PROMPT = "You: "
+HELP = "Commands: /reset starts a new conversation, /stats shows memory and counters, /quit exits."
+
+def rss_mb() -> Optional[float]:
+    """Resident memory of this process in MiB, or None where it can't be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, AttributeError, ValueError):
+        return None
+
+class TerminalChat:
+    """Read-eval-print loop over a JackSparrowChat that prints answers as they stream."""
+
+    def __init__(self, chat, stream: bool = True):
+        self.chat = chat
+        self.stream = stream
+        self.streamed = []  # Pieces printed for the current attempt
+        self.last_seconds = None
+
+    def on_token(self, piece: str):
+        self.streamed.append(piece)
+        sys.stdout.write(piece)
+        sys.stdout.flush()
+
+    def on_retry(self):
+        # What was printed echoed the previous answer and is generated again
+        self.streamed = []
+        sys.stdout.write("\n[rephrasing]\nJack Sparrow: ")
+        sys.stdout.flush()
+
+    def ask(self, message: str) -> str:
+        print("Jack Sparrow: ", end="", flush=True)
+        start = time.perf_counter()
+        history_length = len(self.chat.conversation_history)
+        if self.stream:
+            self.streamed = []
+            response = self.chat.generate_response(message, on_token=self.on_token, on_retry=self.on_retry)
+            if len(self.chat.conversation_history) == history_length:
+                # Not answered: response is the error, and whatever streamed before it is incomplete
+                print(f"\n[error] {response}")
+            # A loop cut short or a cleaned-up answer no longer matches what was printed
+            elif "".join(self.streamed).strip() != response:
+                print(f"\n[final] {response}")
+            else:
+                print()
+        else:
+            response = self.chat.generate_response(message)
+            print(response)
+        self.last_seconds = time.perf_counter() - start
+        return response
+
+    def print_stats(self):
+        rss = rss_mb()
+        print(f"Memory: {rss:.0f} MiB resident" if rss is not None else "Memory: unknown")
+        print(f"History: {len(self.chat.conversation_history)} messages, "
+              f"{self.chat.aborted_generations} generations stopped early, "
+              f"{self.chat.unused_token_budget} tokens of decode budget unused")
+        if self.last_seconds is not None:
+            print(f"Last answer: {self.last_seconds:.2f} s")
+
+    def run(self):
+        print(HELP)
+        while True:
+            try:
+                message = input(PROMPT).strip()
+            except (EOFError, KeyboardInterrupt):
+                print()
+                return
+            if not message:
+                continue
+            if message in ("/quit", "/exit"):
+                return
+            if message == "/reset":
+                self.chat.reset()
+                print("New conversation.")
+            elif message == "/stats":
+                self.print_stats()
+            else:
+                try:
+                    self.ask(message)
+                except KeyboardInterrupt:
+                    # generate_response already dropped the unanswered message
+                    print("\n[interrupted]")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat with Captain Jack Sparrow in the terminal.")
+    parser.add_argument("--model", help="GGUF file (default: JACK_MODEL_PATH or the Hugging Face cache)")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=100)
+    parser.add_argument("--adapter", help="LoRA adapter in adapters/ to answer with (needs a base model GGUF)")
+    parser.add_argument("--no-quotes", action="store_true", help="Don't retrieve dataset lines for each message")
+    parser.add_argument("--no-stream", action="store_true", help="Print whole answers instead of streaming them")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    # Imported after parsing so --help and argument errors don't pay for them
+    from chat_model import JackSparrowChat
+
+    adapters = None
+    if args.adapter:
+        from lora_adapters import find_adapters
+        adapters = find_adapters()
+        if args.adapter not in adapters:
+            parser.error(f"No adapter named {args.adapter} in adapters/")
+
+    quote_index = None
+    if not args.no_quotes:
+        from quote_index import DEFAULT_DATASET as QUOTE_DATASET, QuoteIndex
+        if os.path.exists(QUOTE_DATASET):
+            quote_index = QuoteIndex.open()
+
+    chat = JackSparrowChat(model_path=args.model, n_threads=args.threads, adapters=adapters,
+                           adapter=args.adapter, quote_index=quote_index)
+    chat.max_tokens = args.max_tokens
+    if not chat.initialize_model():
+        print("Failed to initialize the model. Exiting...")
+        sys.exit(1)
+
+    rss = rss_mb()
+    print(f"Ready in {time.perf_counter() - STARTED:.2f} s" + (f", {rss:.0f} MiB resident" if rss is not None else ""))
+    try:
+        import readline  # Line editing and history for input() where the platform has it
+    except ImportError:
+        pass
+    with profile(args.profile, memory=args.profile_memory):
+        TerminalChat(chat, stream=not args.no_stream).run()
@@ -0,0 +1,270 @@
+from typing import Callable, List, Dict
+from repetition import RepetitionDetector, word_overlap
+from model_files import MODEL_REPO, MODEL_FILE, resolve_model_path, verify_model_file, warm_up_file
+from quote_index import QuoteIndex
+
+import repo_root  # noqa: F401
+from profiling import profiled, span, span_iter
+from llama_template import ASSISTANT_START, STOP_SEQUENCES, SYSTEM_HEADER, render_message
+
+SYSTEM_PROMPT = """You are Captain Jack Sparrow from Pirates of the Caribbean.
+You are witty, clever, and always have a plan. You speak in a distinctive pirate manner.
+You should:
+1. Stay in character as Jack Sparrow
+2. Be concise and avoid repeating yourself
+3. Use pirate-like expressions (e.g., "Savvy?", "Aye")
+4. Never break character or acknowledge being an AI
+5. Keep responses focused on the current conversation
+6. Do not include stage directions or multiple responses
+7. Speak naturally as if in a conversation"""
+
+QUOTES_HEADER = "Things you have said in similar moments, for your voice only:"
+
+class JackSparrowChat:
+    def __init__(self, model_path: str = None, repo_id: str = MODEL_REPO, model_file: str = MODEL_FILE,
+                 n_threads: int = 4, use_mmap: bool = True, use_mlock: bool = False,
+                 verify: bool = True, warm_up: bool = True, adapters: Dict[str, str] = None,
+                 adapter: str = None, quote_index: QuoteIndex = None, quote_count: int = 3,
+                 max_quote_tokens: int = 150):
+        self.llm = None
+        self.model_path = model_path  # Explicit GGUF path, otherwise resolved from the Hugging Face cache
+        self.repo_id = repo_id
+        self.model_file = model_file
+        self.n_threads = n_threads  # Adjust based on your CPU
+        self.use_mmap = use_mmap  # Map the weights instead of copying them into memory
+        self.use_mlock = use_mlock  # Pin the weights in RAM so they are never paged out
+        self.verify = verify
+        self.warm_up = warm_up  # Read the weights in the background so the first answer isn't stalled
+        # LoRA adapters by name, applied over the shared base model; use a base (unmerged) GGUF with them
+        self.adapter_paths = adapters or {}
+        self.adapter = adapter  # Adapter used for the next answer, None for the base model
+        self.adapters = None
+        # Canonical lines retrieved per message and shown to the model as examples of Jack's voice
+        self.quote_index = quote_index
+        self.quote_count = quote_count
+        self.max_quote_tokens = max_quote_tokens
+        self.conversation_history: List[Dict] = []
+        self.max_seq_length = 2048
+        self.max_tokens = 100
+        self.max_retries = 2  # Regenerations when an answer echoes the previous one
+        self.last_response = ""
+        self.aborted_generations = 0
+        # max_tokens minus the tokens decoded, summed over aborted generations. An upper
+        # bound on the decode work saved: most answers would have ended at <|eot_id|> earlier
+        self.unused_token_budget = 0
+        # First history message still rendered into the prompt. It only moves forward
+        # when the context is full, so consecutive prompts share a long token prefix
+        # and llama.cpp can reuse its cached state for it.
+        self.history_start = 0
+        
+    def initialize_model(self):
+        """Initialize the model."""
+        try:
+            print("Initializing model... This may take a moment.")
+            
+            model_path = resolve_model_path(self.model_path, self.repo_id, self.model_file)
+            if self.verify and not verify_model_file(model_path):
+                return False
+            
+            # Imported here so front ends start (and show --help) without loading llama.cpp
+            from llama_cpp import Llama
+            
+            # Initialize llama.cpp model
+            self.llm = Llama(
+                model_path=model_path,
+                n_ctx=self.max_seq_length,
+                n_threads=self.n_threads,
+                n_gpu_layers=0,  # CPU only
+                use_mmap=self.use_mmap,
+                use_mlock=self.use_mlock
+            )
+            
+            if self.adapter_paths:
+                from lora_adapters import AdapterPool
+                self.adapters = AdapterPool(self.llm, self.adapter_paths)
+                print(f"LoRA adapters available: {', '.join(self.adapters.names())}")
+            
+            # With mlock the weights are already resident
+            if self.warm_up and self.use_mmap and not self.use_mlock:
+                warm_up_file(model_path)
+            
+            print("Model initialized successfully!")
+            return True
+        except Exception as e:
+            print(f"Error initializing model: {e}")
+            return False
+
+    def clean_response(self, response: str) -> str:
+        """Clean up the response by removing stage directions and multiple responses."""
+        # Split by "Jack Sparrow:" to get only the first response
+        parts = response.split('Jack Sparrow:')
+        if parts:
+            response = parts[0].strip()
+        return response.strip()
+
+    def quote_block(self, user_input: str) -> str:
+        """Retrieved lines for this message as a short system message, within max_quote_tokens."""
+        if not self.quote_index or not self.quote_count:
+            return ""
+        lines = []
+        budget = self.max_quote_tokens * 4  # Roughly four characters per token
+        for prompt, answer in self.quote_index.search(user_input, self.quote_count):
+            line = f'- "{prompt}" -> "{answer}"'
+            if len(line) > budget:
+                continue
+            budget -= len(line)
+            lines.append(line)
+        return render_message("system", QUOTES_HEADER + "\n" + "\n".join(lines)) if lines else ""
+
+    def format_prompt(self, user_input: str) -> str:
+        """Render the conversation with the Llama 3.1 chat template used for fine-tuning."""
+        # <|begin_of_text|> is added by llama.cpp when the prompt is tokenized
+        system = render_message("system", SYSTEM_HEADER + SYSTEM_PROMPT)
+        # The quotes change with every message, so they go after the history to keep
+        # the cached prefix (system prompt and history) reusable
+        ending = self.quote_block(user_input) + render_message("user", user_input) + ASSISTANT_START
+        budget = self.max_seq_length - self.max_tokens
+
+        while True:
+            history = self.conversation_history[self.history_start:]
+            prompt = system + "".join(render_message(m["role"], m["content"]) for m in history) + ending
+            if not history:
+                return prompt
+            with span("llama.cpp.tokenize"):
+                prompt_tokens = len(self.llm.tokenize(prompt.encode("utf-8"), special=True))
+            if prompt_tokens <= budget:
+                return prompt
+            # Drop the older half of the history in one go, keeping user/assistant pairs together
+            self.history_start += max(2, len(history) // 2 // 2 * 2)
+
+    def is_repetitive(self, response: str) -> bool:
+        """Check if the response is repetitive."""
+        if not self.last_response:
+            return False
+        
+        # If more than 70% of words are the same as in the last response
+        return word_overlap(self.clean_response(response), self.clean_response(self.last_response)) > 0.7
+
+    def decode(self, prompt: str, attempt: int, check_echo: bool, on_token: Callable[[str], None] = None):
+        """Stream one answer, stopping as soon as it loops or echoes the previous answer."""
+        detector = RepetitionDetector(self.last_response if check_echo else "")
+        text = ""
+        generated = 0
+        
+        # Each retry samples a little hotter and penalizes repeats harder
+        # The prompt is evaluated on the first step, so that span covers prefill as well
+        for chunk in span_iter("llama.cpp.decode", self.llm(
+            prompt,
+            max_tokens=self.max_tokens,
+            temperature=0.8 + 0.2 * attempt,
+            top_p=0.9,
+            repeat_penalty=1.1 + 0.15 * attempt,
+            stop=STOP_SEQUENCES,
+            stream=True
+        )):
+            piece = chunk["choices"][0]["text"]
+            text += piece
+            generated += 1
+            if on_token:
+                on_token(piece)
+            reason = detector.feed(piece)
+            if reason:
+                self.aborted_generations += 1
+                self.unused_token_budget += self.max_tokens - generated
+                print(f"Stopped after {generated} tokens ({reason}), "
+                      f"{self.unused_token_budget} tokens of decode budget unused so far.")
+                # A loop still has a usable beginning, an echo gets regenerated
+                return (detector.text_before_loop(), None) if reason == "loop" else (text, reason)
+        
+        return text, None
+
+    @profiled()
+    def generate_response(self, user_input: str, on_token: Callable[[str], None] = None,
+                          on_retry: Callable[[], None] = None) -> str:
+        """
+        Generate a response from the model, passing each streamed piece to on_token if given.
+        on_retry is called before an answer is regenerated, so a front end can drop what it streamed.
+        On an error or Ctrl-C the history is left as it was, so only a grown history means an answer;
+        the error is returned as the response, KeyboardInterrupt is raised again.
+        """
+        if not self.llm:
+            return "Model not initialized. Please check your setup."
+
+        history_length = len(self.conversation_history)
+        try:
+            self.apply_adapter()
+            
+            # Format the prompt before adding the new message to the history
+            prompt = self.format_prompt(user_input)
+            self.conversation_history.append({"role": "user", "content": user_input})
+            
+            for attempt in range(self.max_retries + 1):
+                if attempt and on_retry:
+                    on_retry()
+                check_echo = attempt < self.max_retries
+                response, reason = self.decode(prompt, attempt, check_echo, on_token)
+                response = self.clean_response(response)
+                # Short answers are too small for the n-gram check, compare whole words
+                if reason is None and not (check_echo and self.is_repetitive(response)):
+                    break
+            
+            # Update last response and add to history
+            self.last_response = response
+            self.conversation_history.append({"role": "assistant", "content": response})
+            return response
+
+        except BaseException as e:
+            # Forget the unanswered message so the history keeps alternating
+            del self.conversation_history[history_length:]
+            if not isinstance(e, Exception):
+                raise
+            return f"Error generating response: {e}"
+
+    def apply_adapter(self):
+        """Switch the shared model to the selected adapter if another one is active."""
+        if self.adapters is None or self.adapters.active == self.adapter:
+            return
+        with span("llama.cpp.adapter"):
+            seconds = self.adapters.activate(self.adapter)
+        print(f"Switched to adapter {self.adapter or 'base'} in {seconds * 1000:.1f} ms")
+
+    def reset(self):
+        """Forget the conversation."""
+        self.conversation_history = []
+        self.history_start = 0
+        self.last_response = ""
+
+    def export_session(self) -> dict:
+        """The per-conversation state, so one loaded model can take turns serving several sessions."""
+        return {
+            "conversation_history": self.conversation_history,
+            "history_start": self.history_start,
+            "last_response": self.last_response,
+            "adapter": self.adapter,
+        }
+
+    def import_session(self, session: dict = None):
+        """Continue a session exported earlier, or start a new one when session is None."""
+        self.reset()
+        if session:
+            self.conversation_history = session["conversation_history"]
+            self.history_start = session["history_start"]
+            self.last_response = session["last_response"]
+            self.adapter = session["adapter"]
+
+    def save_model_state(self) -> dict:
+        """Snapshot of the llama.cpp state that matches the current history."""
+        return {"history_start": self.history_start, "adapter": self.adapter, "llama_state": self.llm.save_state()}
+
+    def restore_history(self, messages: List[Dict], model_state: dict = None):
+        """Continue an earlier conversation, reusing a saved model state if there is one."""
+        self.conversation_history = [{"role": m["role"], "content": m["content"]} for m in messages]
+        self.last_response = next((m["content"] for m in reversed(messages) if m["role"] == "assistant"), "")
+        self.history_start = 0
+        if model_state is not None and self.llm:
+            # The cached tokens already cover the history, so it is not evaluated again;
+            # they were computed with the adapter active at the time
+            self.adapter = model_state.get("adapter")
+            self.apply_adapter()
+            self.history_start = model_state["history_start"]
+            self.llm.load_state(model_state["llama_state"])
@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import json
+import os
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scheduler import NORMAL, DeadlineExceeded, Overloaded, RequestScheduler
+from session_manager import SessionManager
+
+class ChatEngine:
+    """
+    A chat model behind a SessionManager and a RequestScheduler, with the
+    scheduler's event loop running on its own thread so blocking callers
+    (HTTP handler threads) can use it.
+    """
+
+    def __init__(self, chat, max_queue: int = 64, max_per_session: int = 4, keep_model_state: bool = True):
+        self.chat_model = chat
+        self.sessions = SessionManager(chat, keep_model_state=keep_model_state)
+        self.scheduler = RequestScheduler(self.sessions.chat, concurrency=1, max_queue=max_queue,
+                                          max_per_session=max_per_session)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.scheduler.start(), self.loop).result()
+
+    def submit(self, session_id: str, message: str, priority: int = NORMAL, timeout: float = None,
+               on_token=None):
+        """Schedule a message from any thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(
+            self.scheduler.submit(session_id, message, priority, timeout, on_token), self.loop
+        )
+
+    def stats(self) -> dict:
+        return {"scheduler": self.scheduler.stats(), "sessions": self.sessions.stats()}
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.scheduler.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.sessions.close()
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /chat {"session_id", "message", "priority"?, "timeout"?} streams
+    newline-delimited JSON: {"token": ...} per generated piece, then
+    {"response": ...} with the final answer (a regenerated answer can differ
+    from the streamed pieces). A full queue answers 429, an expired request 504.
+    GET /stats returns the scheduler and session metrics.
+    """
+
+    protocol_version = "HTTP/1.1"
+    engine: ChatEngine = None
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the server output under load
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, payload: dict):
+        line = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.engine.stats())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/chat":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            session_id, message = request["session_id"], request["message"]
+        except (ValueError, KeyError):
+            self.send_json(400, {"error": "Expected JSON with session_id and message"})
+            return
+
+        # Tokens arrive on the generating thread; None marks the end of the request
+        events = queue.Queue()
+        future = self.engine.submit(session_id, message, request.get("priority", NORMAL),
+                                    request.get("timeout"), events.put)
+        future.add_done_callback(lambda f: events.put(None))
+
+        first = events.get()
+        if first is None:
+            error = future.exception()
+            if isinstance(error, Overloaded):
+                self.send_json(429, {"error": str(error)})
+            elif isinstance(error, DeadlineExceeded):
+                self.send_json(504, {"error": str(error)})
+            elif error is not None:
+                self.send_json(500, {"error": str(error)})
+            else:
+                self.send_json(200, {"response": future.result()})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        piece = first
+        while piece is not None:
+            self.write_chunk({"token": piece})
+            piece = events.get()
+        error = future.exception()
+        self.write_chunk({"error": str(error)} if error else {"response": future.result()})
+        self.wfile.write(b"0\r\n\r\n")
+
+def serve(engine: ChatEngine, host: str = "127.0.0.1", port: int = 8000):
+    ChatRequestHandler.engine = engine
+    server = ThreadingHTTPServer((host, port), ChatRequestHandler)
+    server.daemon_threads = True
+    print(f"Serving Jack Sparrow on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        engine.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the Jack Sparrow chat model over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--stub", action="store_true", help="Use a fake model that emits tokens at a fixed rate")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=20.0)
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_chat import StubChat
+        chat = StubChat(tokens_per_second=args.stub_tokens_per_second)
+    else:
+        from chat_model import JackSparrowChat
+        from quote_index import DEFAULT_DATASET as QUOTE_DATASET, QuoteIndex
+        chat = JackSparrowChat(quote_index=QuoteIndex.open() if os.path.exists(QUOTE_DATASET) else None)
+    if chat.initialize_model():
+        serve(ChatEngine(chat, max_queue=args.max_queue, keep_model_state=not args.stub), args.host, args.port)
+    else:
+        print("Failed to initialize the model. Exiting...")
@@ -1,14 +1,18 @@
-import torch
-from llama_cpp import Llama
 import sys
-import time
-from typing import List, Dict
+import argparse
 import os
-import re
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 from datetime import datetime
 import threading
+import queue
+from chat_model import JackSparrowChat
+from session_store import SessionStore
+from lora_adapters import find_adapters
+from quote_index import DEFAULT_DATASET as QUOTE_DATASET, QuoteIndex
+
+import repo_root  # noqa: F401
+from profiling import add_profile_argument, profile
 
 # Dark theme colors - updated to match screenshot
 DARK_BG = "#2b2b2b"  # Main background
@@ -22,127 +26,19 @@ DARK_INPUT_BG = "#333333"  # Input field background
 DARK_INPUT_FG = "#ffffff"  # Input field text
 HEADER_BG = "#000000"  # Header background
 
-class JackSparrowChat:
-    def __init__(self):
-        self.llm = None
-        self.conversation_history: List[Dict] = []
-        self.max_seq_length = 2048
-        self.last_response = ""
-        
-    def initialize_model(self):
-        """Initialize the model."""
-        try:
-            print("Initializing model... This may take a moment.")
-            
-            # Initialize llama.cpp model
-            self.llm = Llama    (
-                model_path="C:\\Users\\Emeric\\.cache\\huggingface\\hub\\models--Devwa--jackSparrow\\snapshots\\54a555e116e1b87d707362cd816b552d32f5895d\\unsloth.Q4_K_M.gguf",
-                n_ctx=self.max_seq_length,
-                n_threads=4,  # Adjust based on your CPU
-                n_gpu_layers=0  # CPU only
-            )
-            
-            print("Model initialized successfully!")
-            return True
-        except Exception as e:
-            print(f"Error initializing model: {e}")
-            return False
-
-    def clean_response(self, response: str) -> str:
-        """Clean up the response by removing stage directions and multiple responses."""
-        # Split by "Jack Sparrow:" to get only the first response
-        parts = response.split('Jack Sparrow:')
-        if parts:
-            response = parts[0].strip()
-        return response.strip()
-
-    def format_prompt(self, user_input: str) -> str:
-        """Format the prompt for the model."""
-        # System message to guide the model's behavior
-        system_prompt = """You are Captain Jack Sparrow from Pirates of the Caribbean. 
-You are witty, clever, and always have a plan. You speak in a distinctive pirate manner.
-You should:
-1. Stay in character as Jack Sparrow
-2. Be concise and avoid repeating yourself
-3. Use pirate-like expressions (e.g., "Savvy?", "Aye")
-4. Never break character or acknowledge being an AI
-5. Keep responses focused on the current conversation
-6. Do not include stage directions or multiple responses
-7. Speak naturally as if in a conversation
-
-Current conversation:"""
-
-        # Build context from conversation history
-        context = system_prompt + "\n"
-        for msg in self.conversation_history[-3:]:  # Keep last 3 messages for context
-            if msg["role"] == "user":
-                context += f"Human: {msg['content']}\n"
-            else:
-                context += f"Jack: {msg['content']}\n"
-        
-        # Add current user input
-        context += f"Human: {user_input}\nJack:"
-        return context
-
-    def is_repetitive(self, response: str) -> bool:
-        """Check if the response is repetitive."""
-        if not self.last_response:
-            return False
-        
-        # Clean both responses before comparison
-        clean_response = self.clean_response(response)
-        clean_last = self.clean_response(self.last_response)
-        
-        # Check if the response is too similar to the last one
-        response_words = set(clean_response.lower().split())
-        last_words = set(clean_last.lower().split())
-        similarity = len(response_words.intersection(last_words)) / len(response_words)
-        
-        return similarity > 0.7  # If more than 70% of words are the same
-
-    def generate_response(self, user_input: str) -> str:
-        """Generate a response from the model."""
-        if not self.llm:
-            return "Model not initialized. Please check your setup."
-
-        # Add user message to history
-        self.conversation_history.append({"role": "user", "content": user_input})
-
-        try:
-            # Format the prompt
-            prompt = self.format_prompt(user_input)
-            
-            # Generate response
-            output = self.llm(
-                prompt,
-                max_tokens=100,  # Reduced to prevent multiple responses
-                temperature=0.8,
-                top_p=0.9,
-                stop=["Human:", "\n\n", "Jack:", "Jack Sparrow:"],  # Stop at next speaker or double newline
-                stream=False
-            )
-            
-            # Get the response
-            response = output["choices"][0]["text"]
-            
-            # Clean up the response
-            response = self.clean_response(response)
-            
-            # Check for repetition
-            if self.is_repetitive(response):
-                return self.generate_response(user_input)  # Try again
-            
-            # Update last response and add to history
-            self.last_response = response
-            self.conversation_history.append({"role": "assistant", "content": response})
-            return response
-
-        except Exception as e:
-            return f"Error generating response: {e}"
+# Transcript rendering
+MAX_RENDERED_MESSAGES = 500  # Messages kept in the text widget, older ones stay in the transcript only
+PAGE_SIZE = 100  # Messages paged back in when scrolling to the top
+FLUSH_INTERVAL_MS = 50  # How often queued UI updates are applied
+BASE_ADAPTER_LABEL = "base model"
+WELCOME_MESSAGE = "Ahoy there! Captain Jack Sparrow at your service. What brings you to my humble presence?"
 
 class ChatGUI:
-    def __init__(self, chat_model):
+    def __init__(self, chat_model, session_store: SessionStore = None, keep_model_state: bool = False):
         self.chat_model = chat_model
+        self.session_store = session_store
+        self.keep_model_state = keep_model_state  # Save the llama.cpp state on close for instant resume
+        self.session_id = None  # Created with the first message of a chat
         self.root = tk.Tk()
         self.root.title("Jack Sparrow Chat")
         self.root.geometry("800x600")
@@ -158,7 +54,15 @@ class ChatGUI:
         # Set window icon
         self.root.iconbitmap("jack_icon.ico") if os.path.exists("jack_icon.ico") else None
         
+        # Every message of the session as (timestamp, sender, message); only the tail is rendered
+        self.transcript = []
+        self.first_rendered = 0  # Transcript index of the first message in the widget
+        # UI updates queued from any thread, applied in batches on the Tk thread
+        self.ui_updates = queue.Queue()
+        
         self.setup_ui()
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_ui_updates)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def setup_ui(self):
         # Main container with dark background
@@ -182,6 +86,19 @@ class ChatGUI:
         )
         title_label.pack()
         
+        # Adapter selector, only when the model serves several fine-tunes
+        if self.chat_model.adapters:
+            self.adapter_choice = tk.StringVar(value=self.chat_model.adapter or BASE_ADAPTER_LABEL)
+            adapter_menu = ttk.Combobox(
+                header_frame,
+                textvariable=self.adapter_choice,
+                values=[BASE_ADAPTER_LABEL] + self.chat_model.adapters.names(),
+                state="readonly",
+                width=20
+            )
+            adapter_menu.pack(side=tk.RIGHT)
+            adapter_menu.bind("<<ComboboxSelected>>", self.on_adapter_selected)
+        
         # Chat history
         chat_frame = tk.Frame(main_frame, bg=DARK_BG)
         chat_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
@@ -203,6 +120,8 @@ class ChatGUI:
             borderwidth=5
         )
         self.chat_history.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+        self.chat_history.configure(yscrollcommand=self.on_transcript_scroll)
+        self.configure_tags()
         
         # Input area with rounded corners
         input_frame = tk.Frame(main_frame, bg=DARK_BG)
@@ -258,101 +177,324 @@ class ChatGUI:
         )
         clear_button.pack(side=tk.RIGHT, padx=10)
         
-        # Add welcome message
-        self.add_message("Jack Sparrow", "Ahoy there! Captain Jack Sparrow at your service. What brings you to my humble presence?")
-        
-    def add_message(self, sender: str, message: str):
-        self.chat_history.config(state=tk.NORMAL)
-        
-        # Add timestamp
-        timestamp = datetime.now().strftime("%H:%M")
+        # Saved sessions, only when there is a store to resume from
+        if self.session_store:
+            sessions_button = tk.Button(
+                input_frame,
+                text="Sessions",
+                command=self.show_sessions,
+                bg=DARK_SECONDARY,
+                fg=DARK_FG,
+                relief="flat",
+                borderwidth=0,
+                padx=10,
+                pady=5,
+                font=("Verdana", 10),
+                activebackground=DARK_SECONDARY,
+                activeforeground=DARK_FG
+            )
+            sessions_button.pack(side=tk.RIGHT)
         
-        # Format message without backgrounds, just colored text
-        if sender == "You":
-            self.chat_history.insert(tk.END, f"\n[{timestamp}] ", "timestamp")
-            self.chat_history.insert(tk.END, "You: ", "user_name")
-            self.chat_history.insert(tk.END, f"{message}\n", "user_message")
-        else:
-            self.chat_history.insert(tk.END, f"\n[{timestamp}] ", "timestamp")
-            self.chat_history.insert(tk.END, "Jack Sparrow: ", "assistant_name")
-            self.chat_history.insert(tk.END, f"{message}\n", "assistant_message")
-        
-        self.chat_history.see(tk.END)
-        self.chat_history.config(state=tk.DISABLED)
+        # Add welcome message
+        self.add_message("Jack Sparrow", WELCOME_MESSAGE)
         
-        # Configure tags with colors but no backgrounds
+    def configure_tags(self):
+        """Configure the transcript text tags once."""
+        # Colored text but no backgrounds
         self.chat_history.tag_configure("timestamp", foreground="#888888")
         self.chat_history.tag_configure("user_name", foreground=DARK_USER_TEXT, font=("Verdana", 12, "bold"))
         self.chat_history.tag_configure("user_message", foreground=DARK_USER_TEXT)
         self.chat_history.tag_configure("assistant_name", foreground=DARK_ASSISTANT_TEXT, font=("Verdana", 12, "bold"))
         self.chat_history.tag_configure("assistant_message", foreground=DARK_ASSISTANT_TEXT)
-    
-    def show_typing_indicator(self):
-        self.chat_history.config(state=tk.NORMAL)
-        self.chat_history.insert(tk.END, "\nJack Sparrow is typing...\n", "typing")
-        self.chat_history.see(tk.END)
-        self.chat_history.config(state=tk.DISABLED)
         self.chat_history.tag_configure("typing", foreground=DARK_TYPING, font=("Verdana", 10, "italic"))
+        
+    def add_message(self, sender: str, message: str, created_at: float = None):
+        """Queue a message for the transcript, safe to call from any thread."""
+        moment = datetime.fromtimestamp(created_at) if created_at else datetime.now()
+        self.ui_updates.put(("message", (moment.strftime("%H:%M"), sender, message)))
+    
+    def message_chunks(self, timestamp: str, sender: str, message: str) -> list:
+        """Text and tag pairs for a single Text.insert call."""
+        if sender == "You":
+            return [f"\n[{timestamp}] ", "timestamp", "You: ", "user_name", f"{message}\n", "user_message"]
+        return [f"\n[{timestamp}] ", "timestamp", "Jack Sparrow: ", "assistant_name",
+                f"{message}\n", "assistant_message"]
+    
+    def flush_ui_updates(self):
+        """Apply all queued UI updates with a single widget state change and scroll."""
+        new_messages = []
+        typing = None
+        input_enabled = None
+        calls = []
+        while True:
+            try:
+                kind, value = self.ui_updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "message":
+                new_messages.append(value)
+            elif kind == "typing":
+                typing = value
+            elif kind == "input":
+                input_enabled = value
+            elif kind == "call":
+                calls.append(value)
+        
+        if new_messages or typing is not None:
+            self.chat_history.config(state=tk.NORMAL)
+            self.delete_typing_indicator()
+            if new_messages:
+                self.append_messages(new_messages)
+            if typing:
+                self.chat_history.insert(tk.END, "\nJack Sparrow is typing...\n", "typing")
+            self.chat_history.config(state=tk.DISABLED)
+            self.chat_history.see(tk.END)
+        
+        if input_enabled is not None:
+            self.set_input_enabled(input_enabled)
+        
+        # Work handed back from other threads, after the messages queued before it are drawn
+        for call in calls:
+            call()
+        
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_ui_updates)
     
-    def remove_typing_indicator(self):
-        """Remove the typing indicator."""
+    def append_messages(self, messages: list):
+        """Render new messages at the end and trim the widget back to MAX_RENDERED_MESSAGES."""
+        start = len(self.transcript)
+        self.transcript.extend(messages)
+        
+        # Only the messages that survive trimming are worth inserting
+        first_new = max(start, len(self.transcript) - MAX_RENDERED_MESSAGES)
+        for index in range(first_new, len(self.transcript)):
+            position = self.chat_history.index("end-1c")
+            self.chat_history.insert(tk.END, *self.message_chunks(*self.transcript[index]))
+            self.chat_history.mark_set(f"msg{index}", position)
+        
+        if first_new > start:
+            # Everything rendered before is older than the new tail
+            self.chat_history.delete("1.0", f"msg{first_new}")
+            self.unset_marks(self.first_rendered, first_new)
+            self.first_rendered = first_new
+        self.trim_rendered()
+    
+    def trim_rendered(self):
+        """Drop the oldest messages from the widget once it holds too many."""
+        # Trim in whole pages so deleting from the front stays rare
+        if len(self.transcript) - self.first_rendered <= MAX_RENDERED_MESSAGES + PAGE_SIZE:
+            return
+        keep_from = len(self.transcript) - MAX_RENDERED_MESSAGES
+        self.chat_history.delete("1.0", f"msg{keep_from}")
+        self.unset_marks(self.first_rendered, keep_from)
+        self.first_rendered = keep_from
+    
+    def unset_marks(self, start: int, end: int):
+        for index in range(start, end):
+            self.chat_history.mark_unset(f"msg{index}")
+    
+    def on_transcript_scroll(self, first, last):
+        """Keep the scrollbar in sync and page older messages back in at the top."""
+        self.chat_history.vbar.set(first, last)
+        if float(first) == 0.0 and self.first_rendered > 0:
+            self.root.after_idle(self.page_in_older)
+    
+    def page_in_older(self):
+        """Insert the previous page of messages above the rendered ones."""
+        if self.first_rendered == 0 or float(self.chat_history.yview()[0]) > 0.0:
+            return
+        new_first = max(0, self.first_rendered - PAGE_SIZE)
         self.chat_history.config(state=tk.NORMAL)
-        # Remove the last two lines (typing indicator)
-        self.chat_history.delete("end-2l linestart", "end")
+        # Insert newest first at the top; existing marks move right with the text
+        for index in range(self.first_rendered - 1, new_first - 1, -1):
+            self.chat_history.insert("1.0", *self.message_chunks(*self.transcript[index]))
+            self.chat_history.mark_set(f"msg{index}", "1.0")
         self.chat_history.config(state=tk.DISABLED)
+        added = self.first_rendered - new_first
+        self.first_rendered = new_first
+        # Keep the message the user was looking at in place
+        self.chat_history.see(f"msg{new_first + added}")
+    
+    def on_adapter_selected(self, event=None):
+        """The switch itself happens before the next answer, on the generation thread."""
+        choice = self.adapter_choice.get()
+        self.chat_model.adapter = None if choice == BASE_ADAPTER_LABEL else choice
     
-    def generate_response_thread(self, message: str):
+    def is_busy(self) -> bool:
+        """Whether an answer is being generated or a session restored (input stays disabled until then)."""
+        return str(self.send_button["state"]) == tk.DISABLED
+    
+    def set_input_enabled(self, enabled: bool):
+        state = tk.NORMAL if enabled else tk.DISABLED
+        self.message_input.config(state=state)
+        self.send_button.config(state=state)
+        if enabled:
+            self.message_input.focus()
+    
+    def delete_typing_indicator(self):
+        ranges = self.chat_history.tag_ranges("typing")
+        if ranges:
+            self.chat_history.delete(ranges[0], ranges[-1])
+    
+    def generate_response_thread(self, message: str, session_id: str = None):
         """Generate response in a separate thread."""
-        # Disable input while generating
-        self.message_input.config(state=tk.DISABLED)
-        self.send_button.config(state=tk.DISABLED)
-        
-        # Show typing indicator
-        self.show_typing_indicator()
-        
         # Generate response
+        history_length = len(self.chat_model.conversation_history)
         response = self.chat_model.generate_response(message)
         
-        # Remove typing indicator and add response
-        self.remove_typing_indicator()
-        self.add_message("Jack Sparrow", response)
+        # Errors are shown but never make it into the history or the store
+        if self.session_store and len(self.chat_model.conversation_history) == history_length + 2:
+            self.session_store.append_message(session_id, "user", message)
+            self.session_store.append_message(session_id, "assistant", response)
         
-        # Re-enable input
-        self.message_input.config(state=tk.NORMAL)
-        self.send_button.config(state=tk.NORMAL)
-        self.message_input.focus()
+        # The typing indicator is removed before the response is drawn, then input is re-enabled
+        self.ui_updates.put(("typing", False))
+        self.add_message("Jack Sparrow", response)
+        self.ui_updates.put(("input", True))
     
     def send_message(self, event=None):
+        if self.is_busy():
+            return  # A second Enter before the first answer is back
         message = self.message_input.get().strip()
         if message:
             # Clear input immediately
             self.message_input.delete(0, tk.END)
             
-            # Add user message to chat immediately
+            if self.session_store and self.session_id is None:
+                self.session_id = self.session_store.create_session(message)
+            
+            # Disable input right away so nothing else is sent while generating
+            self.set_input_enabled(False)
+            # Add user message to chat and show the typing indicator
             self.add_message("You", message)
+            self.ui_updates.put(("typing", True))
             
             # Start response generation in a separate thread
             threading.Thread(
                 target=self.generate_response_thread,
-                args=(message,),
+                args=(message, self.session_id),
                 daemon=True
             ).start()
     
-    def clear_chat(self):
+    def reset_transcript(self):
         self.chat_history.config(state=tk.NORMAL)
         self.chat_history.delete(1.0, tk.END)
         self.chat_history.config(state=tk.DISABLED)
-        self.chat_model.conversation_history = []
-        self.chat_model.last_response = ""
-        self.add_message("Jack Sparrow", "Ahoy there! Captain Jack Sparrow at your service. What brings you to my humble presence?")
+        self.unset_marks(self.first_rendered, len(self.transcript))
+        self.transcript = []
+        self.first_rendered = 0
+    
+    def clear_chat(self):
+        """Start a new chat; the previous one stays in the session store."""
+        if self.is_busy():
+            return  # The answer being generated belongs to the current chat
+        self.reset_transcript()
+        self.save_session_state()
+        self.session_id = None
+        self.chat_model.reset()
+        self.add_message("Jack Sparrow", WELCOME_MESSAGE)
+    
+    def show_sessions(self):
+        """List saved sessions, most recent first; double-click one to resume it."""
+        # Reads wait for the queued writes, so they run off the Tk thread
+        def load():
+            sessions = self.session_store.list_sessions()
+            self.ui_updates.put(("call", lambda: self.open_sessions_window(sessions)))
+        
+        threading.Thread(target=load, daemon=True).start()
+    
+    def open_sessions_window(self, sessions: list):
+        window = tk.Toplevel(self.root, bg=DARK_BG)
+        window.title("Saved Sessions")
+        window.geometry("500x400")
+        listbox = tk.Listbox(
+            window,
+            font=("Verdana", 10),
+            bg=DARK_SECONDARY,
+            fg=DARK_FG,
+            selectbackground=DARK_ACCENT,
+            relief="flat",
+            borderwidth=5
+        )
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for session in sessions:
+            updated = datetime.fromtimestamp(session["updated_at"]).strftime("%Y-%m-%d %H:%M")
+            listbox.insert(tk.END, f"{updated}  ({session['message_count']})  {session['title']}")
+        
+        def on_select(event=None):
+            selection = listbox.curselection()
+            if selection:
+                window.destroy()
+                self.resume_session(sessions[selection[0]]["id"])
+        
+        listbox.bind("<Double-Button-1>", on_select)
+        listbox.bind("<Return>", on_select)
+    
+    def resume_session(self, session_id: str):
+        if self.is_busy():
+            return  # Still answering the current chat
+        self.save_session_state()
+        # Reading waits for the queued writes and loading a model state can take a moment,
+        # so both run off the Tk thread with input disabled
+        self.set_input_enabled(False)
+        
+        def restore():
+            messages = self.session_store.load_messages(session_id)
+            saved = self.session_store.load_model_state(session_id)
+            # A saved state is only valid for the exact history it was taken after
+            model_state = saved[1] if saved and saved[0] == len(messages) else None
+            self.ui_updates.put(("call", lambda: self.show_session(session_id, messages, model_state)))
+            self.chat_model.restore_history(messages, model_state)
+            self.ui_updates.put(("input", True))
+        
+        threading.Thread(target=restore, daemon=True).start()
+    
+    def show_session(self, session_id: str, messages: list, model_state: dict = None):
+        """Replace the transcript with a resumed session."""
+        if model_state is not None and self.chat_model.adapters:
+            self.adapter_choice.set(model_state.get("adapter") or BASE_ADAPTER_LABEL)
+        self.reset_transcript()
+        self.session_id = session_id
+        self.add_message("Jack Sparrow", WELCOME_MESSAGE)
+        for m in messages:
+            self.add_message("You" if m["role"] == "user" else "Jack Sparrow", m["content"], m["created_at"])
+    
+    def save_session_state(self):
+        """Store the model state of the current session so resuming skips re-ingesting it."""
+        if not (self.session_store and self.keep_model_state and self.session_id and self.chat_model.llm):
+            return
+        try:
+            self.session_store.save_model_state(
+                self.session_id,
+                len(self.chat_model.conversation_history),
+                self.chat_model.save_model_state()
+            )
+        except Exception as e:
+            print(f"Error saving model state: {e}")
+    
+    def on_close(self):
+        if self.session_store:
+            # The model is in use while busy, and its state would not match the history anyway
+            if not self.is_busy():
+                self.save_session_state()
+            self.session_store.close()
+        self.root.destroy()
     
     def run(self):
         self.root.mainloop()
 
 if __name__ == "__main__":
-    chat = JackSparrowChat()
+    parser = argparse.ArgumentParser(description="Chat with Captain Jack Sparrow.")
+    parser.add_argument("--keep-model-state", action="store_true",
+                        help="Save the llama.cpp state with each session so resuming it skips re-reading the history")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    # Adapters in ui/adapters/ are served over one base model (set JACK_MODEL_PATH to its GGUF)
+    quote_index = QuoteIndex.open() if os.path.exists(QUOTE_DATASET) else None
+    chat = JackSparrowChat(adapters=find_adapters(), quote_index=quote_index)
     if chat.initialize_model():
-        gui = ChatGUI(chat)
-        gui.run()
+        gui = ChatGUI(chat, SessionStore("chat_sessions.db"), keep_model_state=args.keep_model_state)
+        with profile(args.profile, memory=args.profile_memory):
+            gui.run()
     else:
         print("Failed to initialize the model. Exiting...") 
\ No newline at end of file
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from scheduler import DeadlineExceeded, Overloaded, percentile
+
+DEFAULT_DATASET = os.path.join("..", "dataset", "jack_sharegpt_dataset.jsonl")
+
+def load_sessions(path: str = DEFAULT_DATASET, turns: int = 3, limit: int = None) -> List[List[str]]:
+    """
+    Build chat sessions from the dataset's user lines.
+
+    Most dataset conversations are a single exchange, so consecutive ones are
+    chained into sessions of `turns` user messages, which gives the model a
+    growing history like a real chat.
+    """
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                for m in json.loads(line)["conversations"]:
+                    if m["from"] in ("human", "user"):
+                        messages.append(m["value"])
+    sessions = [messages[i:i + turns] for i in range(0, len(messages) - turns + 1, turns)]
+    return sessions[:limit] if limit else sessions
+
+class InProcessTarget:
+    """Send messages to a ChatEngine in this process."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def send(self, session_id: str, message: str, timeout: float, on_token) -> str:
+        return await asyncio.wrap_future(self.engine.submit(session_id, message, timeout=timeout, on_token=on_token))
+
+    def stats(self) -> dict:
+        return self.engine.stats()
+
+    def close(self):
+        self.engine.close()
+
+class HttpTarget:
+    """Send messages to chat_server.py; each request runs on its own thread."""
+
+    def __init__(self, url: str, max_connections: int):
+        self.url = urllib.parse.urlparse(url)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    def connect(self):
+        import http.client
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=600)
+
+    def post(self, session_id: str, message: str, timeout: float, on_token) -> str:
+        connection = self.connect()
+        try:
+            body = json.dumps({"session_id": session_id, "message": message, "timeout": timeout})
+            connection.request("POST", "/chat", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            if response.status == 429:
+                raise Overloaded(response.read().decode("utf-8"))
+            if response.status == 504:
+                raise DeadlineExceeded(response.read().decode("utf-8"))
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {response.read().decode('utf-8')}")
+            # Streamed answers are JSON lines; an answer without tokens is one JSON object
+            final = None
+            for line in response:
+                event = json.loads(line)
+                if "token" in event:
+                    on_token(event["token"])
+                elif "error" in event:
+                    raise RuntimeError(event["error"])
+                else:
+                    final = event["response"]
+            return final
+        finally:
+            connection.close()
+
+    async def send(self, session_id: str, message: str, timeout: float, on_token) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.post, session_id, message, timeout, on_token)
+
+    def stats(self) -> dict:
+        connection = self.connect()
+        try:
+            connection.request("GET", "/stats")
+            return json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+class LoadTest:
+    """
+    Replay sessions against a target and record per-request timings.
+
+    With arrival_rate set, sessions start as a Poisson process at that rate
+    (open loop) with at most `concurrency` running; otherwise `concurrency`
+    virtual users each run one session after another (closed loop). Users
+    wait an exponentially distributed think time between messages.
+    """
+
+    def __init__(self, target, sessions: List[List[str]], concurrency: int = 4, arrival_rate: float = None,
+                 think_time: float = 1.0, timeout: float = None, duration: float = None, seed: int = 3407):
+        self.target = target
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.arrival_rate = arrival_rate
+        self.think_time = think_time
+        self.timeout = timeout
+        self.duration = duration
+        self.random = random.Random(seed)
+        self.results = []
+        self.started_at = None
+
+    def expired(self) -> bool:
+        return self.duration is not None and time.perf_counter() - self.started_at > self.duration
+
+    async def run_session(self, index: int):
+        session_id = f"load-{index}"
+        for turn, message in enumerate(self.sessions[index]):
+            if turn and self.think_time:
+                await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+            if self.expired():
+                return
+
+            result = {"session": session_id, "turn": turn, "status": "ok", "ttft": None, "tokens": 0}
+            start = time.perf_counter()
+
+            def on_token(piece):
+                if result["ttft"] is None:
+                    result["ttft"] = time.perf_counter() - start
+                result["tokens"] += 1
+
+            try:
+                await self.target.send(session_id, message, self.timeout, on_token)
+            except Overloaded:
+                result["status"] = "overloaded"
+            except DeadlineExceeded:
+                result["status"] = "deadline"
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = str(e)
+            result["latency"] = time.perf_counter() - start
+            self.results.append(result)
+            if result["status"] != "ok":
+                return  # A refused message ends the conversation, like a user giving up
+
+    async def closed_loop(self):
+        next_session = iter(range(len(self.sessions)))
+
+        async def user():
+            for index in next_session:
+                if self.expired():
+                    return
+                await self.run_session(index)
+
+        await asyncio.gather(*(user() for _ in range(self.concurrency)))
+
+    async def open_loop(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
+
+        async def limited(index):
+            async with slots:
+                await self.run_session(index)
+
+        for index in range(len(self.sessions)):
+            if self.expired():
+                break
+            tasks.append(asyncio.create_task(limited(index)))
+            await asyncio.sleep(self.random.expovariate(self.arrival_rate))
+        await asyncio.gather(*tasks)
+
+    async def run(self) -> dict:
+        self.started_at = time.perf_counter()
+        if self.arrival_rate:
+            await self.open_loop()
+        else:
+            await self.closed_loop()
+        return self.report(time.perf_counter() - self.started_at)
+
+    def report(self, seconds: float) -> dict:
+        ok = [r for r in self.results if r["status"] == "ok"]
+        ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+        latencies = [r["latency"] for r in ok]
+        statuses = {}
+        for r in self.results:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+        return {
+            "seconds": seconds,
+            "requests": len(self.results),
+            "statuses": statuses,
+            "requests_per_second": len(ok) / seconds if seconds else 0.0,
+            "tokens_per_second": sum(r["tokens"] for r in ok) / seconds if seconds else 0.0,
+            "ttft": {name: percentile(ttfts, q) for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+            "latency": {name: percentile(latencies, q) for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+        }
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests in {report['seconds']:.1f}s: "
+          + ", ".join(f"{count} {status}" for status, count in report["statuses"].items()))
+    print(f"Throughput: {report['requests_per_second']:.2f} requests/s, {report['tokens_per_second']:.1f} tokens/s")
+    for name in ("ttft", "latency"):
+        values = report[name]
+        print(f"{name.upper():<8} p50 {values['p50']:.3f}s  p90 {values['p90']:.3f}s  p99 {values['p99']:.3f}s")
+
+async def main(args):
+    sessions = load_sessions(args.dataset, args.turns, args.sessions)
+    if args.url:
+        target = HttpTarget(args.url, args.concurrency)
+    else:
+        from chat_server import ChatEngine
+        if args.stub:
+            from stub_chat import StubChat
+            chat = StubChat(tokens_per_second=args.stub_tokens_per_second)
+        else:
+            from chat_model import JackSparrowChat
+            chat = JackSparrowChat()
+            if not chat.initialize_model():
+                print("Failed to initialize the model. Exiting...")
+                return
+        target = InProcessTarget(ChatEngine(chat, max_queue=args.max_queue, keep_model_state=not args.stub))
+
+    print(f"Replaying {len(sessions)} sessions of {args.turns} messages against "
+          f"{args.url or ('the stub model' if args.stub else 'the local model')}...")
+    test = LoadTest(target, sessions, args.concurrency, args.arrival_rate, args.think_time,
+                    args.timeout, args.duration)
+    report = await test.run()
+    report["server"] = target.stats()
+    target.close()
+    print_report(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"report": report, "requests": test.results}, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dataset conversations against the chat engine.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--url", default=None, help="chat_server.py address, e.g. http://127.0.0.1:8000 (default: in-process)")
+    parser.add_argument("--stub", action="store_true", help="In-process: fake model emitting tokens at a fixed rate")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=20.0)
+    parser.add_argument("--sessions", type=int, default=50, help="Number of sessions to replay")
+    parser.add_argument("--turns", type=int, default=3, help="User messages per session")
+    parser.add_argument("--concurrency", type=int, default=4, help="Simultaneous users")
+    parser.add_argument("--arrival-rate", type=float, default=None, help="New sessions per second (open loop)")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds between a user's messages")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds a message may wait in the queue")
+    parser.add_argument("--duration", type=float, default=None, help="Stop starting requests after this many seconds")
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--output", default="load_test.json")
+    asyncio.run(main(parser.parse_args()))
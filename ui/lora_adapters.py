@@ -0,0 +1,108 @@
+import glob
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import llama_cpp
+
+ADAPTER_DIR = "adapters"  # Every *.gguf LoRA adapter in here is offered by its file name
+MAX_LOADED_ADAPTERS = 4
+
+# llama.cpp renamed the adapter API (llama_lora_adapter_* -> llama_adapter_lora_*), accept both
+_init_adapter = getattr(llama_cpp, "llama_adapter_lora_init", None) or getattr(llama_cpp, "llama_lora_adapter_init", None)
+_set_adapter = getattr(llama_cpp, "llama_set_adapter_lora", None) or getattr(llama_cpp, "llama_lora_adapter_set", None)
+_clear_adapters = getattr(llama_cpp, "llama_clear_adapter_lora", None) or getattr(llama_cpp, "llama_lora_adapter_clear", None)
+_free_adapter = getattr(llama_cpp, "llama_adapter_lora_free", None) or getattr(llama_cpp, "llama_lora_adapter_free", None)
+
+def find_adapters(adapter_dir: str = ADAPTER_DIR) -> Dict[str, str]:
+    """Map adapter names (file names without .gguf) to their paths."""
+    paths = sorted(glob.glob(os.path.join(adapter_dir, "*.gguf")))
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+class AdapterPool:
+    """
+    LoRA adapters attached on demand to one shared llama.cpp base model.
+
+    The base weights are loaded once; switching persona only loads the small
+    adapter file (cached, least recently used ones are freed) and changes which
+    adapter the context applies. Load and switch times are kept for stats().
+    """
+
+    def __init__(self, llm, adapters: Dict[str, str], scale: float = 1.0,
+                 max_loaded: int = MAX_LOADED_ADAPTERS):
+        if None in (_init_adapter, _set_adapter, _clear_adapters):
+            raise RuntimeError("This llama-cpp-python build has no LoRA adapter API, please upgrade it")
+        self.llm = llm
+        self.paths = dict(adapters)
+        self.scale = scale
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()  # name -> adapter handle, most recently used last
+        self.active: Optional[str] = None  # None means the plain base model
+        self.metrics = {"switches": 0, "switch_seconds": 0.0, "last_switch_seconds": 0.0,
+                        "loads": 0, "load_seconds": 0.0, "cache_hits": 0}
+
+    def names(self) -> list:
+        return list(self.paths)
+
+    def load(self, name: str):
+        """Return the adapter handle for name, loading it from disk if it isn't cached."""
+        if name in self.loaded:
+            self.loaded.move_to_end(name)
+            self.metrics["cache_hits"] += 1
+            return self.loaded[name]
+        if name not in self.paths:
+            raise KeyError(f"Unknown adapter: {name}")
+
+        start = time.perf_counter()
+        adapter = _init_adapter(self.llm.model, self.paths[name].encode("utf-8"))
+        if not adapter:
+            raise RuntimeError(f"Failed to load LoRA adapter {self.paths[name]}")
+        self.metrics["loads"] += 1
+        self.metrics["load_seconds"] += time.perf_counter() - start
+        self.loaded[name] = adapter
+
+        # Never free the adapter the context is using or the one just requested
+        while len(self.loaded) > max(self.max_loaded, 2):
+            oldest = next(n for n in self.loaded if n not in (self.active, name))
+            handle = self.loaded.pop(oldest)
+            if _free_adapter is not None:
+                _free_adapter(handle)
+        return adapter
+
+    def activate(self, name: Optional[str]) -> float:
+        """Apply adapter name (None for the base model) and return the switch time in seconds."""
+        if name == self.active:
+            return 0.0
+
+        start = time.perf_counter()
+        adapter = self.load(name) if name is not None else None
+        _clear_adapters(self.llm.ctx)
+        if adapter is not None:
+            _set_adapter(self.llm.ctx, adapter, self.scale)
+        # The cached prompt was computed with other weights and can't be reused
+        self.llm.reset()
+        self.active = name
+
+        seconds = time.perf_counter() - start
+        self.metrics["switches"] += 1
+        self.metrics["switch_seconds"] += seconds
+        self.metrics["last_switch_seconds"] = seconds
+        return seconds
+
+    def stats(self) -> dict:
+        switches = self.metrics["switches"]
+        return {
+            **self.metrics,
+            "average_switch_seconds": self.metrics["switch_seconds"] / switches if switches else 0.0,
+            "loaded": list(self.loaded),
+            "active": self.active,
+        }
+
+    def close(self):
+        _clear_adapters(self.llm.ctx)
+        if _free_adapter is not None:
+            for handle in self.loaded.values():
+                _free_adapter(handle)
+        self.loaded.clear()
+        self.active = None
@@ -0,0 +1,139 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+MODEL_REPO = "Devwa/jackSparrow"
+MODEL_FILE = "unsloth.Q4_K_M.gguf"
+CHECKSUM_CACHE = "model_checksums.json"
+READ_CHUNK = 8 * 1024 * 1024
+
+def hf_cache_dir() -> str:
+    """Hugging Face hub cache directory, honouring the same environment variables as huggingface_hub."""
+    if os.environ.get("HF_HUB_CACHE"):
+        return os.environ["HF_HUB_CACHE"]
+    hf_home = os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface"))
+    return os.path.join(hf_home, "hub")
+
+def find_in_hf_cache(repo_id: str, filename: str, cache_dir: str) -> Optional[str]:
+    """Locate filename in the snapshot refs/main points to, else in the newest snapshot that has it."""
+    repo_dir = os.path.join(cache_dir, "models--" + repo_id.replace("/", "--"))
+    ref_path = os.path.join(repo_dir, "refs", "main")
+    if os.path.exists(ref_path):
+        with open(ref_path, 'r', encoding='utf-8') as f:
+            candidate = os.path.join(repo_dir, "snapshots", f.read().strip(), filename)
+        if os.path.exists(candidate):
+            return candidate
+    candidates = glob.glob(os.path.join(repo_dir, "snapshots", "*", filename))
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+def resolve_model_path(model_path: str = None, repo_id: str = MODEL_REPO, filename: str = MODEL_FILE,
+                       cache_dir: str = None, download: bool = True) -> str:
+    """
+    Find the GGUF file to load.
+
+    Tries, in order: an explicit path (argument or JACK_MODEL_PATH), the
+    Hugging Face cache layout, and finally a download with huggingface_hub.
+    """
+    model_path = model_path or os.environ.get("JACK_MODEL_PATH")
+    if model_path:
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        return model_path
+
+    cache_dir = cache_dir or hf_cache_dir()
+    cached = find_in_hf_cache(repo_id, filename, cache_dir)
+    if cached:
+        return cached
+
+    if not download:
+        raise FileNotFoundError(f"{filename} from {repo_id} is not in {cache_dir}")
+    try:
+        from huggingface_hub import hf_hub_download
+    except ImportError:
+        raise FileNotFoundError(f"{filename} is not cached and huggingface_hub is not installed to download it")
+    print(f"Downloading {filename} from {repo_id}...")
+    return hf_hub_download(repo_id=repo_id, filename=filename, cache_dir=cache_dir)
+
+def expected_checksum(path: str) -> Optional[str]:
+    """Hugging Face stores LFS files as blobs named by their sha256, which snapshots link to."""
+    real_path = os.path.realpath(path)
+    name = os.path.basename(real_path)
+    if os.path.basename(os.path.dirname(real_path)) == "blobs" and len(name) == 64:
+        return name
+    return None
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify_model_file(path: str, expected: str = None, cache_path: str = None) -> bool:
+    """
+    Check the model file against its expected sha256.
+
+    The hash is remembered together with the file size and modification time,
+    so later launches only re-hash the file when it changed.
+    """
+    expected = expected or expected_checksum(path)
+    if not expected:
+        print("No checksum known for the model file, skipping verification.")
+        return True
+
+    real_path = os.path.realpath(path)
+    cache_path = cache_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), CHECKSUM_CACHE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+
+    stat = os.stat(real_path)
+    entry = cache.get(real_path)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        checksum = entry["sha256"]
+    else:
+        start = time.perf_counter()
+        checksum = file_sha256(real_path)
+        print(f"Hashed model file in {time.perf_counter() - start:.1f}s")
+        cache[real_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": checksum}
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+
+    if checksum != expected:
+        print(f"Model file checksum mismatch: expected {expected}, got {checksum}")
+        return False
+    return True
+
+def warm_up_file(path: str, on_done=None) -> threading.Thread:
+    """
+    Read the model file in the background so its pages are in the page cache
+    before the first generation faults them in through mmap.
+    """
+    def run():
+        start = time.perf_counter()
+        size = 0
+        with open(path, 'rb', buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            buffer = bytearray(READ_CHUNK)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                size += read
+        seconds = time.perf_counter() - start
+        print(f"Model warm-up read {size / 1024 / 1024:.0f} MB in {seconds:.1f}s")
+        if on_done:
+            on_done(seconds)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,179 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import time
+from collections import Counter
+from typing import List, Tuple
+
+DEFAULT_DATASET = os.path.join("..", "dataset", "jack_sharegpt_dataset.jsonl")
+DEFAULT_INDEX = "quote_index.bin"
+MAGIC = b"JQIX"
+FORMAT_VERSION = 1
+K1 = 1.2
+B = 0.75
+SEPARATOR = "\x1f"  # Between the prompt and Jack's line in the stored text
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by do for from had has have he her him his i if in into is it its me my "
+    "no not of on or our she so than that the their them then there they this to up us was we were what "
+    "when where which who why will with would you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z']+", text.lower()) if word not in STOPWORDS]
+
+def source_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def load_pairs(dataset_path: str) -> List[Tuple[str, str]]:
+    """(prompt, Jack's line) for every exchange in a ShareGPT dataset."""
+    pairs = []
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            messages = json.loads(line)["conversations"]
+            for prompt, answer in zip(messages, messages[1:]):
+                if prompt["from"] in ("human", "user") and answer["from"] in ("assistant", "gpt"):
+                    pairs.append((prompt["value"], answer["value"]))
+    return pairs
+
+def build_index(dataset_path: str = DEFAULT_DATASET, index_path: str = DEFAULT_INDEX):
+    """
+    Write a BM25 index of the dataset's exchanges to index_path.
+
+    Layout: magic, version, header length, a JSON header with the vocabulary
+    (term -> postings offset, count, idf) and section offsets, then uint32
+    arrays for the postings (doc, term frequency), document lengths and text
+    offsets, and finally the UTF-8 text of every exchange.
+    """
+    pairs = load_pairs(dataset_path)
+    doc_terms = [Counter(tokenize(prompt + " " + answer)) for prompt, answer in pairs]
+    postings = {}
+    for doc, terms in enumerate(doc_terms):
+        for term, count in terms.items():
+            postings.setdefault(term, []).append((doc, count))
+
+    n_docs = len(pairs)
+    vocab = {}
+    flat = []
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+        vocab[term] = [len(flat) // 2, len(entries), idf]
+        for doc, count in entries:
+            flat.extend((doc, count))
+
+    lengths = [sum(terms.values()) for terms in doc_terms]
+    texts = [(prompt + SEPARATOR + answer).encode("utf-8") for prompt, answer in pairs]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+
+    header = {
+        "source": source_signature(dataset_path),
+        "n_docs": n_docs,
+        "avgdl": sum(lengths) / n_docs if n_docs else 0.0,
+        "vocab": vocab,
+        "postings_count": len(flat),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 4)  # Keep the uint32 arrays aligned
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack("<II", FORMAT_VERSION, len(header_bytes)) + header_bytes)
+        for values in (flat, lengths, offsets):
+            f.write(struct.pack(f"<{len(values)}I", *values))
+        f.write(b"".join(texts))
+    os.replace(tmp_path, index_path)
+    print(f"Indexed {n_docs} exchanges ({len(vocab)} terms) into {index_path}")
+
+class QuoteIndex:
+    """
+    Memory-mapped BM25 index over Jack's lines.
+
+    The postings and texts stay in the mapped file and are read in place, so
+    opening the index costs only the vocabulary, and a query touches just the
+    postings of its own words.
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX):
+        with open(index_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:4] != MAGIC:
+            raise ValueError(f"{index_path} is not a quote index")
+        version, header_length = struct.unpack_from("<II", self.mm, 4)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{index_path} has format {version}, expected {FORMAT_VERSION}")
+        start = 12 + header_length
+        header = json.loads(self.mm[12:start])
+        self.source = header["source"]
+        self.n_docs = header["n_docs"]
+        self.avgdl = header["avgdl"]
+        self.vocab = header["vocab"]
+
+        base = memoryview(self.mm)
+        words = base[start:].cast("I")
+        self.postings = words[:header["postings_count"]]
+        self.lengths = words[header["postings_count"]:header["postings_count"] + self.n_docs]
+        offset_start = header["postings_count"] + self.n_docs
+        self.offsets = words[offset_start:offset_start + self.n_docs + 1]
+        self.text_start = start + 4 * (offset_start + self.n_docs + 1)
+        self.views = [base, words, self.postings, self.lengths, self.offsets]
+        self.last_search_seconds = 0.0
+
+    @classmethod
+    def open(cls, dataset_path: str = DEFAULT_DATASET, index_path: str = DEFAULT_INDEX) -> "QuoteIndex":
+        """Open the index, rebuilding it first when the dataset changed since it was built."""
+        if os.path.exists(index_path):
+            index = cls(index_path)
+            if index.source == source_signature(dataset_path):
+                return index
+            index.close()
+        build_index(dataset_path, index_path)
+        return cls(index_path)
+
+    def text(self, doc: int) -> Tuple[str, str]:
+        start = self.text_start + self.offsets[doc]
+        end = self.text_start + self.offsets[doc + 1]
+        prompt, answer = self.mm[start:end].decode("utf-8").split(SEPARATOR, 1)
+        return prompt, answer
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, str]]:
+        """The k best matching (prompt, Jack's line) pairs, most relevant first."""
+        start = time.perf_counter()
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self.vocab.get(term)
+            if entry is None:
+                continue
+            offset, count, idf = entry
+            for i in range(2 * offset, 2 * (offset + count), 2):
+                doc = self.postings[i]
+                tf = self.postings[i + 1]
+                norm = K1 * (1 - B + B * self.lengths[doc] / self.avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        results = []
+        seen = set()
+        for doc in heapq.nlargest(k * 2, scores, key=scores.get):
+            prompt, answer = self.text(doc)
+            if answer not in seen:
+                seen.add(answer)
+                results.append((prompt, answer))
+            if len(results) == k:
+                break
+        self.last_search_seconds = time.perf_counter() - start
+        return results
+
+    def close(self):
+        # The memoryviews must be released before the map can be closed
+        for view in reversed(self.views):
+            view.release()
+        self.mm.close()
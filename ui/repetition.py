@@ -0,0 +1,96 @@
+"""
+Early detection of repetitive answers while they are being decoded.
+
+`RepetitionDetector` watches the streamed text of one answer for a word
+n-gram that loops within it, or for n-grams mostly copied from the previous
+answer, so decoding can stop before the token budget is spent.
+`word_overlap` compares whole answers, for ones too short for n-grams.
+"""
+
+import re
+from collections import defaultdict
+from typing import Optional
+
+WORD_PATTERN = re.compile(r"\S+")
+
+def normalize_words(text: str) -> list:
+    """Lowercase words without surrounding punctuation, dropping empty ones."""
+    words = (re.sub(r"[^\w']", "", word.lower()) for word in text.split())
+    return [word for word in words if word]
+
+def word_overlap(response: str, previous: str) -> float:
+    """Share of the response's distinct words that also appear in previous (0 for an empty response)."""
+    response_words = set(normalize_words(response))
+    if not response_words:
+        return 0.0
+    return len(response_words & set(normalize_words(previous))) / len(response_words)
+
+class RepetitionDetector:
+    """
+    Watch a response while it is being decoded and flag repetition early.
+
+    Text pieces from the token stream are fed in as they arrive. Two kinds of
+    repetition are reported:
+    - "loop": the same n-gram of words appears max_repeats times in this response
+    - "echo": most n-grams so far also appear in the previous answer
+    """
+
+    def __init__(self, previous_response: str = "", n: int = 3, max_repeats: int = 3,
+                 echo_threshold: float = 0.7, min_echo_ngrams: int = 4):
+        self.n = n
+        self.max_repeats = max_repeats
+        self.echo_threshold = echo_threshold
+        self.min_echo_ngrams = min_echo_ngrams
+        previous_words = normalize_words(previous_response)
+        self.previous_ngrams = {tuple(previous_words[i:i + n]) for i in range(len(previous_words) - n + 1)}
+
+        self.text = ""
+        self.scan_pos = 0
+        self.words = []  # (normalized word, offset in text)
+        self.ngram_offsets = defaultdict(list)
+        self.ngram_count = 0
+        self.echo_count = 0
+        self.loop_offset = None
+
+    def feed(self, piece: str) -> Optional[str]:
+        """Add streamed text; return "loop" or "echo" as soon as repetition is clear."""
+        self.text += piece
+        for match in WORD_PATTERN.finditer(self.text, self.scan_pos):
+            # The last word may still grow with the next piece
+            if match.end() == len(self.text):
+                break
+            self.scan_pos = match.end()
+            reason = self._add_word(match.group(), match.start())
+            if reason:
+                return reason
+        return None
+
+    def _add_word(self, raw_word: str, offset: int) -> Optional[str]:
+        word = re.sub(r"[^\w']", "", raw_word.lower())
+        if not word:
+            return None
+        self.words.append((word, offset))
+        if len(self.words) < self.n:
+            return None
+
+        window = self.words[-self.n:]
+        ngram = tuple(w for w, _ in window)
+        offsets = self.ngram_offsets[ngram]
+        offsets.append(window[0][1])
+        if len(offsets) >= self.max_repeats:
+            self.loop_offset = offsets[1]
+            return "loop"
+
+        self.ngram_count += 1
+        if ngram in self.previous_ngrams:
+            self.echo_count += 1
+        if (self.ngram_count >= self.min_echo_ngrams
+                and self.echo_count / self.ngram_count >= self.echo_threshold):
+            return "echo"
+        return None
+
+    def text_before_loop(self) -> str:
+        """The response up to where the loop started repeating itself."""
+        if self.loop_offset is None:
+            return self.text
+        return self.text[:self.loop_offset].rstrip()
@@ -0,0 +1,219 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+# Lower numbers are served first
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+RECENT_SAMPLES = 1000  # Wait and service times kept for the percentiles in stats()
+
+class Overloaded(Exception):
+    """Raised when a request is refused because the queue or the session's share of it is full."""
+
+class DeadlineExceeded(Exception):
+    """Raised when a request is still queued when its deadline passes."""
+
+class Request:
+    def __init__(self, session_id: str, message: str, priority: int, deadline: float, future: asyncio.Future,
+                 on_token: Callable[[str], None] = None):
+        self.session_id = session_id
+        self.message = message
+        self.on_token = on_token
+        self.priority = priority
+        self.deadline = deadline  # loop.time() after which the request is dropped, or None
+        self.future = future
+        self.queued_at = time.perf_counter()
+        self.timer = None
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class RequestScheduler:
+    """
+    Async admission control and queueing in front of a blocking generate function.
+
+    generate(session_id, message) -> str is run on `concurrency` threads, e.g.
+    WorkerPool.chat with one thread per worker, or SessionManager.chat, which
+    also accepts an on_token callback for streaming. Requests are admitted while the
+    queue has room (max_queue overall, max_per_session per session), otherwise
+    submit raises Overloaded so callers can back off. Queued requests are served
+    by priority, and round-robin between sessions within a priority so one busy
+    session can't starve the others; a session never has two requests running
+    at once. A request whose deadline passes while queued fails with
+    DeadlineExceeded without reaching the model.
+    """
+
+    def __init__(self, generate: Callable[[str, str], str], concurrency: int = 1, max_queue: int = 64,
+                 max_per_session: int = 4, default_timeout: float = None):
+        self.generate = generate
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.default_timeout = default_timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="generate")
+        # Per priority: the sessions with queued requests in round-robin order, and their requests
+        self.rotation: Dict[int, deque] = {p: deque() for p in PRIORITY_NAMES}
+        self.pending: Dict[int, Dict[str, deque]] = {p: {} for p in PRIORITY_NAMES}
+        self.queued_per_session: Dict[str, int] = {}
+        self.running_sessions = set()
+        self.depth = 0
+        self.wakeup = None  # Created by start(), on Python < 3.10 an Event belongs to the loop it's made in
+        self.tasks = []
+        self.waits = deque(maxlen=RECENT_SAMPLES)
+        self.service_times = deque(maxlen=RECENT_SAMPLES)
+        self.metrics = {"admitted": 0, "rejected": 0, "expired": 0, "cancelled": 0,
+                        "completed": 0, "failed": 0, "max_depth": 0}
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.serve()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, session_id: str, message: str, priority: int = NORMAL, timeout: float = None,
+                     on_token: Callable[[str], None] = None) -> str:
+        """
+        Queue a message and wait for the answer.
+
+        timeout is how long it may wait in the queue. on_token, if given, is
+        passed to generate and called from the generating thread.
+        """
+        if self.wakeup is None:
+            raise RuntimeError("RequestScheduler.start() must be awaited before submit()")
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if self.depth >= self.max_queue:
+            self.metrics["rejected"] += 1
+            raise Overloaded(f"Queue full ({self.depth} requests)")
+        if self.queued_per_session.get(session_id, 0) >= self.max_per_session:
+            self.metrics["rejected"] += 1
+            raise Overloaded(f"Session {session_id} already has {self.max_per_session} requests queued")
+
+        loop = asyncio.get_running_loop()
+        timeout = timeout if timeout is not None else self.default_timeout
+        deadline = loop.time() + timeout if timeout is not None else None
+        request = Request(session_id, message, priority, deadline, loop.create_future(), on_token)
+        if deadline is not None:
+            request.timer = loop.call_at(deadline, self.expire, request)
+        self.enqueue(request)
+
+        try:
+            return await request.future
+        except asyncio.CancelledError:
+            # The caller went away, don't spend compute on it
+            if self.remove(request):
+                self.metrics["cancelled"] += 1
+            raise
+
+    def enqueue(self, request: Request):
+        sessions = self.pending[request.priority]
+        if request.session_id not in sessions:
+            sessions[request.session_id] = deque()
+            self.rotation[request.priority].append(request.session_id)
+        sessions[request.session_id].append(request)
+        self.queued_per_session[request.session_id] = self.queued_per_session.get(request.session_id, 0) + 1
+        self.depth += 1
+        self.metrics["admitted"] += 1
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], self.depth)
+        self.wakeup.set()
+
+    def remove(self, request: Request) -> bool:
+        """Take a request out of the queue; False if it already left it."""
+        queue = self.pending[request.priority].get(request.session_id)
+        if queue is None or request not in queue:
+            return False
+        queue.remove(request)
+        if not queue:
+            del self.pending[request.priority][request.session_id]
+            self.rotation[request.priority].remove(request.session_id)
+        self.left_queue(request)
+        return True
+
+    def left_queue(self, request: Request):
+        self.depth -= 1
+        self.queued_per_session[request.session_id] -= 1
+        if not self.queued_per_session[request.session_id]:
+            del self.queued_per_session[request.session_id]
+        if request.timer:
+            request.timer.cancel()
+
+    def expire(self, request: Request):
+        if self.remove(request):
+            self.metrics["expired"] += 1
+            if not request.future.done():
+                request.future.set_exception(DeadlineExceeded("Request waited too long in the queue"))
+
+    def next_request(self):
+        """Highest priority first, then the next session in turn that isn't already running."""
+        for priority in sorted(PRIORITY_NAMES):
+            rotation = self.rotation[priority]
+            for _ in range(len(rotation)):
+                session_id = rotation[0]
+                rotation.rotate(-1)
+                if session_id in self.running_sessions:
+                    continue
+                queue = self.pending[priority][session_id]
+                request = queue.popleft()
+                if not queue:
+                    del self.pending[priority][session_id]
+                    rotation.remove(session_id)
+                self.left_queue(request)
+                return request
+        return None
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request = self.next_request()
+            if request is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            self.running_sessions.add(request.session_id)
+            self.waits.append(time.perf_counter() - request.queued_at)
+            start = time.perf_counter()
+            try:
+                generate = functools.partial(self.generate, request.session_id, request.message)
+                if request.on_token:
+                    generate = functools.partial(generate, on_token=request.on_token)
+                response = await loop.run_in_executor(self.executor, generate)
+                self.metrics["completed"] += 1
+                if not request.future.done():
+                    request.future.set_result(response)
+            except Exception as e:
+                self.metrics["failed"] += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+            finally:
+                self.service_times.append(time.perf_counter() - start)
+                self.running_sessions.discard(request.session_id)
+                # The session may have more requests waiting for this one to finish
+                self.wakeup.set()
+
+    def stats(self) -> dict:
+        waits = list(self.waits)
+        service_times = list(self.service_times)
+        return {
+            **self.metrics,
+            "depth": self.depth,
+            "depth_by_priority": {
+                PRIORITY_NAMES[p]: sum(len(q) for q in self.pending[p].values()) for p in PRIORITY_NAMES
+            },
+            "queued_sessions": len(self.queued_per_session),
+            "running": len(self.running_sessions),
+            "wait_p50": percentile(waits, 0.5),
+            "wait_p95": percentile(waits, 0.95),
+            "service_p50": percentile(service_times, 0.5),
+            "service_p95": percentile(service_times, 0.95),
+        }
@@ -0,0 +1,198 @@
+import glob
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+SPILL_DIR = "session_spill"
+MAX_RESIDENT_SESSIONS = 32
+MAX_RESIDENT_BYTES = 2 * 1024 ** 3  # llama.cpp states hold the KV cache and are tens of MB each
+IDLE_SECONDS = 15 * 60
+IDLE_CHECK_SECONDS = 60  # How often idle sessions are looked for when no messages come in
+
+class SessionManager:
+    """
+    Many chat sessions taking turns on one JackSparrowChat.
+
+    The session being answered lives in the chat object itself. The others are
+    kept in memory, most recently used last, together with the llama.cpp state
+    saved when they were switched out, so switching back skips re-evaluating the
+    prompt. When more than max_resident sessions or max_resident_bytes are in
+    memory, or a session has been idle for idle_seconds, it is pickled to
+    spill_dir and loaded again on its next message. Idle sessions are looked
+    for after every message and every idle_check_seconds, so they leave memory
+    even when no more messages come in. Spilled sessions only
+    live as long as the manager: spill_dir is emptied on start and on close,
+    so a reused session id never picks up another run's history.
+    """
+
+    def __init__(self, chat, spill_dir: str = SPILL_DIR, max_resident: int = MAX_RESIDENT_SESSIONS,
+                 max_resident_bytes: int = MAX_RESIDENT_BYTES, idle_seconds: float = IDLE_SECONDS,
+                 keep_model_state: bool = True, idle_check_seconds: Optional[float] = IDLE_CHECK_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        self.chat_model = chat
+        self.spill_dir = spill_dir
+        self.max_resident = max_resident
+        self.max_resident_bytes = max_resident_bytes
+        self.idle_seconds = idle_seconds
+        self.keep_model_state = keep_model_state
+        self.clock = clock  # Wall clock for idle times
+        self.resident = OrderedDict()  # session id -> {"session", "model_state", "bytes", "used_at"}
+        self.resident_bytes = 0
+        self.current: Optional[str] = None
+        self.lock = threading.Lock()
+        self.metrics = {
+            "resident_hits": 0, "new_sessions": 0, "spills": 0, "restores": 0,
+            "spill_seconds": 0.0, "restore_seconds": 0.0, "bytes_spilled": 0, "bytes_restored": 0,
+            "switch_out_seconds": 0.0,
+        }
+        os.makedirs(spill_dir, exist_ok=True)
+        self.clear_spilled()
+
+        self.stopped = threading.Event()
+        self.idle_check_seconds = idle_check_seconds
+        if idle_check_seconds is not None:
+            threading.Thread(target=self.spill_idle_loop, daemon=True).start()
+
+    def clear_spilled(self):
+        """Delete every spilled session, including half-written ones."""
+        for pattern in ("*.pkl", "*.pkl.tmp"):
+            for path in glob.glob(os.path.join(self.spill_dir, pattern)):
+                os.remove(path)
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.clear_spilled()
+
+    def spill_path(self, session_id: str) -> str:
+        name = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, name + ".pkl")
+
+    def chat(self, session_id: str, message: str, on_token: Callable[[str], None] = None) -> str:
+        """Answer message in session_id, switching the model to that session first."""
+        with self.lock:
+            self.switch_to(session_id)
+            response = self.chat_model.generate_response(message, on_token)
+            self.spill_idle()
+            return response
+
+    def switch_to(self, session_id: str):
+        if session_id == self.current:
+            return
+        if self.current is not None:
+            self.switch_out()
+
+        start = time.perf_counter()
+        entry = self.resident.pop(session_id, None)
+        restored = False
+        if entry is not None:
+            self.resident_bytes -= entry["bytes"]
+            self.metrics["resident_hits"] += 1
+        else:
+            entry = self.restore(session_id)
+            restored = entry is not None
+
+        self.chat_model.import_session(entry["session"] if entry else None)
+        if entry and entry["model_state"] is not None:
+            # The state was computed with the session's adapter, apply it before loading
+            self.chat_model.apply_adapter()
+            self.chat_model.llm.load_state(entry["model_state"])
+        if restored:
+            # Reading, unpickling and loading the state back into llama.cpp
+            self.metrics["restore_seconds"] += time.perf_counter() - start
+        self.current = session_id
+
+    def switch_out(self):
+        """Move the current session from the chat object into the resident tier."""
+        start = time.perf_counter()
+        model_state = self.chat_model.llm.save_state() if self.keep_model_state else None
+        entry = {
+            "session": self.chat_model.export_session(),
+            "model_state": model_state,
+            "used_at": self.clock(),
+        }
+        entry["bytes"] = self.entry_size(entry)
+        self.resident[self.current] = entry
+        self.resident_bytes += entry["bytes"]
+        self.current = None
+        self.metrics["switch_out_seconds"] += time.perf_counter() - start
+
+        while self.resident and (len(self.resident) > self.max_resident
+                                 or self.resident_bytes > self.max_resident_bytes):
+            self.spill(next(iter(self.resident)))
+
+    def entry_size(self, entry: dict) -> int:
+        history = entry["session"]["conversation_history"]
+        size = sum(len(m["content"]) for m in history)
+        if entry["model_state"] is not None:
+            size += entry["model_state"].llama_state_size
+        return size
+
+    def spill(self, session_id: str):
+        start = time.perf_counter()
+        entry = self.resident.pop(session_id)
+        self.resident_bytes -= entry["bytes"]
+        path = self.spill_path(session_id)
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.metrics["spills"] += 1
+        self.metrics["bytes_spilled"] += len(data)
+        self.metrics["spill_seconds"] += time.perf_counter() - start
+
+    def restore(self, session_id: str) -> Optional[dict]:
+        path = self.spill_path(session_id)
+        if not os.path.exists(path):
+            self.metrics["new_sessions"] += 1
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.remove(path)
+        self.metrics["restores"] += 1
+        self.metrics["bytes_restored"] += len(data)
+        return pickle.loads(data)
+
+    def spill_idle(self):
+        """Spill sessions not used for idle_seconds, oldest first."""
+        cutoff = self.clock() - self.idle_seconds
+        while self.resident:
+            session_id, entry = next(iter(self.resident.items()))
+            if entry["used_at"] > cutoff:
+                break
+            self.spill(session_id)
+
+    def spill_idle_loop(self):
+        while not self.stopped.wait(self.idle_check_seconds):
+            with self.lock:
+                self.spill_idle()
+
+    def forget(self, session_id: str):
+        """Drop a session from memory and disk."""
+        with self.lock:
+            if session_id == self.current:
+                self.chat_model.reset()
+                self.current = None
+            entry = self.resident.pop(session_id, None)
+            if entry is not None:
+                self.resident_bytes -= entry["bytes"]
+            path = self.spill_path(session_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self) -> dict:
+        spills = self.metrics["spills"]
+        restores = self.metrics["restores"]
+        return {
+            **self.metrics,
+            "resident_sessions": len(self.resident) + (self.current is not None),
+            "resident_bytes": self.resident_bytes,
+            "spilled_sessions": len(glob.glob(os.path.join(self.spill_dir, "*.pkl"))),
+            "average_spill_seconds": self.metrics["spill_seconds"] / spills if spills else 0.0,
+            "average_restore_seconds": self.metrics["restore_seconds"] / restores if restores else 0.0,
+        }
@@ -0,0 +1,163 @@
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_by_update ON sessions (updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS model_states (
+    session_id TEXT PRIMARY KEY,
+    history_length INTEGER NOT NULL,
+    state BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+class SessionStore:
+    """
+    Append-only chat session storage in SQLite (WAL mode).
+
+    Writes are queued and committed in batches by a background thread, so the
+    UI thread never waits on disk. Reads use their own connection, which WAL
+    lets run alongside the writer, after waiting for the queued writes so they
+    see them; call them off the UI thread. Listing sessions and loading a
+    session go through indexes and stay fast however many messages are stored.
+    """
+
+    def __init__(self, path: str = "chat_sessions.db"):
+        self.path = path
+        self.writes = queue.Queue()
+        # Next sequence number per session, so appends need no read-back
+        self.next_seq: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+        self.reader = self.connect()
+        self.reader.executescript(SCHEMA)
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def write_loop(self):
+        connection = self.connect()
+        while True:
+            batch = [self.writes.get()]
+            # Everything queued meanwhile goes into the same transaction
+            while True:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is None for item in batch)
+            try:
+                with connection:
+                    for item in batch:
+                        if item is not None:
+                            connection.execute(*item)
+            except sqlite3.Error as e:
+                print(f"Error saving chat session: {e}")
+            for _ in batch:
+                self.writes.task_done()
+            if stop:
+                connection.close()
+                return
+
+    def create_session(self, title: str) -> str:
+        """Start a new session and return its id."""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.next_seq[session_id] = 0
+        self.writes.put((
+            "INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, title[:80], now, now),
+        ))
+        return session_id
+
+    def append_message(self, session_id: str, role: str, content: str):
+        """Queue a message for the end of a session."""
+        now = time.time()
+        with self.lock:
+            if session_id not in self.next_seq:
+                self.next_seq[session_id] = self.message_count(session_id)
+            seq = self.next_seq[session_id]
+            self.next_seq[session_id] = seq + 1
+        self.writes.put((
+            "INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, seq, role, content, now),
+        ))
+        self.writes.put((
+            "UPDATE sessions SET updated_at = ?, message_count = ? WHERE id = ?",
+            (now, seq + 1, session_id),
+        ))
+
+    def save_model_state(self, session_id: str, history_length: int, state):
+        """Queue a llama.cpp state saved after history_length messages of the session."""
+        self.writes.put((
+            "INSERT OR REPLACE INTO model_states (session_id, history_length, state, created_at) VALUES (?, ?, ?, ?)",
+            (session_id, history_length, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+        ))
+
+    def message_count(self, session_id: str) -> int:
+        self.flush()
+        row = self.reader.execute("SELECT message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def list_sessions(self, limit: int = 50) -> List[Dict]:
+        """Most recently updated sessions first."""
+        self.flush()
+        rows = self.reader.execute(
+            "SELECT id, title, created_at, updated_at, message_count FROM sessions "
+            "ORDER BY updated_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [
+            {"id": r[0], "title": r[1], "created_at": r[2], "updated_at": r[3], "message_count": r[4]}
+            for r in rows
+        ]
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        self.flush()
+        rows = self.reader.execute(
+            "SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        return [{"role": r[0], "content": r[1], "created_at": r[2]} for r in rows]
+
+    def load_model_state(self, session_id: str):
+        """Return (history_length, state) or None if no state was saved."""
+        self.flush()
+        row = self.reader.execute(
+            "SELECT history_length, state FROM model_states WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return (row[0], pickle.loads(row[1])) if row else None
+
+    def flush(self):
+        """Wait until every queued write is committed."""
+        self.writes.join()
+
+    def close(self):
+        self.writes.put(None)
+        self.writer.join()
+        self.reader.close()
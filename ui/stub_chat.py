@@ -0,0 +1,71 @@
+import time
+from typing import Callable, Dict, List
+
+STUB_WORDS = ("Aye", " savvy,", " mate.", " The", " rum", " is", " gone,", " but", " the", " Pearl", " remains.")
+
+class StubChat:
+    """
+    Stand-in for JackSparrowChat that needs no model.
+
+    It answers with a fixed number of tokens at a fixed rate after a delay
+    proportional to the prompt length, blocking like the real model does, so
+    the scheduler, session manager, server and load test can be exercised on
+    any machine.
+    """
+
+    def __init__(self, tokens_per_second: float = 20.0, prompt_tokens_per_second: float = 200.0,
+                 response_tokens: int = 40):
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.response_tokens = response_tokens
+        self.llm = None
+        self.adapter = None
+        self.conversation_history: List[Dict] = []
+        self.history_start = 0
+        self.last_response = ""
+
+    def initialize_model(self) -> bool:
+        return True
+
+    def generate_response(self, user_input: str, on_token: Callable[[str], None] = None) -> str:
+        # Roughly four characters per token, like the dataset tools assume
+        prompt_chars = sum(len(m["content"]) for m in self.conversation_history) + len(user_input)
+        time.sleep(prompt_chars / 4 / self.prompt_tokens_per_second)
+
+        pieces = []
+        for i in range(self.response_tokens):
+            time.sleep(1 / self.tokens_per_second)
+            piece = STUB_WORDS[i % len(STUB_WORDS)]
+            pieces.append(piece)
+            if on_token:
+                on_token(piece)
+        response = "".join(pieces)
+
+        self.conversation_history.append({"role": "user", "content": user_input})
+        self.conversation_history.append({"role": "assistant", "content": response})
+        self.last_response = response
+        return response
+
+    def apply_adapter(self):
+        pass
+
+    def reset(self):
+        self.conversation_history = []
+        self.history_start = 0
+        self.last_response = ""
+
+    def export_session(self) -> dict:
+        return {
+            "conversation_history": self.conversation_history,
+            "history_start": self.history_start,
+            "last_response": self.last_response,
+            "adapter": self.adapter,
+        }
+
+    def import_session(self, session: dict = None):
+        self.reset()
+        if session:
+            self.conversation_history = session["conversation_history"]
+            self.history_start = session["history_start"]
+            self.last_response = session["last_response"]
+            self.adapter = session["adapter"]
@@ -0,0 +1,289 @@
+import glob
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+from model_files import MODEL_REPO, MODEL_FILE, resolve_model_path, verify_model_file, warm_up_file
+from session_manager import SPILL_DIR, SessionManager
+
+LIVENESS_INTERVAL = 0.5  # Seconds between checks that the workers are still running
+START_TIMEOUT = 600.0  # Seconds the workers get to load the model
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Parse a kernel CPU list such as "0-3,8-11"."""
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+def numa_nodes() -> List[List[int]]:
+    """CPUs this process may use, grouped by NUMA node (one group when there is no NUMA info)."""
+    if hasattr(os, "sched_getaffinity"):
+        allowed = set(os.sched_getaffinity(0))
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node*/cpulist")):
+        with open(path, 'r', encoding='utf-8') as f:
+            cpus = [cpu for cpu in parse_cpu_list(f.read()) if cpu in allowed]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+def plan_cpu_sets(num_workers: int) -> List[List[int]]:
+    """
+    Give each worker its own slice of cores.
+
+    Workers are spread round-robin over NUMA nodes and the cores of a node are
+    split evenly between the workers placed on it, so no two workers compete
+    for a core and each one stays on a single node.
+    """
+    nodes = numa_nodes()
+    per_node = [[] for _ in nodes]
+    for worker in range(num_workers):
+        per_node[worker % len(nodes)].append(worker)
+
+    cpu_sets = [None] * num_workers
+    for cpus, workers in zip(nodes, per_node):
+        for i, worker in enumerate(workers):
+            share = cpus[i * len(cpus) // len(workers):(i + 1) * len(cpus) // len(workers)]
+            cpu_sets[worker] = share or cpus  # More workers than cores: share the node
+    return cpu_sets
+
+def worker_main(worker_id: int, model_path: str, cpus: List[int], requests, results):
+    """Worker process: one llama.cpp context pinned to cpus, serving many sessions in turn."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    from chat_model import JackSparrowChat
+
+    # The parent already verified and warmed up the file, the mmap shares its page cache
+    chat = JackSparrowChat(model_path=model_path, n_threads=len(cpus), verify=False, warm_up=False)
+    if not chat.initialize_model():
+        results.put((worker_id, None, "error", "Model failed to load"))
+        return
+    results.put((worker_id, None, "ready", None))
+
+    sessions = SessionManager(chat, spill_dir=os.path.join(SPILL_DIR, f"worker{worker_id}"))
+    while True:
+        request = requests.get()
+        if request is None:
+            sessions.close()
+            break
+        request_id, session_id, message = request
+        if message is None:
+            # The session ended, forget its history
+            sessions.forget(session_id)
+            continue
+        start = time.perf_counter()
+        response = sessions.chat(session_id, message)
+        results.put((worker_id, request_id, "done", {
+            "response": response,
+            "seconds": time.perf_counter() - start,
+            "worker": worker_id,
+            "sessions": sessions.stats(),
+        }))
+
+class WorkerPool:
+    """
+    Several llama.cpp processes over one memory-mapped GGUF file.
+
+    Each worker is pinned to its own cores (see plan_cpu_sets) and keeps the
+    sessions routed to it in a SessionManager. The dispatcher sends every message
+    of a session to the same worker, so its history and cached prompt stay
+    there; new sessions go to the worker with the fewest requests in flight.
+
+    A worker that dies while serving fails its pending requests and is
+    restarted, its sessions start over on whichever worker they are routed to
+    next. A worker that fails to load the model fails the whole pool.
+    """
+
+    def __init__(self, num_workers: int = None, model_path: str = None, repo_id: str = MODEL_REPO,
+                 model_file: str = MODEL_FILE, verify: bool = True, start_timeout: float = START_TIMEOUT):
+        num_workers = num_workers or max(1, len(numa_nodes()[0]) // 4)
+        self.model_path = resolve_model_path(model_path, repo_id, model_file)
+        if verify and not verify_model_file(self.model_path):
+            raise RuntimeError(f"Model file failed verification: {self.model_path}")
+        # Read the file once here so all workers map pages that are already cached
+        warm_up_file(self.model_path).join()
+
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.cpu_sets = plan_cpu_sets(num_workers)
+        self.requests = [None] * num_workers
+        self.processes = [None] * num_workers
+        self.loaded = [False] * num_workers  # Whether each worker's current process has loaded the model
+        self.closing = False
+        for i in range(num_workers):
+            self.start_worker(i)
+
+        self.lock = threading.Lock()
+        self.futures: Dict[int, Tuple[int, Future]] = {}  # request id -> (worker, future)
+        self.next_request_id = 0
+        self.affinity: Dict[str, int] = {}  # session id -> worker
+        self.in_flight = [0] * num_workers
+        self.session_counts = [0] * num_workers
+        self.worker_sessions = [{} for _ in range(num_workers)]  # Latest SessionManager stats per worker
+        self.ready = threading.Event()
+        self.metrics = {
+            "requests": 0, "affinity_hits": 0, "new_sessions": 0,
+            "busy_seconds": [0.0] * num_workers, "completed": [0] * num_workers,
+        }
+
+        self.error = None
+        self.collector = threading.Thread(target=self.collect_results, daemon=True)
+        self.collector.start()
+        if not self.ready.wait(start_timeout):
+            self.error = f"Workers not ready after {start_timeout:.0f} s"
+        if self.error:
+            self.close()
+            raise RuntimeError(self.error)
+        for i, cpus in enumerate(self.cpu_sets):
+            print(f"Worker {i} ready on CPUs {cpus}")
+
+    def start_worker(self, worker_id: int):
+        """Start a worker process with a fresh request queue."""
+        self.requests[worker_id] = self.context.Queue()
+        self.loaded[worker_id] = False
+        self.processes[worker_id] = self.context.Process(
+            target=worker_main,
+            args=(worker_id, self.model_path, self.cpu_sets[worker_id], self.requests[worker_id], self.results),
+            daemon=True,
+        )
+        self.processes[worker_id].start()
+
+    def collect_results(self):
+        """Resolve futures as workers answer and watch that they stay alive; runs on a background thread."""
+        while True:
+            try:
+                item = self.results.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            if item is None:
+                break
+            worker_id, request_id, kind, payload = item
+            if kind == "ready":
+                self.loaded[worker_id] = True
+                if all(self.loaded):
+                    self.ready.set()
+            elif kind == "error":
+                self.fail(f"Worker {worker_id}: {payload}")
+            else:
+                with self.lock:
+                    entry = self.futures.pop(request_id, None)
+                    if entry is None:
+                        continue  # Already failed when the worker was presumed dead
+                    self.in_flight[worker_id] -= 1
+                    self.metrics["busy_seconds"][worker_id] += payload["seconds"]
+                    self.metrics["completed"][worker_id] += 1
+                    self.worker_sessions[worker_id] = payload.pop("sessions")
+                entry[1].set_result(payload)
+
+    def check_workers(self):
+        """Restart workers that died while serving, fail the pool if one died while loading."""
+        if self.closing or self.error:
+            return
+        for worker_id, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            message = f"Worker {worker_id} exited with code {process.exitcode}"
+            if not self.loaded[worker_id]:
+                # Loading again would most likely fail the same way
+                self.fail(message)
+                return
+            print(f"{message}, restarting it")
+            with self.lock:
+                failed = self.take_futures(worker_id)
+                # Its sessions' history died with it, they start over on their next message
+                for session_id in [s for s, w in self.affinity.items() if w == worker_id]:
+                    del self.affinity[session_id]
+                self.session_counts[worker_id] = 0
+                self.worker_sessions[worker_id] = {}
+                self.start_worker(worker_id)
+            for future in failed:
+                future.set_exception(RuntimeError(message))
+
+    def take_futures(self, worker_id: int = None) -> List[Future]:
+        """Remove the pending requests of one worker, or of all of them, and return their futures."""
+        request_ids = [r for r, (w, _) in self.futures.items() if worker_id is None or w == worker_id]
+        for i in range(len(self.in_flight)) if worker_id is None else [worker_id]:
+            self.in_flight[i] = 0
+        return [self.futures.pop(r)[1] for r in request_ids]
+
+    def fail(self, message: str):
+        """Put the pool out of service: pending and later requests fail with message."""
+        with self.lock:
+            self.error = message
+            failed = self.take_futures()
+        self.ready.set()
+        for future in failed:
+            future.set_exception(RuntimeError(message))
+
+    def worker_for(self, session_id: str) -> int:
+        """Sticky routing: known sessions keep their worker, new ones go to the least busy."""
+        worker = self.affinity.get(session_id)
+        if worker is not None:
+            self.metrics["affinity_hits"] += 1
+            return worker
+        # Ties go to the worker holding the fewest sessions, so their history is spread out
+        worker = min(range(len(self.processes)), key=lambda i: (self.in_flight[i], self.session_counts[i], i))
+        self.affinity[session_id] = worker
+        self.session_counts[worker] += 1
+        self.metrics["new_sessions"] += 1
+        return worker
+
+    def submit(self, session_id: str, message: str) -> Future:
+        """Queue a message; the future resolves to {"response", "seconds", "worker"}."""
+        future = Future()
+        with self.lock:
+            if self.error:
+                raise RuntimeError(self.error)
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            worker = self.worker_for(session_id)
+            self.futures[request_id] = (worker, future)
+            self.in_flight[worker] += 1
+            self.metrics["requests"] += 1
+            # Under the lock, so a restart can't swap the queue in between
+            self.requests[worker].put((request_id, session_id, message))
+        return future
+
+    def chat(self, session_id: str, message: str) -> str:
+        return self.submit(session_id, message).result()["response"]
+
+    def forget_session(self, session_id: str):
+        """End a session: drop its routing entry and its history on the worker."""
+        with self.lock:
+            worker = self.affinity.pop(session_id, None)
+            if worker is not None:
+                self.session_counts[worker] -= 1
+                self.requests[worker].put((None, session_id, None))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                **self.metrics,
+                "sessions": len(self.affinity),
+                "in_flight": list(self.in_flight),
+                "worker_sessions": list(self.worker_sessions),
+                "cpu_sets": self.cpu_sets,
+            }
+
+    def close(self):
+        self.closing = True
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.collector.join(timeout=10)